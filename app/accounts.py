@@ -0,0 +1,181 @@
+"""Doctor login: normalized usernames and a TTL cache of identity records.
+
+A doctor logs in as first + last name without spaces ('JohnDoe'). The
+comparison is case-insensitive. Migration 11 stores that login, normalized,
+in ``doctors.username`` under a unique index, so a login is one index lookup
+instead of a scan comparing ``f_name || l_name``. Same-name doctors get the
+lowest free number from 2 up appended ('johndoe2'): ``admin.add_doctor`` uses
+``unique_username``, ``backfill`` numbers existing rows the same way, and the
+insert trigger does it for any other insert that leaves the username out
+(``import_data`` keeps a username given in the file).
+
+``IDENTITIES`` caches the (doctor_id, names, password) record per username for
+LOGIN_CACHE_TTL seconds, unknown usernames included, so a burst of logins at
+shift change touches SQLite once per doctor. The whole cache is dropped when
+the doctors table changes: routes call ``invalidate()``, and other processes'
+changes are seen through the ``cache_versions`` counter (refcache), checked at
+most every refcache.CHECK_INTERVAL seconds.
+"""
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import refcache
+
+LOGIN_CACHE_TTL = float(os.environ.get('HMS_LOGIN_CACHE_TTL', 60))
+LOGIN_CACHE_SIZE = 1024
+
+# SQL lower() only folds ASCII; fold the same way here so both sides agree
+_ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+SCHEMA = """
+CREATE UNIQUE INDEX IF NOT EXISTS ux_doctors_username ON doctors(username);
+"""
+
+# inserts that do not set a username (generate_data, ad-hoc SQL) get the same
+# name unique_username would give: the base if free, else the lowest free
+# base || n with n >= 2. That n is 2 or one more than a taken suffix, so only
+# the names starting with base and a digit (an index range) are looked at.
+USERNAME_TRIGGER = """
+DROP TRIGGER IF EXISTS trg_doctors_username;
+CREATE TRIGGER trg_doctors_username AFTER INSERT ON doctors
+WHEN NEW.username IS NULL
+BEGIN
+    UPDATE doctors
+    SET username = (
+        SELECT CASE WHEN NOT EXISTS (SELECT 1 FROM doctors WHERE username = b.base) THEN b.base
+               ELSE b.base || (
+                   SELECT min(c.n) FROM (
+                       SELECT 2 AS n
+                       UNION ALL
+                       SELECT CAST(substr(username, length(b.base) + 1) AS INTEGER) + 1
+                       FROM doctors WHERE username >= b.base || '0' AND username < b.base || ':'
+                   ) c
+                   WHERE c.n >= 2 AND NOT EXISTS (SELECT 1 FROM doctors WHERE username = b.base || c.n))
+               END
+        FROM (SELECT lower(replace(NEW.f_name || NEW.l_name, ' ', '')) AS base) b)
+    WHERE doctor_id = NEW.doctor_id;
+END;
+"""
+
+
+def normalize_username(value):
+    """'John Doe ' / 'JohnDoe' -> 'johndoe' (same as the trigger's SQL)."""
+    return (value or '').strip().replace(' ', '').translate(_ASCII_LOWER)
+
+
+def username_for(f_name, l_name):
+    return normalize_username(f'{f_name or ""}{l_name or ""}')
+
+
+def unique_username(conn, f_name, l_name, taken=None):
+    """The default username for a new doctor, suffixed with a number if it is taken.
+
+    ``taken`` is an optional set of names already handed out but not yet inserted.
+    """
+    base = username_for(f_name, l_name)
+    candidate, n = base, 1
+    while (taken is not None and candidate in taken) or conn.execute(
+            'SELECT 1 FROM doctors WHERE username = ?', (candidate,)).fetchone():
+        n += 1
+        candidate = f'{base}{n}'
+    return candidate
+
+
+def backfill(conn):
+    """Give every doctor without a username one, lowest doctor_id first; caller commits."""
+    taken = {row[0] for row in conn.execute('SELECT username FROM doctors WHERE username IS NOT NULL')}
+    rows = conn.execute('SELECT doctor_id, f_name, l_name FROM doctors WHERE username IS NULL ORDER BY doctor_id').fetchall()
+    updates = []
+    for doctor_id, f_name, l_name in rows:
+        name = unique_username(conn, f_name, l_name, taken)
+        taken.add(name)
+        updates.append((name, doctor_id))
+    conn.executemany('UPDATE doctors SET username = ? WHERE doctor_id = ?', updates)
+    return len(updates)
+
+
+class IdentityCache:
+    """username -> identity record (or None), each entry kept for ``ttl`` seconds."""
+
+    def __init__(self, ttl=LOGIN_CACHE_TTL, max_size=LOGIN_CACHE_SIZE, check_interval=refcache.CHECK_INTERVAL):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self._checked = 0.0
+        # bumped on every clear, so a lookup that raced one is not stored
+        self._generation = 0
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'invalidations': 0}
+
+    def _check_version(self, conn, now):
+        if now - self._checked < self.check_interval:
+            return
+        version = refcache.read_version(conn, 'doctors')
+        with self._lock:
+            if version is None or version != self._version:
+                self._entries.clear()
+                self._generation += 1
+                self._version = version
+            self._checked = now
+
+    def get(self, conn, username):
+        key = normalize_username(username)
+        now = time.monotonic()
+        self._check_version(conn, now)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry[1]
+                self._stats['expired'] += 1
+            self._stats['misses'] += 1
+            generation = self._generation
+        # ux_doctors_username
+        row = conn.execute('SELECT doctor_id, f_name, l_name, password FROM doctors WHERE username = ?',
+                           (key,)).fetchone()
+        record = dict(row) if row else None
+        with self._lock:
+            if generation != self._generation:
+                return record
+            self._entries[key] = (now + self.ttl, record)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return record
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._version = None
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['size'] = len(self._entries)
+        return out
+
+
+IDENTITIES = IdentityCache()
+
+
+def authenticate(conn, username, password):
+    """The doctor's identity record if the credentials match, else None."""
+    record = IDENTITIES.get(conn, username)
+    if record is None or record['password'] is None:
+        return None
+    if not hmac.compare_digest(record['password'].encode(), (password or '').encode()):
+        return None
+    return record
+
+
+def invalidate():
+    IDENTITIES.invalidate()
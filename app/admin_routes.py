@@ -1,22 +1,23 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-import sqlite3
-import os
+from datetime import date, datetime
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+from db import get_db, pool_stats
+import sql_metrics
+from writer import get_writer, run_write, WriteTimeout
+from pagination import paginate, paginate_rows, page_size
+import refcache
+import search
+import stats as stats_counters
+import accounts
+import archive
+import assign
+import rollups
+import scheduling
+import timeline
+from scheduling import normalize_appointment_datetime
 
 admin_bp = Blueprint('admin', __name__)
 
-# Use a path relative to this file so the app always finds the right DB
-DATABASE = os.path.join(os.path.dirname(__file__), 'hospital_management.db')
-
-def get_db_connection():
-    # increase timeout and allow connections from different threads (dev server may use threads)
-    conn = sqlite3.connect(DATABASE, timeout=30, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    # ensure foreign keys are enabled on this connection
-    try:
-        conn.execute('PRAGMA foreign_keys = ON;')
-    except Exception:
-        pass
-    return conn
 
 # --------------------------
 # Admin Login / Logout
@@ -53,17 +54,99 @@ def dashboard():
     if 'admin' not in session:
         return redirect(url_for('admin.login'))  # <- added blueprint prefix
 
-    conn = get_db_connection()
-    stats = {
-        'patients': conn.execute('SELECT COUNT(*) FROM patients').fetchone()[0],
-        'doctors': conn.execute("SELECT COUNT(*) FROM doctors").fetchone()[0],
-        'rooms': conn.execute('SELECT COUNT(*) FROM rooms').fetchone()[0],
-        'bills': conn.execute('SELECT COUNT(*) FROM bills').fetchone()[0],
-    }
+    conn = get_db()
+    # single-row read of the trigger-maintained counters (see stats.py)
+    stats = stats_counters.read(conn)
     conn.close()
     return render_template('dashboard.html', stats=stats)  # <- corrected template name
 
 
+# --------------------------
+# Reports (daily rollups, see rollups.py)
+# --------------------------
+def _month_bounds(value):
+    # 'YYYY-MM' -> (first day, first day of next month); bad input -> this month
+    try:
+        first = date.fromisoformat(f'{value}-01')
+    except (TypeError, ValueError):
+        first = date.today().replace(day=1)
+    following = date(first.year + first.month // 12, first.month % 12 + 1, 1)
+    previous = date(first.year - (first.month == 1), (first.month - 2) % 12 + 1, 1)
+    return first, following, previous
+
+
+@admin_bp.route('/reports')
+def reports():
+    if 'admin' not in session:
+        return redirect(url_for('admin.login'))
+    first, following, previous = _month_bounds(request.args.get('month'))
+    conn = get_db()
+    # reads only the rollup tables: a month is a few hundred rows however long the history
+    report = rollups.month_report(conn, first.isoformat(), following.isoformat())
+    workload = {}
+    for r in report['appointments']:
+        workload.setdefault(r['doctor_id'], dict.fromkeys(rollups.APPOINTMENT_STATUSES, 0))[r['status']] = r['appointments']
+    for r in report['treatments']:
+        workload.setdefault(r['doctor_id'], dict.fromkeys(rollups.APPOINTMENT_STATUSES, 0))
+    doctors = {}
+    for doctor_id in workload:
+        d = refcache.get_doctor(conn, doctor_id)
+        doctors[doctor_id] = f"{d['f_name']} {d['l_name']}" if d else ('Unassigned' if not doctor_id else f'#{doctor_id}')
+    state = rollups.state(conn)
+    pending = rollups.pending(conn)
+    conn.close()
+    treatments = {r['doctor_id']: r for r in report['treatments']}
+    return render_template('admin_reports.html', report=report, workload=workload, doctors=doctors,
+                           treatments=treatments, statuses=rollups.APPOINTMENT_STATUSES,
+                           month=first.strftime('%Y-%m'), month_label=first.strftime('%B %Y'),
+                           previous=previous.strftime('%Y-%m'), following=following.strftime('%Y-%m'),
+                           state=state, pending=pending)
+
+
+@admin_bp.route('/reports/refresh', methods=['POST'])
+def refresh_reports():
+    if 'admin' not in session:
+        return redirect(url_for('admin.login'))
+    # one writer unit per step, so bookings are not held up behind a long catch-up
+    steps = 0
+    try:
+        while any(run_write(rollups.refresh_step).values()):
+            steps += 1
+    except WriteTimeout as e:
+        # completed steps are committed; the current one may be too. Refreshing
+        # again carries on from the stored high-water marks either way.
+        flash(f'Reports partly refreshed ({steps} step(s)). {e}', 'danger')
+        return redirect(url_for('admin.reports', month=request.form.get('month')))
+    flash(f'Reports refreshed ({steps} step(s)).', 'success')
+    return redirect(url_for('admin.reports', month=request.form.get('month')))
+
+
+# --------------------------
+# SQL metrics (JSON)
+# --------------------------
+@admin_bp.route('/metrics', methods=['GET', 'POST'])
+def metrics():
+    if 'admin' not in session:
+        return redirect(url_for('admin.login'))
+    collector = sql_metrics.get_metrics()
+    writer = get_writer()
+    if collector is None:
+        data = {'enabled': False}
+    else:
+        # POST resets the histograms (e.g. before a load test)
+        if request.method == 'POST':
+            collector.reset()
+        data = collector.snapshot()
+        data['enabled'] = True
+    data['pool'] = pool_stats()
+    data['writer'] = writer.stats() if writer is not None else None
+    data['schedule'] = scheduling.SCHEDULE.stats()
+    data['login_cache'] = accounts.IDENTITIES.stats()
+    data['refcache'] = refcache.cache_stats()
+    data['timeline'] = timeline.TIMELINE.stats()
+    return jsonify(data)
+
+
 # --------------------------
 # Patients Management
 # --------------------------
@@ -71,16 +154,25 @@ def dashboard():
 def patients():
     if 'admin' not in session:
         return redirect(url_for('admin.login'))  # <- added blueprint prefix
-    conn = get_db_connection()
-    patients = conn.execute('''
-        SELECT p.*, d.f_name || ' ' || d.l_name AS doctor_name
-        FROM patients p
-        LEFT JOIN doctors d ON d.doctor_id = p.doctor
-        ORDER BY p.id DESC
-    ''').fetchall()
-    doctors = conn.execute('SELECT doctor_id, f_name, l_name FROM doctors').fetchall()
+    conn = get_db()
+    q = request.args.get('q', '').strip()
+    if q:
+        # search box: best FTS matches on name / phone / address, no paging
+        page = None
+        rows = search.search_patients(conn, q, limit=page_size())
+    else:
+        page = paginate(conn, '''
+            SELECT p.*, d.f_name || ' ' || d.l_name AS doctor_name
+            FROM patients p
+            LEFT JOIN doctors d ON d.doctor_id = p.doctor
+            WHERE {keyset}
+            ORDER BY {order}
+            LIMIT ?
+        ''', keys=(('p.id', 'id'),))
+        rows = page.rows
+    doctors = refcache.doctor_choices(conn)
     conn.close()
-    return render_template('add_patient.html', patients=patients, doctors=doctors)
+    return render_template('add_patient.html', patients=rows, page=page, doctors=doctors, q=q)
 
 
 @admin_bp.route('/patients/add', methods=['GET', 'POST'])
@@ -94,7 +186,7 @@ def add_patient():
         address = request.form['address']
         doctor = request.form.get('doctor') or None
 
-        conn = get_db_connection()
+        conn = get_db()
         conn.execute(
             'INSERT INTO patients (first_name, last_name, phone, address, doctor) VALUES (?, ?, ?, ?, ?)',
             (first, last, phone, address, doctor)
@@ -105,8 +197,8 @@ def add_patient():
         return redirect(url_for('admin.patients'))  # <- added blueprint prefix
 
     # GET: provide list of doctors for the select
-    conn = get_db_connection()
-    doctors = conn.execute('SELECT doctor_id, f_name, l_name FROM doctors').fetchall()
+    conn = get_db()
+    doctors = refcache.doctor_choices(conn)
     conn.close()
     return render_template('add_patients.html', doctors=doctors)
 
@@ -115,10 +207,12 @@ def add_patient():
 def delete_patient(pid):
     if 'admin' not in session:
         return redirect(url_for('admin.login'))  # <- added blueprint prefix
-    conn = get_db_connection()
+    # deletes are plain links (GET), so ask for the read/write connection
+    conn = get_db(readonly=False)
     conn.execute('DELETE FROM patients WHERE id = ?', (pid,))
     conn.commit()
     conn.close()
+    timeline.invalidate(pid)
     flash('Patient deleted successfully!', 'info')
     return redirect(url_for('admin.patients'))  # <- added blueprint prefix
 
@@ -130,16 +224,20 @@ def delete_patient(pid):
 def bills():
     if 'admin' not in session:
         return redirect(url_for('admin.login'))  # <- added blueprint prefix
-    conn = get_db_connection()
-    bills = conn.execute('''
+    # ?archived=1 also lists paid bills moved to the archive (see archive.py)
+    show_archived = request.args.get('archived') == '1'
+    conn = get_db()
+    page = paginate(conn, '''
         SELECT b.id, p.first_name || " " || p.last_name AS patient_name,
                b.total_amount, b.paid, b.created_at
-        FROM bills b
+        FROM %s b
         JOIN patients p ON p.id = b.patient_id
-        ORDER BY b.created_at DESC
-    ''').fetchall()
+        WHERE {keyset}
+        ORDER BY {order}
+        LIMIT ?
+    ''' % archive.bills_source(show_archived), keys=(('b.created_at', 'created_at'), ('b.id', 'id')))
     conn.close()
-    return render_template('bills.html', bills=bills)
+    return render_template('bills.html', bills=page.rows, page=page, show_archived=show_archived)
 
 
 # --------------------------
@@ -149,10 +247,11 @@ def bills():
 def doctors():
     if 'admin' not in session:
         return redirect(url_for('admin.login'))
-    conn = get_db_connection()
-    doctors = conn.execute("SELECT * FROM doctors ORDER BY created_at DESC").fetchall()
+    conn = get_db()
+    # doctors change rarely: page through the cached table (see refcache.py)
+    page = paginate_rows(refcache.doctors(conn), keys=('created_at', 'doctor_id'))
     conn.close()
-    return render_template('doctors.html', doctors=doctors)
+    return render_template('doctors.html', doctors=page.rows, page=page)
 
 
 @admin_bp.route('/doctors/add', methods=['GET', 'POST'])
@@ -168,14 +267,23 @@ def add_doctor():
         availability = request.form.get('availability')
 
         password = request.form.get('password')
-        conn = get_db_connection()
+        conn = get_db()
+        # login name: as typed (normalized), else FirstNameLastName made unique
+        username = accounts.normalize_username(request.form.get('username'))
+        if username and conn.execute('SELECT 1 FROM doctors WHERE username = ?', (username,)).fetchone():
+            conn.close()
+            flash(f'Username {username} is already taken.', 'danger')
+            return render_template('add_doctors.html', form=request.form)
+        username = username or accounts.unique_username(conn, f_name, l_name)
         conn.execute(
-            "INSERT INTO doctors (f_name, l_name, specialization, contact, department, availability, password) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (f_name, l_name, specialization, contact, department, availability, password)
+            "INSERT INTO doctors (f_name, l_name, specialization, contact, department, availability, password, username) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (f_name, l_name, specialization, contact, department, availability, password, username)
         )
         conn.commit()
         conn.close()
-        flash('Doctor added successfully!', 'success')
+        refcache.invalidate('doctors')
+        accounts.invalidate()
+        flash(f'Doctor added successfully! Login username: {username}', 'success')
         return redirect(url_for('admin.doctors'))
     
     return render_template('add_doctors.html')
@@ -185,10 +293,13 @@ def add_doctor():
 def delete_doctor(did):
     if 'admin' not in session:
         return redirect(url_for('admin.login'))
-    conn = get_db_connection()
+    # deletes are plain links (GET), so ask for the read/write connection
+    conn = get_db(readonly=False)
     conn.execute("DELETE FROM doctors WHERE doctor_id = ?", (did,))
     conn.commit()
     conn.close()
+    refcache.invalidate('doctors')
+    accounts.invalidate()
     flash('Doctor deleted successfully!', 'info')
     return redirect(url_for('admin.doctors'))
 
@@ -200,14 +311,16 @@ def update_patient(pid):
     if 'admin' not in session:
         return redirect(url_for('admin.login'))
 
-    conn = get_db_connection()
+    # ?archived=1 adds archived (read-only) appointments, see archive.py
+    show_archived = request.args.get('archived') == '1'
+    conn = get_db()
     patient = conn.execute('SELECT * FROM patients WHERE id = ?', (pid,)).fetchone()
-    doctors = conn.execute('SELECT doctor_id, f_name, l_name FROM doctors').fetchall()
+    doctors = refcache.doctor_choices(conn)
     # fetch appointments for this patient so admin can edit time/status
     # include doctor info (if assigned) so template can show current assigned doctor name
-    appointments = conn.execute('''
+    appointments = conn.execute(f'''
         SELECT a.*, d.doctor_id AS assigned_doctor_id, d.f_name || ' ' || d.l_name AS doctor_name
-        FROM appointments a
+        FROM {archive.appointments_source(show_archived)} a
         LEFT JOIN doctors d ON d.doctor_id = a.doctor_id
         WHERE a.patient_id = ?
         ORDER BY a.appointment_datetime DESC
@@ -240,7 +353,7 @@ def update_patient(pid):
         # resolve doctor name for flash
         doc_name = None
         if doctor:
-            row = conn.execute('SELECT f_name, l_name FROM doctors WHERE doctor_id = ?', (doctor,)).fetchone()
+            row = refcache.get_doctor(conn, doctor)
             if row:
                 doc_name = f"Dr. {row['f_name']} {row['l_name']}"
         conn.close()
@@ -251,7 +364,8 @@ def update_patient(pid):
         return redirect(url_for('admin.patients'))
 
     conn.close()
-    return render_template('update_patient.html', patient=patient, doctors=doctors, appointments=appointments)
+    return render_template('update_patient.html', patient=patient, doctors=doctors, appointments=appointments,
+                           show_archived=show_archived)
 
 
 @admin_bp.route('/appointments/update/<int:aid>', methods=['POST'])
@@ -274,29 +388,32 @@ def update_appointment(aid):
         except Exception:
             doctor_id = doctor_raw
 
-    # combine date and time if provided
-    appt_dt = date or None
-    if date and time:
-        appt_dt = f"{date} {time}"
+    # combine date and time (canonical 'YYYY-MM-DD HH:MM') if provided
+    appt_dt = None
+    if date:
+        appt_dt = normalize_appointment_datetime(date, time)
+        if appt_dt is None:
+            flash('Invalid appointment date/time', 'danger')
+            if patient_id:
+                return redirect(url_for('admin.update_patient', pid=patient_id))
+            return redirect(url_for('admin.appointments'))
 
     # debug print for tracing what is being updated
     print(f"[admin.update_appointment] FORM DATA: {dict(request.form)}")
     print(f"[admin.update_appointment] aid={aid} patient_id={patient_id!r} appt_dt={appt_dt!r} status={status!r} actions={actions!r} doctor_id={doctor_id!r}")
 
-    conn = get_db_connection()
     # update appointment fields: actions, optionally datetime, status, and per-appointment doctor assignment
+    values = {'status': status, 'actions': actions}
     if appt_dt:
-        if doctor_id is not None:
-            conn.execute('UPDATE appointments SET appointment_datetime = ?, status = ?, actions = ?, doctor_id = ? WHERE id = ?', (appt_dt, status, actions, doctor_id, aid))
-        else:
-            conn.execute('UPDATE appointments SET appointment_datetime = ?, status = ?, actions = ? WHERE id = ?', (appt_dt, status, actions, aid))
-    else:
-        if doctor_id is not None:
-            conn.execute('UPDATE appointments SET status = ?, actions = ?, doctor_id = ? WHERE id = ?', (status, actions, doctor_id, aid))
-        else:
-            conn.execute('UPDATE appointments SET status = ?, actions = ? WHERE id = ?', (status, actions, aid))
-    conn.commit()
+        values['appointment_datetime'] = appt_dt
+    if doctor_id is not None:
+        values['doctor_id'] = doctor_id
+    if not _write_schedule(aid, values, request.form.get('force') == '1'):
+        if patient_id:
+            return redirect(url_for('admin.update_patient', pid=patient_id))
+        return redirect(url_for('admin.appointments'))
     # verify update
+    conn = get_db()
     row = conn.execute('SELECT id, doctor_id, status, appointment_datetime, actions FROM appointments WHERE id = ?', (aid,)).fetchone()
     print(f"[admin.update_appointment] post-update row={row}")
     conn.close()
@@ -306,11 +423,69 @@ def update_appointment(aid):
     return redirect(url_for('admin.appointments'))
 
 
+def _write_schedule(aid, values, force):
+    """Apply an appointment update through scheduling.reschedule; flashes and
+    returns False when it would double-book the doctor (unless ``force``) or the
+    write timed out (then it may still commit: SCHEDULE reloads on the version bump)."""
+    try:
+        change, clashes = run_write(scheduling.reschedule, aid, values, force)
+    except WriteTimeout as e:
+        flash(str(e), 'danger')
+        return False
+    if change is not None:
+        scheduling.SCHEDULE.apply(change)
+        conn = get_db()
+        row = conn.execute('SELECT patient_id FROM appointments WHERE id = ?', (aid,)).fetchone()
+        conn.close()
+        if row:
+            timeline.invalidate(row['patient_id'])
+    if not clashes:
+        return True
+    taken = ', '.join(f'#{other} at {at}' for other, at in clashes)
+    if change is not None:
+        flash(f'Saved, but the doctor is double-booked (overlaps {taken}).', 'warning')
+        return True
+    conn = get_db()
+    doctor = refcache.get_doctor(conn, values.get('doctor_id'))
+    requested = values.get('appointment_datetime') or clashes[0][1]
+    slots = scheduling.SCHEDULE.free_slots(conn, values.get('doctor_id'), doctor['availability'] if doctor else None,
+                                           requested, count=3, exclude_id=aid) if doctor else []
+    conn.close()
+    free = f" Free: {', '.join(slots)}." if slots else ''
+    flash(f'The doctor already has appointment {taken}.{free} Pick another time or tick "Allow overlap".', 'danger')
+    return False
+
+
+@admin_bp.route('/appointments/<int:aid>/slots')
+def appointment_slots(aid):
+    """JSON for the confirm screen: clashes at the requested time and the next free slots."""
+    if 'admin' not in session:
+        return jsonify({'error': 'login required'}), 401
+    conn = get_db()
+    row = conn.execute('SELECT appointment_datetime FROM appointments WHERE id = ?', (aid,)).fetchone()
+    doctor = refcache.get_doctor(conn, request.args.get('doctor'))
+    if row is None or doctor is None:
+        conn.close()
+        return jsonify({'error': 'unknown appointment or doctor'}), 404
+    requested = row['appointment_datetime']
+    now = datetime.now().strftime(scheduling.CANONICAL_FORMAT)
+    count = min(request.args.get('n', 5, type=int), 20)
+    clashes = scheduling.SCHEDULE.conflicts(conn, doctor['doctor_id'], requested, exclude_id=aid)
+    slots = scheduling.SCHEDULE.free_slots(conn, doctor['doctor_id'], doctor['availability'],
+                                           max(requested, now), count=count, exclude_id=aid)
+    conn.close()
+    return jsonify({
+        'requested': requested,
+        'conflicts': [{'id': other, 'at': at} for other, at in clashes],
+        'slots': slots,
+    })
+
+
 @admin_bp.route('/appointments')
 def appointments():
     if 'admin' not in session:
         return redirect(url_for('admin.login'))
-    conn = get_db_connection()
+    conn = get_db()
     # show appointments that are booked (pending) so admin can assign a doctor and confirm
     rows = conn.execute('''
         SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name, d.doctor_id, d.f_name || ' ' || d.l_name AS doctor_name
@@ -320,11 +495,32 @@ def appointments():
         WHERE a.status = 'booked'
         ORDER BY a.appointment_datetime ASC
     ''').fetchall()
-    doctors = conn.execute('SELECT doctor_id, f_name, l_name FROM doctors ORDER BY f_name, l_name').fetchall()
+    doctors = refcache.doctor_choices(conn)
     conn.close()
     return render_template('admin_appointments.html', rows=rows, doctors=doctors)
 
 
+@admin_bp.route('/appointments/auto-assign', methods=['POST'])
+def auto_assign():
+    if 'admin' not in session:
+        return redirect(url_for('admin.login'))
+    if request.form.get('dry_run') == '1':
+        conn = get_db()
+        summary = assign.auto_assign(conn, dry_run=True)
+        conn.close()
+    else:
+        # one writer unit: every assignment of the run commits together or not at all
+        try:
+            summary = run_write(assign.auto_assign)
+        except WriteTimeout as e:
+            # the whole run may still commit (e.committed is None); the list shows it
+            flash(str(e), 'danger')
+            return redirect(url_for('admin.appointments'))
+        if summary['assigned']:
+            timeline.invalidate()
+    return render_template('admin_auto_assign.html', summary=summary)
+
+
 @admin_bp.route('/appointments/confirm/<int:aid>', methods=['POST'])
 def confirm_appointment(aid):
     if 'admin' not in session:
@@ -342,12 +538,13 @@ def confirm_appointment(aid):
     time = request.form.get('time')
     actions = request.form.get('actions')
 
-    # if edit_dt is present, combine date/time
+    # if edit_dt is present, combine date/time (canonical 'YYYY-MM-DD HH:MM')
     appt_dt = None
     if edit_dt and date:
-        appt_dt = date
-        if time:
-            appt_dt = f"{date} {time}"
+        appt_dt = normalize_appointment_datetime(date, time)
+        if appt_dt is None:
+            flash('Invalid appointment date/time', 'danger')
+            return redirect(url_for('admin.appointments'))
 
     # debug log to help trace why doctor_id may not be set
     print(f"[admin.confirm_appointment] aid={aid} doctor_id={doctor_id!r} edit_dt={edit_dt!r} date={date!r} time={time!r} actions={actions!r}")
@@ -356,14 +553,14 @@ def confirm_appointment(aid):
         flash('Please select a doctor before confirming.', 'danger')
         return redirect(url_for('admin.appointments'))
 
-    conn = get_db_connection()
     # build update fields dynamically
+    values = {'doctor_id': doctor_id, 'status': 'confirmed', 'actions': actions}
     if appt_dt is not None:
-        conn.execute('UPDATE appointments SET doctor_id = ?, status = ?, appointment_datetime = ?, actions = ? WHERE id = ?', (doctor_id, 'confirmed', appt_dt, actions, aid))
-    else:
-        conn.execute('UPDATE appointments SET doctor_id = ?, status = ?, actions = ? WHERE id = ?', (doctor_id, 'confirmed', actions, aid))
+        values['appointment_datetime'] = appt_dt
+    if not _write_schedule(aid, values, request.form.get('force') == '1'):
+        return redirect(url_for('admin.appointments'))
 
-    conn.commit()
+    conn = get_db()
     # verify update: fetch appointment row and confirm doctor_id
     row = conn.execute('SELECT id, doctor_id, status, appointment_datetime, actions FROM appointments WHERE id = ?', (aid,)).fetchone()
     conn.close()
@@ -0,0 +1,84 @@
+"""JSON versions of the appointment listings, for polling clients and dashboards.
+
+Each response carries an ETag (etags.py). A client that sends it back in
+``If-None-Match`` gets ``304 Not Modified`` until one of the tables behind the
+listing changes; the listing query does not run for a 304.
+"""
+from flask import Blueprint, jsonify, request, session
+
+import archive
+import etags
+from db import get_db
+
+api_bp = Blueprint('api', __name__)
+
+
+def _rows(cursor):
+    return [dict(row) for row in cursor]
+
+
+@api_bp.route('/patient/appointments')
+def patient_appointments():
+    """Same rows as patient.view_appointments; ?archived=1 adds archived ones."""
+    if 'patient_id' not in session:
+        return jsonify({'error': 'login required'}), 401
+    pid = session['patient_id']
+    show_archived = request.args.get('archived') == '1'
+
+    def build(conn):
+        return {'appointments': _rows(conn.execute(f'''
+            SELECT a.*, d.f_name || ' ' || d.l_name AS doctor_name
+            FROM {archive.appointments_source(show_archived)} a
+            LEFT JOIN doctors d ON d.doctor_id = a.doctor_id
+            WHERE a.patient_id = ?
+            ORDER BY a.appointment_datetime DESC
+        ''', (pid,)))}
+
+    conn = get_db()
+    response = etags.conditional_json(conn, ('appointments', 'doctors'), build, scope=('patient', pid))
+    conn.close()
+    return response
+
+
+@api_bp.route('/doctor/appointments')
+def doctor_appointments():
+    """Same rows as doctor.view_appointments_doctor (booked and confirmed)."""
+    if not session.get('doctor_logged_in'):
+        return jsonify({'error': 'login required'}), 401
+    did = session.get('doctor_id')
+
+    def build(conn):
+        return {'appointments': _rows(conn.execute('''
+            SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name
+            FROM appointments a
+            LEFT JOIN patients p ON p.id = a.patient_id
+            WHERE a.doctor_id = ? AND a.status IN ('booked','confirmed')
+            ORDER BY a.appointment_datetime ASC
+        ''', (did,)))}
+
+    conn = get_db()
+    response = etags.conditional_json(conn, ('appointments', 'patients'), build, scope=('doctor', did))
+    conn.close()
+    return response
+
+
+@api_bp.route('/admin/appointments')
+def admin_appointments():
+    """Same rows as admin.appointments: the booked queue, earliest first."""
+    if 'admin' not in session:
+        return jsonify({'error': 'login required'}), 401
+
+    def build(conn):
+        return {'appointments': _rows(conn.execute('''
+            SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name, d.f_name || ' ' || d.l_name AS doctor_name
+            FROM appointments a
+            JOIN patients p ON p.id = a.patient_id
+            LEFT JOIN doctors d ON d.doctor_id = a.doctor_id
+            WHERE a.status = 'booked'
+            ORDER BY a.appointment_datetime ASC
+        '''))}
+
+    conn = get_db()
+    response = etags.conditional_json(conn, ('appointments', 'patients', 'doctors'), build, scope='admin')
+    conn.close()
+    return response
@@ -2,19 +2,33 @@ from flask import Flask
 from admin_routes import admin_bp
 from patient_routes import patient_bp
 from doctor_routes import doctor_bp
+from api_routes import api_bp
 
-# also import the modules so we can print which DB they point to on startup
-import admin_routes as admin_mod
-import patient_routes as patient_mod
-import doctor_routes as doctor_mod
+# shared connection pool used by all three blueprints
+import db
+import migrations
+import sql_metrics
+import writer
 import os
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"
+app.config['DATABASE'] = db.DATABASE
+app.config['DB_POOL_SIZE'] = db.POOL_SIZE
+app.config['DB_READ_POOL_SIZE'] = db.READ_POOL_SIZE
+db.init_app(app)
+# per-route SQL timings, slow-query log and /admin/metrics (HMS_SQL_METRICS=0 disables)
+sql_metrics.init_app(app)
+# hot write paths go through one writer thread with group commit (HMS_DB_WRITER=0 disables)
+writer.init_app(app)
+# bring an existing database up to the latest schema version (indexes etc.)
+migrations.migrate_database(app.config['DATABASE'])
 
 app.register_blueprint(admin_bp, url_prefix='/admin')
 app.register_blueprint(patient_bp, url_prefix='/patient')
 app.register_blueprint(doctor_bp, url_prefix='/doctor')
+# JSON listings with ETags (conditional GET)
+app.register_blueprint(api_bp, url_prefix='/api')
 
 
 @app.route('/')
@@ -26,9 +40,8 @@ def index():
 def _log_db_paths():
     try:
         print('--- HMS DB paths ---')
-        print(' admin DB:', os.path.abspath(admin_mod.DATABASE))
-        print(' patient DB:', os.path.abspath(patient_mod.DATABASE))
-        print(' doctor DB:', os.path.abspath(doctor_mod.DATABASE))
+        print(' DB:', os.path.abspath(app.config['DATABASE']))
+        print(' pool size:', app.config['DB_POOL_SIZE'], 'read/write,', app.config['DB_READ_POOL_SIZE'], 'read-only')
         print('--------------------')
     except Exception as e:
         print('Could not resolve DB paths:', e)
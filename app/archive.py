@@ -0,0 +1,191 @@
+"""Hot/cold archival of finished appointments and paid bills.
+
+Completed/cancelled appointments and paid bills (with their items) older than
+ARCHIVE_AFTER_DAYS are moved into ``appointments_archive``, ``bills_archive``
+and ``bill_items_archive`` (migration 8), in batches of ``batch_size`` rows per
+transaction, so the tables the active queries use (``status IN ('booked',
+'confirmed')``, ``paid = 0``) stop growing with history. Rows keep their ids.
+
+Archived rows still count on the dashboard (stats.ARCHIVE_SCHEMA) and stay
+searchable in the doctor notes search (search.NOTES_ARCHIVE_SCHEMA). History
+views include them when asked (``?archived=1``), reading through
+``appointments_source`` / ``bills_source``.
+
+    python archive.py [--days N] [--batch N] [--dry-run] [path/to/hospital_management.db]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import db
+import search
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('HMS_ARCHIVE_DAYS', 365))
+# rows per transaction; also the number of ids bound into one IN (...) list
+BATCH_SIZE = 500
+
+APPOINTMENT_COLUMNS = 'id, patient_id, doctor_id, appointment_datetime, status, notes, fee, actions'
+BILL_COLUMNS = 'id, patient_id, total_amount, paid, created_at, paid_at'
+BILL_ITEM_COLUMNS = 'id, bill_id, item_type, item_ref, description, amount, created_at'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS appointments_archive (
+    id INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    doctor_id INTEGER REFERENCES doctors(doctor_id) ON DELETE SET NULL,
+    appointment_datetime TEXT NOT NULL,
+    status TEXT NOT NULL,
+    notes TEXT,
+    fee REAL DEFAULT 0,
+    actions TEXT,
+    archived_at TEXT DEFAULT (datetime('now'))
+);
+CREATE INDEX IF NOT EXISTS idx_appointments_archive_patient_dt ON appointments_archive(patient_id, appointment_datetime);
+CREATE INDEX IF NOT EXISTS idx_appointments_archive_doctor ON appointments_archive(doctor_id);
+
+CREATE TABLE IF NOT EXISTS bills_archive (
+    id INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    total_amount REAL DEFAULT 0,
+    paid INTEGER DEFAULT 1,
+    created_at TEXT,
+    paid_at TEXT,
+    archived_at TEXT DEFAULT (datetime('now'))
+);
+CREATE INDEX IF NOT EXISTS idx_bills_archive_created ON bills_archive(created_at);
+CREATE INDEX IF NOT EXISTS idx_bills_archive_patient ON bills_archive(patient_id);
+
+CREATE TABLE IF NOT EXISTS bill_items_archive (
+    id INTEGER PRIMARY KEY,
+    bill_id INTEGER NOT NULL REFERENCES bills_archive(id) ON DELETE CASCADE,
+    item_type TEXT NOT NULL,
+    item_ref INTEGER,
+    description TEXT,
+    amount REAL NOT NULL DEFAULT 0,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_bill_items_archive_bill ON bill_items_archive(bill_id);
+
+-- the archival job's scan: paid bills by age (unpaid bills are not in this index)
+CREATE INDEX IF NOT EXISTS idx_bills_paid_created ON bills(created_at) WHERE paid = 1;
+"""
+
+
+def appointments_source(include_archived=False):
+    """FROM-clause source for appointments: the hot table, or hot + archived rows.
+
+    The union has an ``archived`` column (0/1); the hot table alone does not.
+    """
+    if not include_archived:
+        return 'appointments'
+    return (f'(SELECT {APPOINTMENT_COLUMNS}, 0 AS archived FROM appointments '
+            f'UNION ALL SELECT {APPOINTMENT_COLUMNS}, 1 AS archived FROM appointments_archive)')
+
+
+def bills_source(include_archived=False):
+    """FROM-clause source for bills: the hot table, or hot + archived rows."""
+    if not include_archived:
+        return 'bills'
+    return (f'(SELECT {BILL_COLUMNS}, 0 AS archived FROM bills '
+            f'UNION ALL SELECT {BILL_COLUMNS}, 1 AS archived FROM bills_archive)')
+
+
+def cutoff_for(days, now=None):
+    """Timestamp ('YYYY-MM-DD HH:MM:SS') ``days`` before ``now``."""
+    return ((now or datetime.now()) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _marks(ids):
+    return ', '.join('?' for _ in ids)
+
+
+def _archive_appointments(conn, ids):
+    marks = _marks(ids)
+    conn.execute(f'INSERT INTO appointments_archive ({APPOINTMENT_COLUMNS}) '
+                 f'SELECT {APPOINTMENT_COLUMNS} FROM appointments WHERE id IN ({marks})', ids)
+    conn.execute(f'DELETE FROM appointments WHERE id IN ({marks})', ids)
+    # the hot table's delete trigger dropped their notes from the search index
+    search.index_archived_notes(conn, ids)
+
+
+def _archive_bills(conn, ids):
+    marks = _marks(ids)
+    conn.execute(f'INSERT INTO bills_archive ({BILL_COLUMNS}) SELECT {BILL_COLUMNS} FROM bills WHERE id IN ({marks})', ids)
+    conn.execute(f'INSERT INTO bill_items_archive ({BILL_ITEM_COLUMNS}) '
+                 f'SELECT {BILL_ITEM_COLUMNS} FROM bill_items WHERE bill_id IN ({marks})', ids)
+    # bill_items go with their bill (ON DELETE CASCADE)
+    conn.execute(f'DELETE FROM bills WHERE id IN ({marks})', ids)
+
+
+# table -> (what is archived, given the cutoff; mover). Both are index range seeks:
+# idx_appointments_status_dt and the partial idx_bills_paid_created
+JOBS = {
+    'appointments': ("status IN ('completed', 'cancelled') AND appointment_datetime < ?", _archive_appointments),
+    'bills': ('paid = 1 AND created_at < ?', _archive_bills),
+}
+
+
+def archive(conn, cutoff, batch_size=BATCH_SIZE, dry_run=False, progress=None):
+    """Move rows older than ``cutoff`` into the archive tables, one batch per transaction.
+
+    Returns {job: rows moved}. With ``dry_run`` only counts what would be moved.
+    ``progress(job, moved)`` is called after every committed batch.
+    """
+    moved = {}
+    for name, (where, mover) in JOBS.items():
+        moved[name] = 0
+        if dry_run:
+            moved[name] = conn.execute(f'SELECT COUNT(*) FROM {name} WHERE {where}', (cutoff,)).fetchone()[0]
+            continue
+        while True:
+            conn.execute('BEGIN IMMEDIATE;')
+            try:
+                # archived rows leave the range, so every batch starts from the front again
+                ids = [row[0] for row in conn.execute(f'SELECT id FROM {name} WHERE {where} LIMIT ?', (cutoff, batch_size))]
+                if ids:
+                    mover(conn, ids)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            if not ids:
+                break
+            moved[name] += len(ids)
+            if progress:
+                progress(name, moved[name])
+    return moved
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description='Move finished appointments and paid bills into the archive tables.')
+    ap.add_argument('path', nargs='?', default=db.DATABASE)
+    ap.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS, help='archive rows older than this (default %(default)s)')
+    ap.add_argument('--batch', type=int, default=BATCH_SIZE, help='rows per transaction (default %(default)s)')
+    ap.add_argument('--dry-run', action='store_true', help='only count what would be archived')
+    args = ap.parse_args(argv[1:])
+
+    cutoff = cutoff_for(args.days)
+    conn = db.connect(args.path)
+    start = time.perf_counter()
+
+    def progress(name, count):
+        print(f'  {name}: {count} archived', end='\r')
+
+    try:
+        moved = archive(conn, cutoff, args.batch, args.dry_run, progress)
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start
+    verb = 'would archive' if args.dry_run else 'archived'
+    for name, count in moved.items():
+        print(f'{name}: {verb} {count} row(s) older than {cutoff}')
+    total = sum(moved.values())
+    if not args.dry_run and total:
+        print(f'Done in {elapsed:.1f}s ({total / elapsed:.0f} rows/s).')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,185 @@
+"""Batch auto-assignment of the booked appointment queue.
+
+``auto_assign`` takes every upcoming ``status = 'booked'`` appointment, earliest
+first, and confirms it with a doctor:
+
+* the doctor already on the row, or the patient's own doctor, when free;
+* otherwise the least-loaded doctor of the patient's department (any doctor
+  when the department has none) who works at that time
+  (``doctors.availability``) and has no overlapping appointment.
+
+Load is the number of upcoming booked/confirmed appointments. Each department
+keeps a heap of (load, doctor_id); doctors are popped in load order until one
+fits, and the chosen one goes back with load + 1. Conflicts are checked
+against private copies of the doctors' schedules (scheduling.SCHEDULE), which
+also take every assignment made earlier in the same run. All updates are
+written in the caller's transaction, so a run is all or nothing.
+
+    python assign.py [--dry-run] [--limit N] [path/to/hospital_management.db]
+"""
+import argparse
+import bisect
+import heapq
+import sys
+import time
+from datetime import datetime
+
+import db
+import scheduling
+
+
+def _department(value):
+    return (value or '').strip().lower()
+
+
+def _works_at(week, start, slot):
+    day, minute = divmod(start, 1440)
+    for begin, end in week.get(datetime.fromordinal(day).weekday(), ()):
+        if begin <= minute and minute + slot <= end:
+            return True
+    return False
+
+
+def auto_assign(conn, now=None, limit=None, dry_run=False, index=scheduling.SCHEDULE):
+    """Assign and confirm booked appointments from ``now`` on; caller commits.
+
+    Returns a summary dict; with ``dry_run`` nothing is written.
+    """
+    started = time.perf_counter()
+    now = now or datetime.now().strftime(scheduling.CANONICAL_FORMAT)
+    slot = index.slot
+    store = not conn.in_transaction
+
+    doctors = {}
+    for row in conn.execute('SELECT doctor_id, f_name, l_name, department, availability FROM doctors'):
+        doctors[row['doctor_id']] = {
+            'name': f"{row['f_name']} {row['l_name']}",
+            'department': _department(row['department']),
+            'week': (scheduling.parse_availability(row['availability'])
+                     or scheduling.parse_availability(scheduling.DEFAULT_AVAILABILITY)),
+        }
+    from_minute = scheduling.to_minutes(now)
+    schedules = {}
+    load = {}
+    for doctor_id in doctors:
+        schedules[doctor_id] = index.snapshot(conn, doctor_id, store)
+        starts = schedules[doctor_id].starts
+        load[doctor_id] = len(starts) - bisect.bisect_left(starts, from_minute)
+
+    heaps = {}
+    for doctor_id, doctor in doctors.items():
+        heaps.setdefault(doctor['department'], []).append((load[doctor_id], doctor_id))
+    everyone = [(load[d], d) for d in doctors]
+    for heap in (*heaps.values(), everyone):
+        heapq.heapify(heap)
+
+    def free(doctor_id, start, aid):
+        return (doctor_id in doctors and _works_at(doctors[doctor_id]['week'], start, slot)
+                and not schedules[doctor_id].overlapping(start, slot, aid, limit=1))
+
+    def push(doctor_id):
+        for heap in (heaps[doctors[doctor_id]['department']], everyone):
+            heapq.heappush(heap, (load[doctor_id], doctor_id))
+
+    def take(doctor_id, start, aid, previous):
+        # a booked row already counts for the doctor on it
+        if previous == doctor_id:
+            return
+        if previous in schedules:
+            schedules[previous].remove(aid)
+            load[previous] -= 1
+            push(previous)
+        schedules[doctor_id].add(start, aid)
+        load[doctor_id] += 1
+        push(doctor_id)
+
+    summary = {'pending': 0, 'assigned': 0, 'unassigned': 0, 'by_doctor': {}, 'reasons': {}, 'dry_run': dry_run}
+    updates = []
+    sql = '''
+        SELECT a.id, a.doctor_id, a.appointment_datetime, p.doctor AS own_doctor, p.department
+        FROM appointments a
+        JOIN patients p ON p.id = a.patient_id
+        WHERE a.status = 'booked' AND a.appointment_datetime >= ?
+        ORDER BY a.appointment_datetime, a.id
+    '''
+    params = (now,)
+    if limit:
+        sql += ' LIMIT ?'
+        params += (limit,)
+    # idx_appointments_status_dt, already in the order they are handed out
+    for row in conn.execute(sql, params).fetchall():
+        summary['pending'] += 1
+        aid = row['id']
+        start = scheduling.to_minutes(row['appointment_datetime'])
+        chosen = None
+        reason = None
+        if start is None:
+            reason = 'unreadable date/time'
+        else:
+            for preferred in (row['doctor_id'], row['own_doctor']):
+                if preferred is not None and free(preferred, start, aid):
+                    chosen = preferred
+                    break
+        if chosen is None and reason is None:
+            heap = heaps.get(_department(row['department'])) or everyone
+            skipped = []
+            while heap:
+                entry = heapq.heappop(heap)
+                # stale entry: the doctor's load moved since it was pushed
+                if entry[0] != load[entry[1]]:
+                    continue
+                if free(entry[1], start, aid):
+                    chosen = entry[1]
+                    break
+                skipped.append(entry)
+            for entry in skipped:
+                heapq.heappush(heap, entry)
+            if chosen is None:
+                reason = 'no doctor free at that time'
+        if chosen is None:
+            summary['unassigned'] += 1
+            summary['reasons'][reason] = summary['reasons'].get(reason, 0) + 1
+            continue
+        take(chosen, start, aid, row['doctor_id'])
+        updates.append((chosen, aid))
+        summary['assigned'] += 1
+        name = doctors[chosen]['name']
+        summary['by_doctor'][name] = summary['by_doctor'].get(name, 0) + 1
+
+    if updates and not dry_run:
+        conn.executemany("UPDATE appointments SET doctor_id = ?, status = 'confirmed' WHERE id = ? AND status = 'booked'",
+                         updates)
+    summary['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return summary
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description='Assign and confirm every upcoming booked appointment.')
+    ap.add_argument('path', nargs='?', default=db.DATABASE)
+    ap.add_argument('--dry-run', action='store_true', help='plan only, write nothing')
+    ap.add_argument('--limit', type=int, help='at most this many appointments')
+    args = ap.parse_args(argv[1:])
+
+    conn = db.connect(args.path)
+    try:
+        conn.execute('BEGIN IMMEDIATE;')
+        try:
+            summary = auto_assign(conn, limit=args.limit, dry_run=args.dry_run)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+    verb = 'would assign' if args.dry_run else 'assigned'
+    print(f"{summary['pending']} booked appointment(s): {verb} {summary['assigned']}, "
+          f"{summary['unassigned']} left unassigned ({summary['elapsed_ms']} ms).")
+    for reason, count in summary['reasons'].items():
+        print(f'  {count} x {reason}')
+    for name, count in sorted(summary['by_doctor'].items(), key=lambda item: -item[1]):
+        print(f'  Dr. {name}: {count}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
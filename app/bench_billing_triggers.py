@@ -0,0 +1,154 @@
+"""Micro-benchmark: per-insert cost of the billing triggers on a large bills table.
+
+Compares the original triggers (open bill found with NOT EXISTS + two
+``ORDER BY created_at DESC LIMIT 1`` subqueries), with and without the
+(patient_id, paid, created_at) index, against the current triggers, which look
+the single open bill up once and update it through the new bill item.
+
+    python bench_billing_triggers.py --patients 20000 --bills-per-patient 10 --inserts 5000
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+
+from create_hms_db import create_hms_db
+
+# the triggers as they were before migration 4
+LEGACY_TRIGGERS = """
+CREATE TRIGGER trg_ensure_open_bill_after_insert_treatment
+AFTER INSERT ON treatments
+BEGIN
+    INSERT INTO bills(patient_id, total_amount, paid, created_at)
+    SELECT NEW.patient_id, 0, 0, datetime('now')
+    WHERE NOT EXISTS (SELECT 1 FROM bills b WHERE b.patient_id = NEW.patient_id AND b.paid = 0);
+
+    INSERT INTO bill_items(bill_id, item_type, item_ref, description, amount, created_at)
+    VALUES (
+        (SELECT id FROM bills WHERE patient_id = NEW.patient_id AND paid = 0 ORDER BY created_at DESC LIMIT 1),
+        'treatment', NEW.id, COALESCE(NEW.description,'Treatment'), COALESCE(NEW.cost,0), datetime('now')
+    );
+
+    UPDATE bills
+    SET total_amount = total_amount + COALESCE(NEW.cost,0)
+    WHERE id = (SELECT id FROM bills WHERE patient_id = NEW.patient_id AND paid = 0 ORDER BY created_at DESC LIMIT 1);
+END;
+
+CREATE TRIGGER trg_prescription_item_after_insert
+AFTER INSERT ON prescription_items
+BEGIN
+    INSERT INTO bills(patient_id, total_amount, paid, created_at)
+    SELECT p.patient_id, 0, 0, datetime('now')
+    FROM prescriptions p
+    WHERE p.id = NEW.prescription_id
+      AND NOT EXISTS (SELECT 1 FROM bills b WHERE b.patient_id = p.patient_id AND b.paid = 0);
+
+    INSERT INTO bill_items(bill_id, item_type, item_ref, description, amount, created_at)
+    VALUES (
+        (SELECT id FROM bills WHERE patient_id = (SELECT patient_id FROM prescriptions WHERE id = NEW.prescription_id) AND paid = 0 ORDER BY created_at DESC LIMIT 1),
+        'medication', NEW.id,
+        (SELECT m.name FROM medications m WHERE m.id = NEW.medication_id),
+        COALESCE(NEW.unit_price,0) * COALESCE(NEW.quantity,1),
+        datetime('now')
+    );
+
+    UPDATE bills
+    SET total_amount = total_amount + (COALESCE(NEW.unit_price,0) * COALESCE(NEW.quantity,1))
+    WHERE id = (SELECT id FROM bills WHERE patient_id = (SELECT patient_id FROM prescriptions WHERE id = NEW.prescription_id) AND paid = 0 ORDER BY created_at DESC LIMIT 1);
+END;
+"""
+
+
+def build_base(path, patients, bills_per_patient, seed):
+    with redirect_stdout(StringIO()):
+        create_hms_db(path)
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO medications(name, price) VALUES ('Paracetamol', 2.5)")
+    conn.executemany('INSERT INTO patients(id, first_name, last_name) VALUES (?, ?, ?)',
+                     ((i, f'First{i}', f'Last{i}') for i in range(1, patients + 1)))
+    # history of paid bills plus one open bill per patient
+    def bills():
+        for pid in range(1, patients + 1):
+            for k in range(bills_per_patient - 1):
+                yield (pid, rnd.randint(10, 500), 1, f'2024-{1 + k % 12:02d}-01 10:00:00')
+            yield (pid, 0, 0, '2025-01-01 10:00:00')
+    conn.executemany('INSERT INTO bills(patient_id, total_amount, paid, created_at) VALUES (?, ?, ?, ?)', bills())
+    conn.execute('INSERT INTO prescriptions(id, patient_id) SELECT id, id FROM patients')
+    conn.commit()
+    conn.close()
+
+
+def prepare_variant(base, path, variant):
+    shutil.copy(base, path)
+    conn = sqlite3.connect(path)
+    if variant != 'current':
+        conn.executescript("""
+            DROP TRIGGER trg_ensure_open_bill_after_insert_treatment;
+            DROP TRIGGER trg_prescription_item_after_insert;
+            DROP INDEX ux_bills_open_patient;
+        """)
+        conn.executescript(LEGACY_TRIGGERS)
+    if variant == 'legacy-noindex':
+        conn.execute('DROP INDEX idx_bills_patient_paid_created')
+    conn.commit()
+    conn.close()
+
+
+def time_inserts(path, inserts, patients, seed):
+    rnd = random.Random(seed)
+    pids = [rnd.randint(1, patients) for _ in range(inserts)]
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA foreign_keys = ON;')
+    results = {}
+    # treatments -> trg_ensure_open_bill_after_insert_treatment
+    conn.execute('BEGIN;')
+    start = time.perf_counter()
+    for pid in pids:
+        conn.execute('INSERT INTO treatments(patient_id, description, cost) VALUES (?, ?, ?)', (pid, 'bench', 10))
+    results['treatment'] = (time.perf_counter() - start) / inserts
+    # prescription_items -> trg_prescription_item_after_insert
+    start = time.perf_counter()
+    for pid in pids:
+        conn.execute('INSERT INTO prescription_items(prescription_id, medication_id, quantity, unit_price) VALUES (?, 1, 2, 2.5)', (pid,))
+    results['prescription_item'] = (time.perf_counter() - start) / inserts
+    conn.rollback()
+    conn.close()
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--patients', type=int, default=20000)
+    ap.add_argument('--bills-per-patient', type=int, default=10)
+    ap.add_argument('--inserts', type=int, default=5000)
+    ap.add_argument('--noindex-inserts', type=int, default=200,
+                    help='inserts for the unindexed legacy variant (each one scans bills)')
+    ap.add_argument('--repeat', type=int, default=3, help='runs per variant; the best is reported')
+    ap.add_argument('--seed', type=int, default=42)
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='hms_bench_')
+    try:
+        base = os.path.join(workdir, 'base.db')
+        build_base(base, args.patients, args.bills_per_patient, args.seed)
+        print(f'bills table: {args.patients * args.bills_per_patient} rows, {args.patients} open bills')
+        print(f'{"variant":<18}{"inserts":>9}{"treatment us":>15}{"rx item us":>13}')
+        for variant in ('legacy-noindex', 'legacy-index', 'current'):
+            path = os.path.join(workdir, f'{variant}.db')
+            prepare_variant(base, path, variant)
+            n = args.noindex_inserts if variant == 'legacy-noindex' else args.inserts
+            runs = [time_inserts(path, n, args.patients, args.seed) for _ in range(max(1, args.repeat))]
+            res = {k: min(r[k] for r in runs) for k in runs[0]}
+            print(f'{variant:<18}{n:>9}{res["treatment"] * 1e6:>15.1f}{res["prescription_item"] * 1e6:>13.1f}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""Route-level latency benchmark for the admin, doctor and patient blueprints.
+
+Every GET and POST route (except logouts and the delete links) is requested
+through the Flask test client with a logged-in session, and per-route
+p50/p90/p99/mean/max latencies are printed. By default the database is copied
+to a temporary directory first, so the POSTs never touch the original.
+
+    python generate_data.py bench.db --patients 100000 --appointments 300000
+    python bench_routes.py --db bench.db --out baseline.json
+    python bench_routes.py --db bench.db --compare baseline.json --threshold 0.2
+
+With --compare the exit status is 1 when any route's p50 got slower than the
+baseline by more than the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+
+import db
+
+# below this many milliseconds a slowdown is treated as noise
+NOISE_FLOOR_MS = 0.5
+
+
+def sample_ids(path):
+    """Pick realistic ids to put in the URLs: the busiest doctor and one of their patients."""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        doctor = conn.execute('''
+            SELECT d.doctor_id, d.f_name, d.l_name, d.password FROM doctors d
+            ORDER BY (SELECT COUNT(*) FROM patients p WHERE p.doctor = d.doctor_id) DESC, d.doctor_id
+            LIMIT 1
+        ''').fetchone()
+        if doctor is None:
+            raise SystemExit(f'{path} has no doctors; generate data first (generate_data.py)')
+        did = doctor['doctor_id']
+        patient = conn.execute('SELECT id, first_name, last_name FROM patients WHERE doctor = ? ORDER BY id LIMIT 1',
+                               (did,)).fetchone() or conn.execute('SELECT id, first_name, last_name FROM patients ORDER BY id LIMIT 1').fetchone()
+        if patient is None:
+            raise SystemExit(f'{path} has no patients; generate data first (generate_data.py)')
+        pid = patient['id']
+        appt = conn.execute('SELECT id FROM appointments WHERE doctor_id = ? ORDER BY id LIMIT 1', (did,)).fetchone()
+        if appt is None:
+            conn.execute("INSERT INTO appointments (patient_id, doctor_id, appointment_datetime, status) "
+                         "VALUES (?, ?, datetime('now'), 'confirmed')", (pid, did))
+            appt = conn.execute('SELECT last_insert_rowid() AS id').fetchone()
+        # the patient cancels this one over and over, so give them their own
+        conn.execute("INSERT INTO appointments (patient_id, appointment_datetime, status) "
+                     "VALUES (?, strftime('%Y-%m-%d %H:%M', 'now', '+30 days'), 'booked')", (pid,))
+        own = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        treatment = conn.execute('SELECT id FROM treatments WHERE doctor_id = ? ORDER BY id LIMIT 1', (did,)).fetchone()
+        if treatment is None:
+            conn.execute("INSERT INTO treatments (patient_id, doctor_id, description, cost) VALUES (?, ?, 'bench', 0)", (pid, did))
+            treatment = conn.execute('SELECT last_insert_rowid() AS id').fetchone()
+        conn.commit()
+        return {
+            'doctor_id': did, 'doctor_name': f"{doctor['f_name']} {doctor['l_name']}",
+            'doctor_username': f"{doctor['f_name']}{doctor['l_name']}", 'doctor_password': doctor['password'] or '',
+            'patient_id': pid, 'patient_name': f"{patient['first_name']} {patient['last_name']}",
+            'appointment_id': appt['id'], 'own_appointment_id': own, 'treatment_id': treatment['id'],
+        }
+    finally:
+        conn.close()
+
+
+def route_cases(ids):
+    """(name, role, method, url, form data) for every route that is benchmarked."""
+    did, pid, aid, tid = ids['doctor_id'], ids['patient_id'], ids['appointment_id'], ids['treatment_id']
+    return [
+        ('admin.login', None, 'post', '/admin/login', {'username': 'admin', 'password': 'admin123'}),
+        ('admin.dashboard', 'admin', 'get', '/admin/dashboard', None),
+        ('admin.patients', 'admin', 'get', '/admin/patients', None),
+        ('admin.add_patient', 'admin', 'get', '/admin/patients/add', None),
+        ('admin.add_patient:post', 'admin', 'post', '/admin/patients/add',
+         {'first_name': 'Bench', 'last_name': 'Patient', 'phone': '555-0000', 'address': '1 Main St', 'doctor': str(did)}),
+        ('admin.update_patient', 'admin', 'get', f'/admin/patients/update/{pid}', None),
+        ('admin.update_patient:post', 'admin', 'post', f'/admin/patients/update/{pid}',
+         {'first_name': ids['patient_name'].split(' ')[0], 'last_name': ids['patient_name'].split(' ', 1)[-1],
+          'phone': '555-0001', 'address': '2 Main St', 'doctor': str(did)}),
+        ('admin.bills', 'admin', 'get', '/admin/bills', None),
+        ('admin.doctors', 'admin', 'get', '/admin/doctors', None),
+        ('admin.add_doctor', 'admin', 'get', '/admin/doctors/add', None),
+        ('admin.add_doctor:post', 'admin', 'post', '/admin/doctors/add',
+         {'f_name': 'Bench', 'l_name': 'Doctor', 'password': 'bench', 'department': 'General Medicine',
+          'availability': 'Mon-Fri 09:00-17:00'}),
+        ('admin.appointments', 'admin', 'get', '/admin/appointments', None),
+        ('admin.update_appointment:post', 'admin', 'post', f'/admin/appointments/update/{aid}',
+         {'status': 'confirmed', 'doctor': str(did)}),
+        ('admin.confirm_appointment:post', 'admin', 'post', f'/admin/appointments/confirm/{aid}', {'doctor': str(did)}),
+        ('doctor.login', None, 'post', '/doctor/login',
+         {'username': ids['doctor_username'], 'password': ids['doctor_password']}),
+        ('doctor.dashboard', 'doctor', 'get', '/doctor/dashboard', None),
+        ('doctor.my_patients', 'doctor', 'get', '/doctor/patients', None),
+        ('doctor.view_appointments_doctor', 'doctor', 'get', '/doctor/appointments', None),
+        ('doctor.view_patient', 'doctor', 'get', f'/doctor/patient/{pid}', None),
+        ('doctor.view_patient:symptom', 'doctor', 'post', f'/doctor/patient/{pid}',
+         {'action': 'add_symptom', 'description': 'bench symptom'}),
+        ('doctor.view_patient:prescribe', 'doctor', 'post', f'/doctor/patient/{pid}',
+         {'action': 'prescribe', 'medication_name': 'Benchamol', 'dosage': '1x daily', 'quantity': '2', 'unit_price': '1.5'}),
+        ('doctor.open_appointment', 'doctor', 'get', f'/doctor/appointment/{aid}', None),
+        ('doctor.open_appointment:post', 'doctor', 'post', f'/doctor/appointment/{aid}', {'details': 'bench follow-up'}),
+        ('doctor.view_logs', 'doctor', 'get', '/doctor/logs', None),
+        ('doctor.add_treatment', 'doctor', 'get', '/doctor/add_treatment', None),
+        ('doctor.add_treatment?q', 'doctor', 'get', '/doctor/add_treatment?q=smi', None),
+        ('doctor.add_treatment:post', 'doctor', 'post', '/doctor/add_treatment', {'patient_id': str(pid), 'details': 'bench'}),
+        ('doctor.edit_treatment', 'doctor', 'get', f'/doctor/treatment/edit/{tid}', None),
+        ('doctor.edit_treatment:post', 'doctor', 'post', f'/doctor/treatment/edit/{tid}', {'description': 'bench edit'}),
+        ('doctor.list_doctors', 'doctor', 'get', '/doctor/doctors', None),
+        ('doctor.doctor_profile', 'doctor', 'get', f'/doctor/profile/{did}', None),
+        ('patient.login', None, 'post', '/patient/login', {'patient_id': str(pid)}),
+        ('patient.home', 'patient', 'get', '/patient/home', None),
+        ('patient.book_appointment', 'patient', 'get', '/patient/book', None),
+        ('patient.book_appointment:post', 'patient', 'post', '/patient/book',
+         {'date': '2030-01-02', 'time': '10:00', 'notes': 'bench'}),
+        ('patient.view_appointments', 'patient', 'get', '/patient/appointments', None),
+        ('patient.cancel_appointment:post', 'patient', 'post', f'/patient/appointments/cancel/{ids["own_appointment_id"]}', None),
+        # JSON listings: full response, then revalidation with the ETag (":304")
+        ('api.admin_appointments', 'admin', 'get', '/api/admin/appointments', None),
+        ('api.admin_appointments:304', 'admin', 'get', '/api/admin/appointments', None),
+        ('api.doctor_appointments', 'doctor', 'get', '/api/doctor/appointments', None),
+        ('api.doctor_appointments:304', 'doctor', 'get', '/api/doctor/appointments', None),
+        ('api.patient_appointments', 'patient', 'get', '/api/patient/appointments', None),
+        ('api.patient_appointments:304', 'patient', 'get', '/api/patient/appointments', None),
+    ]
+
+
+def log_in(client, role, ids):
+    with client.session_transaction() as sess:
+        sess.clear()
+        if role == 'admin':
+            sess['admin'] = True
+        elif role == 'doctor':
+            sess['doctor_logged_in'] = True
+            sess['doctor_id'] = ids['doctor_id']
+            sess['doctor_name'] = ids['doctor_name']
+        elif role == 'patient':
+            sess['patient_id'] = ids['patient_id']
+            sess['patient_name'] = ids['patient_name']
+
+
+def percentile(sorted_values, pct):
+    # nearest-rank
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def summarize(samples):
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        'n': len(ms),
+        'mean_ms': round(sum(ms) / len(ms), 3),
+        'p50_ms': round(percentile(ms, 50), 3),
+        'p90_ms': round(percentile(ms, 90), 3),
+        'p99_ms': round(percentile(ms, 99), 3),
+        'max_ms': round(ms[-1], 3),
+    }
+
+
+def run(path, requests_per_route, warmup, only=None):
+    ids = sample_ids(path)
+    # app.py reads db.DATABASE at import time, so point it at the copy first
+    os.environ['HMS_DATABASE'] = db.DATABASE = path
+    with redirect_stdout(StringIO()):
+        from app import app
+    app.config['TESTING'] = True
+    client = app.test_client()
+    results = {}
+    for name, role, method, url, data in route_cases(ids):
+        if only and not any(o in name for o in only):
+            continue
+        log_in(client, role, ids)
+        headers = {}
+        if name.endswith(':304'):
+            headers['If-None-Match'] = client.get(url).headers.get('ETag', '')
+        samples = []
+        errors = 0
+        # the routes print debug lines; keep them out of the report
+        with redirect_stdout(StringIO()):
+            for i in range(warmup + requests_per_route):
+                start = time.perf_counter()
+                resp = client.open(url, method=method.upper(), data=data, headers=headers)
+                elapsed = time.perf_counter() - start
+                if resp.status_code >= 400:
+                    errors += 1
+                if i >= warmup:
+                    samples.append(elapsed)
+        results[name] = summarize(samples)
+        results[name]['errors'] = errors
+        row = results[name]
+        print(f'{name:<36}{row["p50_ms"]:>9.2f}{row["p90_ms"]:>9.2f}{row["p99_ms"]:>9.2f}'
+              f'{row["mean_ms"]:>9.2f}{row["max_ms"]:>9.2f}' + (f'  {errors} errors' if errors else ''))
+    return results
+
+
+def compare(results, baseline, threshold, metric='p50_ms'):
+    """Return [(route, old, new, ratio)] for routes that regressed past the threshold."""
+    regressions = []
+    print(f'\n{"route":<36}{"baseline":>10}{"current":>10}{"change":>9}   ({metric})')
+    for name, row in results.items():
+        old = baseline.get('routes', {}).get(name)
+        if not old:
+            print(f'{name:<36}{"-":>10}{row[metric]:>10.2f}{"new":>9}')
+            continue
+        before, now = old[metric], row[metric]
+        ratio = now / before if before else float('inf')
+        flag = ''
+        if now > before * (1 + threshold) and now - before > NOISE_FLOOR_MS:
+            regressions.append((name, before, now, ratio))
+            flag = '  REGRESSION'
+        print(f'{name:<36}{before:>10.2f}{now:>10.2f}{(ratio - 1) * 100:>8.0f}%{flag}')
+    return regressions
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Benchmark HMS routes through the Flask test client.')
+    ap.add_argument('--db', default=db.DATABASE, help='database to benchmark (default: the app database)')
+    ap.add_argument('--requests', type=int, default=50, help='timed requests per route (default 50)')
+    ap.add_argument('--warmup', type=int, default=3, help='untimed requests per route first (default 3)')
+    ap.add_argument('--only', action='append', help='only routes whose name contains this (repeatable)')
+    ap.add_argument('--in-place', action='store_true', help='run against --db itself instead of a temporary copy')
+    ap.add_argument('--out', help='write the results as a JSON baseline')
+    ap.add_argument('--compare', help='baseline JSON to compare against')
+    ap.add_argument('--threshold', type=float, default=0.2, help='allowed p50 slowdown for --compare (default 0.2 = 20%%)')
+    args = ap.parse_args(argv)
+    if args.requests < 1:
+        ap.error('--requests must be positive')
+    if not os.path.exists(args.db):
+        ap.error(f'{args.db} does not exist')
+
+    workdir = None
+    path = args.db
+    if not args.in_place:
+        workdir = tempfile.mkdtemp(prefix='hms_bench_')
+        path = os.path.join(workdir, os.path.basename(args.db))
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                shutil.copy(args.db + suffix, path + suffix)
+    try:
+        print(f'Benchmarking {args.db} ({args.requests} requests per route, {args.warmup} warm-up)')
+        print(f'{"route":<36}{"p50 ms":>9}{"p90 ms":>9}{"p99 ms":>9}{"mean ms":>9}{"max ms":>9}')
+        results = run(path, args.requests, args.warmup, args.only)
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        report = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'database': os.path.abspath(args.db),
+            'requests': args.requests,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'routes': results,
+        }
+        with open(args.out, 'w') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+        print(f'Wrote {args.out}')
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} route(s) regressed by more than {args.threshold:.0%}')
+            return 1
+        print('No regressions.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Billing reconciliation: does every bill's total_amount equal the sum of its items?
+
+The billing triggers (create_hms_db.BILLING_TRIGGERS) keep ``bills.total_amount``
+up to date incrementally; nothing else checks it. ``reconcile`` walks the bills
+in id order, ``chunk_size`` bills at a time. For each chunk it runs one grouped
+SUM over the matching ``bill_items`` range, compares, and with ``fix`` rewrites
+the drifted totals in the same transaction. Memory use is one chunk plus the
+first MAX_REPORTED drifted bills, however many items there are. Archived bills
+(archive.py) are checked the same way.
+
+    python billing.py [--fix] [--chunk N] [path/to/hospital_management.db]
+"""
+import argparse
+import sys
+import time
+
+import db
+
+CHUNK_SIZE = 5000
+# money is compared with a tolerance (REAL sums)
+TOLERANCE = 0.005
+# drifted bills kept for the report; the rest are only counted
+MAX_REPORTED = 20
+
+# (bills table, items table)
+LEDGERS = (
+    ('bills', 'bill_items'),
+    ('bills_archive', 'bill_items_archive'),
+)
+
+
+def _chunk(conn, bills, items, after, chunk_size):
+    rows = conn.execute(f'SELECT id, total_amount FROM {bills} WHERE id > ? ORDER BY id LIMIT ?',
+                        (after, chunk_size)).fetchall()
+    if not rows:
+        return rows, {}, 0
+    # one range scan of the bill_id index for the whole chunk
+    sums = {}
+    item_count = 0
+    for bill_id, total, count in conn.execute(f'''
+            SELECT bill_id, SUM(amount), COUNT(*) FROM {items}
+            WHERE bill_id > ? AND bill_id <= ?
+            GROUP BY bill_id
+        ''', (after, rows[-1][0])):
+        sums[bill_id] = total
+        item_count += count
+    return rows, sums, item_count
+
+
+def reconcile(conn, fix=False, chunk_size=CHUNK_SIZE, progress=None):
+    """Compare every bill total with its items; returns a summary dict.
+
+    With ``fix`` drifted totals are set to the item sum. Each chunk is read (and
+    fixed) in its own transaction, IMMEDIATE when fixing so no billing trigger
+    can change a bill between the check and the update.
+    ``progress(summary)`` is called after every chunk.
+    """
+    summary = {'bills': 0, 'items': 0, 'drifted': 0, 'drift_total': 0.0, 'fixed': 0, 'samples': []}
+    for bills, items in LEDGERS:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (bills,)).fetchone():
+            continue
+        after = 0
+        while True:
+            conn.execute('BEGIN IMMEDIATE;' if fix else 'BEGIN;')
+            try:
+                rows, sums, item_count = _chunk(conn, bills, items, after, chunk_size)
+                drifted = []
+                for bill_id, total in rows:
+                    actual = sums.get(bill_id) or 0.0
+                    if abs((total or 0.0) - actual) > TOLERANCE:
+                        drifted.append((bill_id, total, actual))
+                if fix and drifted:
+                    conn.executemany(f'UPDATE {bills} SET total_amount = ? WHERE id = ?',
+                                     [(actual, bill_id) for bill_id, _, actual in drifted])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            if not rows:
+                break
+            after = rows[-1][0]
+            summary['bills'] += len(rows)
+            summary['items'] += item_count
+            summary['drifted'] += len(drifted)
+            if fix:
+                summary['fixed'] += len(drifted)
+            for bill_id, total, actual in drifted:
+                summary['drift_total'] += actual - (total or 0.0)
+                if len(summary['samples']) < MAX_REPORTED:
+                    summary['samples'].append({'table': bills, 'bill_id': bill_id, 'stored': total, 'actual': actual})
+            if progress:
+                progress(summary)
+    return summary
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description='Check bills.total_amount against SUM(bill_items.amount).')
+    ap.add_argument('path', nargs='?', default=db.DATABASE)
+    ap.add_argument('--fix', action='store_true', help='rewrite drifted totals')
+    ap.add_argument('--chunk', type=int, default=CHUNK_SIZE, help='bills per chunk (default %(default)s)')
+    args = ap.parse_args(argv[1:])
+
+    conn = db.connect(args.path)
+    start = last = time.perf_counter()
+
+    def progress(summary):
+        nonlocal last
+        now = time.perf_counter()
+        # a line every few seconds is enough on tens of millions of items
+        if now - last >= 5:
+            last = now
+            print(f"  {summary['bills']} bills, {summary['items']} items checked "
+                  f"({summary['items'] / (now - start):.0f} items/s)")
+
+    try:
+        summary = reconcile(conn, fix=args.fix, chunk_size=args.chunk, progress=progress)
+    finally:
+        conn.close()
+    elapsed = max(time.perf_counter() - start, 1e-6)
+    print(f"Checked {summary['bills']} bills / {summary['items']} items in {elapsed:.1f}s "
+          f"({summary['bills'] / elapsed:.0f} bills/s, {summary['items'] / elapsed:.0f} items/s).")
+    if not summary['drifted']:
+        print('All bill totals match their items.')
+        return 0
+    for s in summary['samples']:
+        print(f"{s['table']} #{s['bill_id']}: stored={s['stored']} actual={s['actual']:.2f}")
+    if summary['drifted'] > len(summary['samples']):
+        print(f"... and {summary['drifted'] - len(summary['samples'])} more")
+    print(f"{summary['drifted']} bill(s) drifted, net {summary['drift_total']:+.2f}.")
+    if args.fix:
+        print(f"Fixed {summary['fixed']} bill total(s).")
+        return 0
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,124 @@
+"""Medication catalogue: bulk loader and autocomplete check.
+
+``load`` streams a CSV/JSONL file of medications (name, description, price,
+as import_data.py) into the catalogue without creating duplicates. Names are
+compared ignoring case and spacing (refcache.fold_medication_name), against
+the table and against earlier rows of the same file. New names are inserted
+in batches with ``executemany``, one transaction per batch. Names already in
+the catalogue are skipped, or with ``--update`` get the file's description
+and price.
+
+``complete`` prints what the autocomplete endpoint (doctor.medication_autocomplete)
+would suggest for a prefix, and how long the in-memory lookup took.
+
+    python catalog.py load drugs.csv [--update] [--batch-size N] [--db path]
+    python catalog.py complete amox [--db path]
+"""
+import argparse
+import sys
+import time
+
+import db
+import import_data
+import migrations
+import refcache
+
+
+def load_catalog(conn, records, batch_size=5000, update=False, max_errors_shown=20):
+    """Insert (and with ``update`` refresh) medications from (line number, dict) records."""
+    spec = import_data.IMPORT_SPECS['medications']
+    summary = {'read': 0, 'inserted': 0, 'updated': 0, 'skipped': 0, 'rejected': 0}
+    # folded name -> id of the catalogue row it matches (None: added by this file)
+    known = {}
+    for medication_id, name in conn.execute('SELECT id, name FROM medications ORDER BY id'):
+        known.setdefault(refcache.fold_medication_name(name), medication_id)
+
+    inserts, updates = [], []
+
+    def flush():
+        if not inserts and not updates:
+            return
+        conn.execute('BEGIN;')
+        try:
+            conn.executemany('INSERT INTO medications (name, description, price) VALUES (?, ?, ?)', inserts)
+            conn.executemany('UPDATE medications SET description = COALESCE(?, description), '
+                             'price = COALESCE(?, price) WHERE id = ?', updates)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        summary['inserted'] += len(inserts)
+        summary['updated'] += len(updates)
+        inserts.clear()
+        updates.clear()
+
+    for lineno, record in records:
+        summary['read'] += 1
+        try:
+            name, description, price = import_data.validate(record, spec)
+        except import_data.RowError as ex:
+            summary['rejected'] += 1
+            if summary['rejected'] <= max_errors_shown:
+                print(f'  line {lineno}: {ex}')
+            continue
+        key = refcache.fold_medication_name(name)
+        if key not in known:
+            known[key] = None
+            inserts.append((' '.join(name.split()), description, price))
+        elif update and known[key] is not None:
+            updates.append((description, price, known[key]))
+        else:
+            summary['skipped'] += 1
+        if len(inserts) + len(updates) >= batch_size:
+            flush()
+    flush()
+    return summary
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Load the medication catalogue / try the autocomplete.')
+    sub = ap.add_subparsers(dest='command', required=True)
+    load = sub.add_parser('load', help='bulk load medications from CSV or JSONL')
+    load.add_argument('path', help="CSV/JSONL file ('-' for stdin)")
+    load.add_argument('--format', choices=['csv', 'jsonl'], help='default: from the file extension')
+    load.add_argument('--batch-size', type=int, default=5000, help='rows per transaction (default 5000)')
+    load.add_argument('--update', action='store_true', help='refresh description/price of names already listed')
+    complete = sub.add_parser('complete', help='show the suggestions for a prefix')
+    complete.add_argument('prefix')
+    complete.add_argument('--limit', type=int, default=refcache.COMPLETIONS)
+    for p in (load, complete):
+        p.add_argument('--db', default=db.DATABASE, help='database path')
+    args = ap.parse_args(argv)
+
+    conn = db.connect(args.db)
+    try:
+        migrations.migrate(conn)
+        if args.command == 'load':
+            if args.batch_size < 1:
+                ap.error('--batch-size must be positive')
+            start = time.perf_counter()
+            summary = load_catalog(conn, import_data.read_records(args.path, args.format),
+                                   args.batch_size, args.update)
+            elapsed = time.perf_counter() - start
+            rate = summary['read'] / elapsed if elapsed > 0 else 0
+            print(f"medications: read {summary['read']}, inserted {summary['inserted']}, "
+                  f"updated {summary['updated']}, already listed {summary['skipped']}, "
+                  f"rejected {summary['rejected']} in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+            return 1 if summary['rejected'] else 0
+
+        start = time.perf_counter()
+        refcache.medication_completions(conn, args.prefix, args.limit)
+        built = time.perf_counter()
+        found = refcache.medication_completions(conn, args.prefix, args.limit)
+        done = time.perf_counter()
+        for m in found:
+            print(f"{m['id']:>8}  {m['name']}  {m['price'] if m['price'] is not None else ''}")
+        print(f'{len(found)} suggestion(s); index built in {(built - start) * 1000:.1f} ms, '
+              f'lookup {(done - built) * 1e6:.0f} µs')
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""Self-check: run EXPLAIN QUERY PLAN on the SQL used by each route.
+
+Fails (exit status 1) when a query still does a full scan of one of the large
+tables instead of an index search. Keep ROUTE_QUERIES in step with the routes.
+Plans are computed on a statistics-free copy of the schema unless ``--live`` is
+given, in which case the database's own ANALYZE statistics are used.
+
+    python check_query_plans.py [--live] [path/to/hospital_management.db]
+"""
+import re
+import sqlite3
+import sys
+
+import db
+import migrations
+import timeline
+
+# tables that grow with hospital activity; a full SCAN of these is a failure
+LARGE_TABLES = {
+    'appointments', 'patients', 'doctors', 'treatments', 'prescriptions', 'prescription_items',
+    'bills', 'bill_items', 'lab_tests', 'room_assignments', 'med_dispense',
+    'appointments_archive', 'bill_items_archive', 'medications',
+    # one row per day (and doctor / department): must be read by day range
+    'rollup_revenue_daily', 'rollup_appointments_daily', 'rollup_treatments_daily',
+}
+
+# (route, sql, params, tables allowed to be scanned)
+ROUTE_QUERIES = [
+    ('admin.dashboard', 'SELECT * FROM stats_counters WHERE id = 1', (), set()),
+    # keyset-paginated listings: first page (ordered index walk stopped by LIMIT) and a cursor page
+    ('admin.patients', '''
+        SELECT p.*, d.f_name || ' ' || d.l_name AS doctor_name
+        FROM patients p
+        LEFT JOIN doctors d ON d.doctor_id = p.doctor
+        WHERE 1
+        ORDER BY p.id DESC
+        LIMIT ?
+    ''', (51,), set()),
+    ('admin.patients', '''
+        SELECT p.*, d.f_name || ' ' || d.l_name AS doctor_name
+        FROM patients p
+        LEFT JOIN doctors d ON d.doctor_id = p.doctor
+        WHERE p.id < ?
+        ORDER BY p.id DESC
+        LIMIT ?
+    ''', (1000, 51), set()),
+    ('admin.bills', '''
+        SELECT b.id, p.first_name || " " || p.last_name AS patient_name,
+               b.total_amount, b.paid, b.created_at
+        FROM bills b
+        JOIN patients p ON p.id = b.patient_id
+        WHERE (b.created_at, b.id) < (?, ?)
+        ORDER BY b.created_at DESC, b.id DESC
+        LIMIT ?
+    ''', ('2030-01-01 00:00:00', 1000, 51), set()),
+    ('admin.bills', '''
+        SELECT b.id, p.first_name || " " || p.last_name AS patient_name,
+               b.total_amount, b.paid, b.created_at
+        FROM bills b
+        JOIN patients p ON p.id = b.patient_id
+        WHERE (b.created_at, b.id) > (?, ?)
+        ORDER BY b.created_at ASC, b.id ASC
+        LIMIT ?
+    ''', ('2020-01-01 00:00:00', 1, 51), set()),
+    ('admin.update_patient', '''
+        SELECT a.*, d.doctor_id AS assigned_doctor_id, d.f_name || ' ' || d.l_name AS doctor_name
+        FROM appointments a
+        LEFT JOIN doctors d ON d.doctor_id = a.doctor_id
+        WHERE a.patient_id = ?
+        ORDER BY a.appointment_datetime DESC
+    ''', (1,), set()),
+    ('admin.appointments', '''
+        SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name, d.doctor_id, d.f_name || ' ' || d.l_name AS doctor_name
+        FROM appointments a
+        JOIN patients p ON p.id = a.patient_id
+        LEFT JOIN doctors d ON d.doctor_id = a.doctor_id
+        WHERE a.status = 'booked'
+        ORDER BY a.appointment_datetime ASC
+    ''', (), set()),
+    ('doctor.view_logs', '''
+        SELECT t.*, p.first_name || ' ' || p.last_name AS patient_name
+        FROM treatments t
+        LEFT JOIN patients p ON p.id = t.patient_id
+        WHERE t.id < ?
+        ORDER BY t.id DESC
+        LIMIT ?
+    ''', (1000, 51), set()),
+    ('doctor.add_treatment?patient_id', 'SELECT id, first_name, last_name FROM patients WHERE id = ?', (1,), set()),
+    # archive.py batch selection
+    ('archive.appointments', "SELECT id FROM appointments WHERE status IN ('completed', 'cancelled') AND appointment_datetime < ? LIMIT ?",
+     ('2025-01-01 00:00:00', 500), set()),
+    ('archive.bills', 'SELECT id FROM bills WHERE paid = 1 AND created_at < ? LIMIT ?', ('2025-01-01 00:00:00', 500), set()),
+    ('doctor.login', 'SELECT doctor_id, f_name, l_name, password FROM doctors WHERE username = ?', ('johndoe',), set()),
+    # scheduling.SCHEDULE: per-doctor reload of active appointments
+    ('scheduling.conflicts', "SELECT id, appointment_datetime FROM appointments WHERE doctor_id = ? AND status IN (?, ?)",
+     (1, 'booked', 'confirmed'), set()),
+    # assign.py: the booked queue, earliest first
+    ('admin.auto_assign', '''
+        SELECT a.id, a.doctor_id, a.appointment_datetime, p.doctor AS own_doctor, p.department
+        FROM appointments a
+        JOIN patients p ON p.id = a.patient_id
+        WHERE a.status = 'booked' AND a.appointment_datetime >= ?
+        ORDER BY a.appointment_datetime, a.id
+    ''', ('2026-01-01 00:00',), set()),
+    # rollups.py: incremental refresh and the reports page
+    ('rollups.refresh', "SELECT COUNT(*) FROM bill_items WHERE id > ? AND id <= ?", (0, 50000), set()),
+    ('rollups.refresh', "SELECT COUNT(*) FROM bill_items_archive WHERE id > ? AND id <= ?", (0, 50000), set()),
+    ('rollups.refresh', "SELECT COUNT(*) FROM treatments WHERE id > ? AND id <= ?", (0, 50000), set()),
+    ('rollups.refresh', '''
+        SELECT doctor_id, status, COUNT(*)
+        FROM (SELECT doctor_id, status FROM appointments
+              WHERE status IN ('booked', 'confirmed', 'completed', 'cancelled') AND appointment_datetime >= ? AND appointment_datetime < ?
+              UNION ALL
+              SELECT doctor_id, status FROM appointments_archive
+              WHERE status IN ('booked', 'confirmed', 'completed', 'cancelled') AND appointment_datetime >= ? AND appointment_datetime < ?)
+        GROUP BY 1, 2
+    ''', ('2026-01-01', '2026-01-01~', '2026-01-01', '2026-01-01~'), set()),
+    ('admin.reports', 'SELECT department, item_type, SUM(items), SUM(amount) FROM rollup_revenue_daily WHERE day >= ? AND day < ? GROUP BY department, item_type',
+     ('2026-01-01', '2026-02-01'), set()),
+    ('admin.reports', 'SELECT doctor_id, status, SUM(appointments) FROM rollup_appointments_daily WHERE day >= ? AND day < ? GROUP BY doctor_id, status',
+     ('2026-01-01', '2026-02-01'), set()),
+    ('admin.reports', 'SELECT doctor_id, SUM(treatments), SUM(cost) FROM rollup_treatments_daily WHERE day >= ? AND day < ? GROUP BY doctor_id',
+     ('2026-01-01', '2026-02-01'), set()),
+    ('admin.patients?q', '''
+        SELECT p.*, d.f_name || ' ' || d.l_name AS doctor_name, f.candidates
+        FROM (SELECT rowid, rank, count(*) OVER () AS candidates
+              FROM (SELECT rowid, rank FROM patients_fts WHERE patients_fts MATCH ? ORDER BY rowid DESC LIMIT ?)) f
+        JOIN patients p ON p.id = f.rowid
+        LEFT JOIN doctors d ON d.doctor_id = p.doctor
+        ORDER BY f.rank
+        LIMIT ?
+    ''', ('"smi"*', 1001, 50), set()),
+    ('doctor.add_treatment?q', '''
+        SELECT p.*, d.f_name || ' ' || d.l_name AS doctor_name, f.candidates
+        FROM (SELECT rowid, rank, count(*) OVER () AS candidates
+              FROM (SELECT rowid, rank FROM patients_fts WHERE patients_fts MATCH ? ORDER BY rowid DESC LIMIT ?)) f
+        JOIN patients p ON p.id = f.rowid
+        LEFT JOIN doctors d ON d.doctor_id = p.doctor
+        ORDER BY f.rank
+        LIMIT ?
+    ''', ('"smi"*', 1001, 20), set()),
+    ('doctor.search_notes', '''
+        SELECT f.note_id, f.patient_id, f.snippet, f.candidates,
+               p.first_name || ' ' || p.last_name AS patient_name,
+               coalesce(t.start_date, pr.created_at, a.appointment_datetime, aa.appointment_datetime) AS noted_at
+        FROM (SELECT note_id, patient_id, rank, snippet, count(*) OVER () AS candidates
+              FROM (SELECT rowid AS note_id, patient_id, rank,
+                           snippet(notes_fts, 1, char(2), char(3), '…', 16) AS snippet
+                    FROM notes_fts WHERE notes_fts MATCH ? ORDER BY rowid DESC LIMIT ?)) f
+        JOIN patients p ON p.id = f.patient_id
+        LEFT JOIN treatments t ON f.note_id % 4 = 1 AND t.id = f.note_id / 4
+        LEFT JOIN prescriptions pr ON f.note_id % 4 = 2 AND pr.id = f.note_id / 4
+        LEFT JOIN appointments a ON f.note_id % 4 = 3 AND a.id = f.note_id / 4
+        LEFT JOIN appointments_archive aa ON f.note_id % 4 = 3 AND aa.id = f.note_id / 4
+        WHERE p.doctor = ?
+        ORDER BY f.rank
+        LIMIT ?
+    ''', ('owner : "d1" AND body : ("fev"*)', 1001, 1, 50), set()),
+    ('doctor.doctor_profile', 'SELECT * FROM treatments WHERE doctor_id = ? AND (start_date, id) < (?, ?) ORDER BY start_date DESC, id DESC LIMIT ?', (1, '2030-01-01 00:00:00', 1000, 51), set()),
+    ('doctor.my_patients', 'SELECT id, first_name, last_name, phone FROM patients WHERE doctor = ?', (1,), set()),
+    ('doctor.dashboard', '''
+        SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name
+        FROM appointments a
+        LEFT JOIN patients p ON p.id = a.patient_id
+        WHERE a.doctor_id = ? AND a.status IN ('booked','confirmed')
+          AND a.appointment_datetime >= date('now') AND a.appointment_datetime < date('now', '+1 day')
+        ORDER BY a.appointment_datetime ASC
+    ''', (1,), set()),
+    ('doctor.dashboard', '''
+        SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name
+        FROM appointments a
+        LEFT JOIN patients p ON p.id = a.patient_id
+        WHERE a.doctor_id = ? AND a.status IN ('booked','confirmed')
+          AND a.appointment_datetime >= date('now', '+1 day')
+        ORDER BY a.appointment_datetime ASC
+        LIMIT ?
+    ''', (1, 10), set()),
+    ('doctor.view_appointments_doctor', '''
+        SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name
+        FROM appointments a
+        LEFT JOIN patients p ON p.id = a.patient_id
+        WHERE a.doctor_id = ? AND a.status IN ('booked','confirmed')
+        ORDER BY a.appointment_datetime ASC
+    ''', (1,), set()),
+    # prescribing.py: every new medication name of a prescription in one lookup
+    ('doctor.view_patient', 'SELECT id, name, price FROM medications WHERE name IN (?, ?) ORDER BY id',
+     ('Aspirin', 'Ibuprofen'), set()),
+    # timeline.py: a patient's whole chart (doctor.view_patient / open_appointment)
+    ('doctor.view_patient', timeline.EVENTS_SQL, (1,) * timeline.EVENTS_SQL.count('?'), set()),
+    ('patient.view_appointments', 'SELECT a.*, d.f_name || " " || d.l_name AS doctor_name FROM appointments a LEFT JOIN doctors d ON d.doctor_id = a.doctor_id WHERE a.patient_id = ? ORDER BY a.appointment_datetime DESC', (1,), set()),
+    # lookup done by the billing triggers for every treatment / prescription item / lab test
+    ('billing triggers', 'SELECT id FROM bills WHERE patient_id = ? AND paid = 0', (1,), set()),
+    ('billing triggers', 'SELECT b.id FROM prescriptions p JOIN bills b ON b.patient_id = p.patient_id AND b.paid = 0 WHERE p.id = ?', (1,), set()),
+]
+
+_ALIAS_RE = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+_SCAN_RE = re.compile(r'^SCAN (\w+)')
+_LIMIT_RE = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+_ORDER_RE = re.compile(r'\bORDER\s+BY\b', re.IGNORECASE)
+_WHERE_RE = re.compile(r'\bWHERE\b(.*?)(?:\bORDER\s+BY\b|\bGROUP\s+BY\b|\bLIMIT\b|$)', re.IGNORECASE | re.DOTALL)
+_SQL_WORDS = {'on', 'where', 'left', 'join', 'order', 'group', 'limit', 'inner', 'using'}
+
+
+def _aliases(sql):
+    names = {}
+    for table, alias in _ALIAS_RE.findall(sql):
+        names[table] = table
+        if alias and alias.lower() not in _SQL_WORDS:
+            names[alias] = table
+    return names
+
+
+def _filtered(sql, alias, names):
+    """Does the WHERE clause test any column of ``alias``? ('WHERE 1' does not.)"""
+    m = _WHERE_RE.search(sql)
+    if not m:
+        return False
+    where = m.group(1).strip()
+    if where in ('', '1'):
+        return False
+    if len(set(names.values())) == 1:
+        # single table: every predicate is on it
+        return True
+    return re.search(rf'\b{re.escape(alias)}\.', where) is not None
+
+
+def check(conn, queries=ROUTE_QUERIES):
+    """Return a list of (route, table, plan detail) for every disallowed scan.
+
+    A scan is accepted as bounded only when LIMIT cuts it off after a few rows:
+    the query has ORDER BY and LIMIT, the rows come out of the table or an index
+    already in that order (no temp B-tree sort), and the WHERE clause does not
+    filter the scanned table (a filter could skip any number of rows first).
+    """
+    problems = []
+    for route, sql, params, allowed in queries:
+        names = _aliases(sql)
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
+        ordered = (_LIMIT_RE.search(sql) and _ORDER_RE.search(sql)
+                   and not any(d.startswith('USE TEMP B-TREE') for d in plan))
+        for detail in plan:
+            m = _SCAN_RE.match(detail)
+            if not m:
+                continue
+            table = names.get(m.group(1), m.group(1))
+            if table not in LARGE_TABLES or table in allowed:
+                continue
+            if ordered and not _filtered(sql, m.group(1), names):
+                continue
+            problems.append((route, table, detail))
+    return problems
+
+
+def schema_copy(conn):
+    """In-memory copy of the schema without data or ANALYZE statistics.
+
+    With no statistics the planner assumes every table is large, so plans reflect
+    production sizes even when checking a small development database.
+    """
+    mem = db.connect(':memory:')
+    rows = conn.execute("""
+        SELECT type, sql FROM sqlite_master
+        WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+        ORDER BY CASE type WHEN 'table' THEN (CASE WHEN sql LIKE 'CREATE VIRTUAL%' THEN 0 ELSE 1 END)
+                           WHEN 'index' THEN 2 WHEN 'view' THEN 3 ELSE 4 END
+    """).fetchall()
+    for _type, sql in rows:
+        try:
+            mem.execute(sql)
+        except sqlite3.OperationalError as ex:
+            # shadow tables of virtual tables are created with their parent
+            if 'already exists' not in str(ex):
+                raise
+    return mem
+
+
+def main(argv):
+    live = '--live' in argv
+    args = [a for a in argv[1:] if a != '--live']
+    database = args[0] if args else db.DATABASE
+    conn = db.connect(database)
+    try:
+        if migrations.current_version(conn) < migrations.latest_version():
+            print('warning: database is behind the latest migration; run migrations.py first')
+        if live:
+            problems = check(conn)
+        else:
+            mem = schema_copy(conn)
+            try:
+                problems = check(mem)
+            finally:
+                mem.close()
+    finally:
+        conn.close()
+    for route, table, detail in problems:
+        print(f'FAIL {route}: full scan of {table} ({detail})')
+    if problems:
+        return 1
+    print(f'OK: {len(ROUTE_QUERIES)} route queries use indexes on large tables.')
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main(sys.argv))
+    except sqlite3.Error as ex:
+        sys.exit(f'query plan check failed: {ex}')
@@ -1,5 +1,90 @@
 import sqlite3
 
+import migrations
+
+# Billing triggers: every treatment, prescription item and completed lab test is
+# added to the patient's open (unpaid) bill, which is created on demand.
+# At most one open bill exists per patient (partial unique index
+# ux_bills_open_patient, migration 4), so "the open bill" is a plain equality probe
+# on (patient_id, paid = 0) -- no ORDER BY created_at DESC LIMIT 1 subqueries.
+# Prescription items inserted with batched = 1 are billed per prescription by
+# prescribing.prescribe instead (migration 12 re-applies these triggers).
+BILLING_TRIGGERS = """
+    CREATE TRIGGER IF NOT EXISTS trg_ensure_open_bill_after_insert_treatment
+    AFTER INSERT ON treatments
+    BEGIN
+        INSERT INTO bills(patient_id, total_amount, paid, created_at)
+        SELECT NEW.patient_id, 0, 0, datetime('now')
+        WHERE NOT EXISTS (SELECT 1 FROM bills b WHERE b.patient_id = NEW.patient_id AND b.paid = 0);
+
+        INSERT INTO bill_items(bill_id, item_type, item_ref, description, amount, created_at)
+        VALUES (
+            (SELECT id FROM bills WHERE patient_id = NEW.patient_id AND paid = 0),
+            'treatment',
+            NEW.id,
+            COALESCE(NEW.description,'Treatment'),
+            COALESCE(NEW.cost,0),
+            datetime('now')
+        );
+
+        -- the bill_items row just inserted already points at the open bill
+        UPDATE bills
+        SET total_amount = total_amount + COALESCE(NEW.cost,0)
+        WHERE id = (SELECT bill_id FROM bill_items WHERE id = last_insert_rowid());
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_prescription_item_after_insert
+    AFTER INSERT ON prescription_items
+    WHEN NEW.batched = 0
+    BEGIN
+        INSERT INTO bills(patient_id, total_amount, paid, created_at)
+        SELECT p.patient_id, 0, 0, datetime('now')
+        FROM prescriptions p
+        WHERE p.id = NEW.prescription_id
+          AND NOT EXISTS (SELECT 1 FROM bills b WHERE b.patient_id = p.patient_id AND b.paid = 0);
+
+        INSERT INTO bill_items(bill_id, item_type, item_ref, description, amount, created_at)
+        VALUES (
+            (SELECT b.id FROM prescriptions p JOIN bills b ON b.patient_id = p.patient_id AND b.paid = 0
+             WHERE p.id = NEW.prescription_id),
+            'medication',
+            NEW.id,
+            (SELECT m.name FROM medications m WHERE m.id = NEW.medication_id),
+            COALESCE(NEW.unit_price,0) * COALESCE(NEW.quantity,1),
+            datetime('now')
+        );
+
+        -- no need to resolve prescription -> patient -> bill a third time
+        UPDATE bills
+        SET total_amount = total_amount + (COALESCE(NEW.unit_price,0) * COALESCE(NEW.quantity,1))
+        WHERE id = (SELECT bill_id FROM bill_items WHERE id = last_insert_rowid());
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_lab_test_after_update_completed
+    AFTER UPDATE OF status ON lab_tests
+    WHEN NEW.status = 'completed' AND (OLD.status IS NULL OR OLD.status != 'completed')
+    BEGIN
+        INSERT INTO bills(patient_id, total_amount, paid, created_at)
+        SELECT NEW.patient_id, 0, 0, datetime('now')
+        WHERE NOT EXISTS (SELECT 1 FROM bills b WHERE b.patient_id = NEW.patient_id AND b.paid = 0);
+
+        INSERT INTO bill_items(bill_id, item_type, item_ref, description, amount, created_at)
+        VALUES (
+            (SELECT id FROM bills WHERE patient_id = NEW.patient_id AND paid = 0),
+            'lab_test',
+            NEW.id,
+            NEW.test_name,
+            COALESCE(NEW.cost,0),
+            datetime('now')
+        );
+
+        UPDATE bills
+        SET total_amount = total_amount + COALESCE(NEW.cost,0)
+        WHERE id = (SELECT bill_id FROM bill_items WHERE id = last_insert_rowid());
+    END;
+"""
+
+
 def create_hms_db(db_name="hospital_management.db"):
     conn = sqlite3.connect(db_name)
     c = conn.cursor()
@@ -83,7 +168,8 @@ def create_hms_db(db_name="hospital_management.db"):
         appointment_datetime TEXT NOT NULL,
         status TEXT NOT NULL CHECK(status IN ('booked','confirmed','cancelled','completed')) DEFAULT 'booked',
         notes TEXT,
-        fee REAL DEFAULT 0
+        fee REAL DEFAULT 0,
+        actions TEXT
     );
 
     -- -----------------------
@@ -121,7 +207,9 @@ def create_hms_db(db_name="hospital_management.db"):
         quantity INTEGER DEFAULT 1,
         unit_price REAL DEFAULT 0,
         fulfilled INTEGER DEFAULT 0,
-        fulfilled_at TEXT
+        fulfilled_at TEXT,
+        -- 1: billed per prescription by prescribing.prescribe, not by the trigger
+        batched INTEGER NOT NULL DEFAULT 0
     );
 
     -- -----------------------
@@ -175,150 +263,18 @@ def create_hms_db(db_name="hospital_management.db"):
         created_at TEXT DEFAULT (datetime('now'))
     );
 
-    -- -----------------------
-    -- Triggers
-    -- -----------------------
-    CREATE TRIGGER IF NOT EXISTS trg_ensure_open_bill_after_insert_treatment
-    AFTER INSERT ON treatments
-    BEGIN
-        INSERT INTO bills(patient_id, total_amount, paid, created_at)
-        SELECT NEW.patient_id, 0, 0, datetime('now')
-        WHERE NOT EXISTS (SELECT 1 FROM bills b WHERE b.patient_id = NEW.patient_id AND b.paid = 0);
-
-        INSERT INTO bill_items(bill_id, item_type, item_ref, description, amount, created_at)
-        VALUES (
-            (SELECT id FROM bills WHERE patient_id = NEW.patient_id AND paid = 0 ORDER BY created_at DESC LIMIT 1),
-            'treatment',
-            NEW.id,
-            COALESCE(NEW.description,'Treatment'),
-            COALESCE(NEW.cost,0),
-            datetime('now')
-        );
-
-        UPDATE bills
-        SET total_amount = total_amount + COALESCE(NEW.cost,0)
-        WHERE id = (SELECT id FROM bills WHERE patient_id = NEW.patient_id AND paid = 0 ORDER BY created_at DESC LIMIT 1);
-    END;
-
-    CREATE TRIGGER IF NOT EXISTS trg_prescription_item_after_insert
-    AFTER INSERT ON prescription_items
-    BEGIN
-        INSERT INTO bills(patient_id, total_amount, paid, created_at)
-        SELECT p.patient_id, 0, 0, datetime('now')
-        FROM prescriptions p
-        WHERE p.id = NEW.prescription_id
-          AND NOT EXISTS (SELECT 1 FROM bills b WHERE b.patient_id = p.patient_id AND b.paid = 0);
-
-        INSERT INTO bill_items(bill_id, item_type, item_ref, description, amount, created_at)
-        VALUES (
-            (SELECT id FROM bills WHERE patient_id = (SELECT patient_id FROM prescriptions WHERE id = NEW.prescription_id) AND paid = 0 ORDER BY created_at DESC LIMIT 1),
-            'medication',
-            NEW.id,
-            (SELECT m.name FROM medications m WHERE m.id = NEW.medication_id),
-            COALESCE(NEW.unit_price,0) * COALESCE(NEW.quantity,1),
-            datetime('now')
-        );
-
-        UPDATE bills
-        SET total_amount = total_amount + (COALESCE(NEW.unit_price,0) * COALESCE(NEW.quantity,1))
-        WHERE id = (SELECT id FROM bills WHERE patient_id = (SELECT patient_id FROM prescriptions WHERE id = NEW.prescription_id) AND paid = 0 ORDER BY created_at DESC LIMIT 1);
-    END;
-
-    CREATE TRIGGER IF NOT EXISTS trg_lab_test_after_update_completed
-    AFTER UPDATE OF status ON lab_tests
-    WHEN NEW.status = 'completed' AND (OLD.status IS NULL OR OLD.status != 'completed')
-    BEGIN
-        INSERT INTO bills(patient_id, total_amount, paid, created_at)
-        SELECT NEW.patient_id, 0, 0, datetime('now')
-        WHERE NOT EXISTS (SELECT 1 FROM bills b WHERE b.patient_id = NEW.patient_id AND b.paid = 0);
-
-        INSERT INTO bill_items(bill_id, item_type, item_ref, description, amount, created_at)
-        VALUES (
-            (SELECT id FROM bills WHERE patient_id = NEW.patient_id AND paid = 0 ORDER BY created_at DESC LIMIT 1),
-            'lab_test',
-            NEW.id,
-            NEW.test_name,
-            COALESCE(NEW.cost,0),
-            datetime('now')
-        );
-
-        UPDATE bills
-        SET total_amount = total_amount + COALESCE(NEW.cost,0)
-        WHERE id = (SELECT id FROM bills WHERE patient_id = NEW.patient_id AND paid = 0 ORDER BY created_at DESC LIMIT 1);
-    END;
     """
 
-    c.executescript(schema)
-    # --- Migration: ensure 'password' column exists on doctors for older DBs ---
-    try:
-        cols = [r[1] for r in c.execute("PRAGMA table_info(doctors);").fetchall()]
-        if 'password' not in cols:
-            c.execute("ALTER TABLE doctors ADD COLUMN password TEXT;")
-            print("Added 'password' column to doctors table (migration).")
-    except Exception:
-        # If doctors table doesn't exist yet or other issue, ignore here — schema creation above will handle it
-        pass
-    # --- Migration: ensure 'doctor' and 'department' columns exist on patients for older DBs ---
-    try:
-        pcols = [r[1] for r in c.execute("PRAGMA table_info(patients);").fetchall()]
-        if 'doctor' not in pcols:
-            c.execute("ALTER TABLE patients ADD COLUMN doctor INTEGER;")
-            print("Added 'doctor' column to patients table (migration).")
-        if 'department' not in pcols:
-            c.execute("ALTER TABLE patients ADD COLUMN department TEXT;")
-            print("Added 'department' column to patients table (migration).")
-    except Exception:
-        pass
-    # --- Migration: make appointments.doctor_id nullable if older DB has NOT NULL constraint ---
-    try:
-        ap_cols = c.execute("PRAGMA table_info(appointments);").fetchall()
-        # PRAGMA table_info returns rows: (cid, name, type, notnull, dflt_value, pk)
-        doctor_col = None
-        for col in ap_cols:
-            if col[1] == 'doctor_id':
-                doctor_col = col
-                break
-        if doctor_col is not None and doctor_col[3] == 1:
-            print("Found NOT NULL constraint on appointments.doctor_id — migrating to allow NULLs...")
-            # Disable foreign keys temporarily for table rebuild
-            c.execute('PRAGMA foreign_keys = OFF;')
-            # Rename old table
-            c.execute('ALTER TABLE appointments RENAME TO appointments_old;')
-            # Create new appointments table with doctor_id nullable
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS appointments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
-                    doctor_id INTEGER REFERENCES doctors(doctor_id) ON DELETE SET NULL,
-                    appointment_datetime TEXT NOT NULL,
-                    status TEXT NOT NULL CHECK(status IN ('booked','confirmed','cancelled','completed')) DEFAULT 'booked',
-                    notes TEXT,
-                    fee REAL DEFAULT 0
-                );
-            ''')
-            # Copy data across (keep existing doctor_id values)
-            c.execute('''
-                INSERT INTO appointments (id, patient_id, doctor_id, appointment_datetime, status, notes, fee)
-                SELECT id, patient_id, doctor_id, appointment_datetime, status, notes, fee FROM appointments_old;
-            ''')
-            # Drop old table
-            c.execute('DROP TABLE appointments_old;')
-            # Re-enable foreign keys
-            c.execute('PRAGMA foreign_keys = ON;')
-            print('Migrated appointments table to allow NULL doctor_id.')
-    except Exception as ex:
-        # If appointments table doesn't exist yet or migration fails, print and continue
-        print('appointments migration skipped or failed:', ex)
-    # --- Migration: ensure 'actions' column exists on appointments for older DBs ---
-    try:
-        acols = [r[1] for r in c.execute("PRAGMA table_info(appointments);").fetchall()]
-        if 'actions' not in acols:
-            c.execute("ALTER TABLE appointments ADD COLUMN actions TEXT;")
-            print("Added 'actions' column to appointments table (migration).")
-    except Exception:
-        # ignore if appointments table doesn't exist yet
-        pass
+    # an up-to-date database needs nothing: one header read instead of re-running the schema
+    if migrations.current_version(conn) >= migrations.latest_version():
+        conn.close()
+        print(f"Database '{db_name}' is already at schema version {migrations.latest_version()}.")
+        return
+    c.executescript(schema + BILLING_TRIGGERS)
     conn.commit()
+    # --- Versioned migrations, tracked in PRAGMA user_version (older databases
+    # first get the legacy column fixes, see migrations.LEGACY_STEPS) ---
+    migrations.migrate(conn)
     conn.close()
     print(f"✅ Database '{db_name}' created successfully with all tables and triggers.")
 
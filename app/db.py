@@ -0,0 +1,370 @@
+"""Shared SQLite data-access layer for the admin, doctor and patient blueprints.
+
+Connections are kept open in a small bounded pool instead of being opened and
+closed on every request. PRAGMAs are applied once, when a connection is first
+created. Each request checks out one connection through Flask's app context
+(``get_db()``) and it is handed back to the pool automatically at teardown.
+
+GET/HEAD requests get a connection from a second, separately sized pool of
+read-only connections (``mode=ro`` URI plus ``PRAGMA query_only``). Each one
+reads from a single WAL snapshot for the whole request, so heavy listings
+never hold up bookings and treatment inserts on the read/write pool.
+
+Query listeners (``add_query_listener``) make the pooled connections record
+the wall time, row count and calling route of every statement; see
+sql_metrics.py for the collector the app installs.
+"""
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+from flask import current_app, g, has_request_context, request
+
+# Use a path relative to this file so the app always finds the right DB
+DATABASE = os.environ.get('HMS_DATABASE', os.path.join(os.path.dirname(__file__), 'hospital_management.db'))
+# default number of connections kept per process (override with app.config['DB_POOL_SIZE'])
+POOL_SIZE = int(os.environ.get('HMS_POOL_SIZE', 8))
+# read-only connections for GET requests (override with app.config['DB_READ_POOL_SIZE'])
+READ_POOL_SIZE = int(os.environ.get('HMS_READ_POOL_SIZE', 8))
+# seconds to wait for a free connection (and sqlite busy timeout)
+POOL_TIMEOUT = 30
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def connect(database=DATABASE, timeout=POOL_TIMEOUT, readonly=False):
+    """Open a configured connection. Used by the pools and by offline scripts."""
+    # allow connections from different threads: a pooled connection is handed to
+    # whichever worker thread checks it out next
+    if readonly:
+        uri = 'file:' + quote(os.path.abspath(database)) + '?mode=ro'
+        conn = sqlite3.connect(uri, timeout=timeout, check_same_thread=False, uri=True)
+    else:
+        conn = sqlite3.connect(database, timeout=timeout, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    # per-connection PRAGMAs, applied once for the lifetime of the connection
+    if readonly:
+        conn.execute('PRAGMA query_only = ON;')
+    else:
+        conn.execute('PRAGMA foreign_keys = ON;')
+        conn.execute('PRAGMA synchronous = NORMAL;')
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by the threads of one process."""
+
+    def __init__(self, database=DATABASE, size=POOL_SIZE, timeout=POOL_TIMEOUT, readonly=False):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.readonly = readonly
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+        self._stats = {'hits': 0, 'misses': 0, 'waits': 0, 'timeouts': 0}
+        # callables(conn, records) run when a pooled connection is handed back
+        self.listeners = []
+
+    def _check_pid(self):
+        # connections must not be shared across fork(); start over in the child
+        if self._pid != os.getpid():
+            self._idle = []
+            self._created = 0
+            self._pid = os.getpid()
+
+    def acquire(self):
+        with self._cond:
+            self._check_pid()
+            waited = False
+            while True:
+                if self._idle:
+                    self._stats['hits'] += 1
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    self._stats['misses'] += 1
+                    break
+                if not waited:
+                    self._stats['waits'] += 1
+                    waited = True
+                if not self._cond.wait(self.timeout):
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'no database connection free after {self.timeout}s')
+        try:
+            return connect(self.database, self.timeout, self.readonly)
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        # never hand out a connection with a half-finished transaction
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self.discard(conn)
+            return
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._cond:
+            if self._pid == os.getpid():
+                self._created -= 1
+            self._cond.notify()
+
+    def connection(self):
+        raw = self.acquire()
+        if self.readonly:
+            # open the read transaction now: every query of the request sees the same
+            # WAL snapshot (it is rolled back when the connection is released)
+            raw.execute('BEGIN;')
+        return PooledConnection(self, raw)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._cond:
+            out = dict(self._stats)
+            out['size'] = self.size
+            out['readonly'] = self.readonly
+            out['open'] = self._created
+            out['idle'] = len(self._idle)
+        return out
+
+
+class QueryRecord:
+    """One executed statement: SQL, parameters, calling endpoint, seconds spent and rows."""
+    __slots__ = ('sql', 'params', 'endpoint', 'elapsed', 'rows')
+
+    def __init__(self, sql, params, endpoint):
+        self.sql = sql
+        self.params = params
+        self.endpoint = endpoint
+        self.elapsed = 0.0
+        self.rows = 0
+
+
+class TimedCursor:
+    """Cursor wrapper that adds fetch time and fetched rows to its QueryRecord."""
+
+    def __init__(self, cursor, record):
+        self._cursor = cursor
+        self._record = record
+
+    def _timed(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            self._record.elapsed += time.perf_counter() - start
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is not None:
+            self._record.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._timed(self._cursor.fetchmany, *args)
+        self._record.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._record.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self._timed(next, self._cursor)
+        self._record.rows += 1
+        return row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedConnection:
+    """sqlite3 connection wrapper that records every ``execute``/``executemany``.
+
+    When ``listeners`` is not empty, statements are timed into QueryRecords and
+    ``flush()`` passes them to the listeners. A statement is attributed to the
+    current request's endpoint, or outside a request to ``endpoint`` (the writer
+    thread sets it to the route that submitted the unit).
+    """
+
+    def __init__(self, conn, listeners=()):
+        self._conn = conn
+        self._listeners = listeners
+        self._records = [] if listeners else None
+        self.endpoint = None
+
+    def _live(self):
+        return self._conn
+
+    def _run(self, method, sql, params):
+        conn = self._live()
+        if self._records is None:
+            return getattr(conn, method)(sql, params)
+        endpoint = request.endpoint if has_request_context() else self.endpoint
+        # executemany parameters may be a one-shot iterator; don't keep them
+        record = QueryRecord(sql, params if method == 'execute' else None, endpoint)
+        self._records.append(record)
+        start = time.perf_counter()
+        try:
+            cur = getattr(conn, method)(sql, params)
+        finally:
+            record.elapsed = time.perf_counter() - start
+        if cur.description is None:
+            # INSERT/UPDATE/DELETE: nothing to fetch, count affected rows
+            record.rows = max(cur.rowcount, 0)
+            return cur
+        return TimedCursor(cur, record)
+
+    def execute(self, sql, params=()):
+        return self._run('execute', sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._run('executemany', sql, seq_of_params)
+
+    def flush(self):
+        """Hand the records so far to the listeners (the connection is still usable, e.g. for EXPLAIN)."""
+        if not self._records:
+            return
+        records, self._records = self._records, []
+        for listener in list(self._listeners):
+            try:
+                listener(self._conn, records)
+            except Exception as e:
+                # instrumentation must never break a request
+                print('query listener failed:', e)
+
+    def __getattr__(self, name):
+        return getattr(self._live(), name)
+
+
+class PooledConnection(TimedConnection):
+    """Thin wrapper around a pooled sqlite3 connection.
+
+    Behaves like the connection itself, except ``close()`` returns it to the pool,
+    so route code that already calls ``conn.close()`` keeps working unchanged.
+    When the pool has query listeners, ``execute``/``executemany`` are timed and
+    the records are passed to the listeners as the connection is handed back.
+    """
+
+    def __init__(self, pool, conn):
+        super().__init__(conn, pool.listeners)
+        self._pool = pool
+        # read-only connections are already in their snapshot transaction by now;
+        # caches use this to tell whether a read could predate a write (timeline.py)
+        self.opened = time.monotonic()
+
+    @property
+    def closed(self):
+        return self._conn is None
+
+    def _live(self):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a connection returned to the pool.')
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self.flush()
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    # ``with conn:`` commits or rolls back like a sqlite3 connection, but the
+    # block keeps using this wrapper (pool guard and timing)
+    def __enter__(self):
+        self._live().__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._live().__exit__(*exc)
+
+
+# guards lazy pool creation, so concurrent first requests share one pool
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(app=None, readonly=False):
+    """Return the read/write (or read-only) pool for the (current) app.
+
+    ``init_app`` creates both; an app that skipped it gets them on first use.
+    """
+    app = app or current_app
+    key = 'hms_db_read_pool' if readonly else 'hms_db_pool'
+    pool = app.extensions.get(key)
+    if pool is None:
+        with _POOLS_LOCK:
+            pool = app.extensions.get(key)
+            if pool is None:
+                size = app.config.get('DB_READ_POOL_SIZE', READ_POOL_SIZE) if readonly else app.config.get('DB_POOL_SIZE', POOL_SIZE)
+                pool = ConnectionPool(app.config.get('DATABASE', DATABASE), size=size, readonly=readonly)
+                app.extensions[key] = pool
+    return pool
+
+
+def get_db(readonly=None):
+    """Connection for the current request; checked out once and reused until teardown.
+
+    By default GET/HEAD requests get a read-only snapshot connection and every
+    other method the read/write one. Routes that write on GET pass readonly=False.
+    """
+    if readonly is None:
+        readonly = has_request_context() and request.method in ('GET', 'HEAD')
+    key = '_hms_db_ro' if readonly else '_hms_db'
+    conn = g.get(key)
+    if conn is None or conn.closed:
+        conn = get_pool(readonly=readonly).connection()
+        setattr(g, key, conn)
+    return conn
+
+
+def close_db(exc=None):
+    for key in ('_hms_db', '_hms_db_ro'):
+        conn = g.pop(key, None)
+        if conn is not None:
+            conn.close()
+
+
+def pool_stats():
+    return {'read_write': get_pool().stats(), 'read_only': get_pool(readonly=True).stats()}
+
+
+def add_query_listener(listener, app=None):
+    """Call ``listener(conn, records)`` with the QueryRecords of every pooled connection
+    (both pools) when it is returned to the pool (``conn`` is still usable, e.g. for EXPLAIN)."""
+    get_pool(app).listeners.append(listener)
+    get_pool(app, readonly=True).listeners.append(listener)
+
+
+def init_app(app):
+    # both pools up front (connections are still opened on demand)
+    get_pool(app)
+    get_pool(app, readonly=True)
+    app.teardown_appcontext(close_db)
@@ -1,40 +1,57 @@
-from flask import Blueprint, render_template, request, redirect, url_for
-import sqlite3
-import os
+from flask import Blueprint, render_template, request, redirect, url_for, jsonify
+from db import get_db
+from writer import execute_write, run_write, WriteTimeout
+from pagination import paginate, paginate_rows, page_size
+import accounts
+import refcache
+import prescribing
+import search
+import timeline
 
 doctor_bp = Blueprint('doctor', __name__)
 
-# DB path relative to this module
-DATABASE = os.path.join(os.path.dirname(__file__), 'hospital_management.db')
+# number of upcoming (after today) appointments shown on the dashboard
+UPCOMING_LIMIT = 10
 
-def get_conn():
-    # increase timeout and allow connections from different threads (dev server may use threads)
-    conn = sqlite3.connect(DATABASE, timeout=30, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    try:
-        conn.execute('PRAGMA foreign_keys = ON;')
-    except Exception:
-        pass
-    return conn
+# patients offered by the add-treatment picker for one search
+PICKER_LIMIT = 20
 
 
 @doctor_bp.route('/logs')
 def view_logs():
-    conn = get_conn()
+    conn = get_db()
     # include patient name for better display
-    logs = conn.execute('''
+    page = paginate(conn, '''
         SELECT t.*, p.first_name || ' ' || p.last_name AS patient_name
         FROM treatments t
         LEFT JOIN patients p ON p.id = t.patient_id
-        ORDER BY t.id DESC
-    ''').fetchall()
+        WHERE {keyset}
+        ORDER BY {order}
+        LIMIT ?
+    ''', keys=(('t.id', 'id'),))
     conn.close()
-    return render_template('doctor_logs.html', logs=logs)
+    return render_template('doctor_logs.html', logs=page.rows, page=page)
+
+
+@doctor_bp.route('/search')
+def search_notes():
+    """Full-text search over the clinical notes of the logged-in doctor's patients."""
+    from flask import session, flash
+    if not session.get('doctor_logged_in'):
+        flash('Please login as doctor')
+        return redirect(url_for('doctor.login'))
+    q = request.args.get('q', '').strip()
+    results = []
+    if q:
+        conn = get_db()
+        results = search.search_notes(conn, session.get('doctor_id'), q, limit=page_size())
+        conn.close()
+    return render_template('doctor_search.html', q=q, results=results)
 
 
 @doctor_bp.route('/add_treatment', methods=['GET', 'POST'])
 def add_treatment():
-    conn = get_conn()
+    conn = get_db()
     if request.method == 'POST':
         pid = request.form['patient_id']
         # prefer using logged-in doctor id
@@ -48,28 +65,40 @@ def add_treatment():
             did = session.get('doctor_id')
 
         details = request.form['details']
-        conn.execute("INSERT INTO treatments (patient_id, doctor_id, description) VALUES (?, ?, ?)", (pid, did, details))
-        conn.commit()
         conn.close()
+        try:
+            execute_write("INSERT INTO treatments (patient_id, doctor_id, description) VALUES (?, ?, ?)", (pid, did, details))
+        except WriteTimeout as e:
+            # the treatment may still be saved (e.committed is None): see the logs
+            from flask import flash
+            flash(str(e))
+            return redirect(url_for('doctor.view_logs'))
+        timeline.invalidate(pid)
         return redirect(url_for('doctor.view_logs'))
 
-    # GET: render simple form with patients and doctors
-    patients = conn.execute('SELECT id, first_name, last_name FROM patients').fetchall()
-    doctors = conn.execute('SELECT doctor_id, f_name, l_name FROM doctors').fetchall()
+    # GET: the patient is picked from a name/phone search (search.py), never a
+    # list of every patient; ?patient_id= preselects one (primary key lookup)
+    q = request.args.get('q', '').strip()
+    patients = search.search_patients(conn, q, limit=PICKER_LIMIT) if q else []
+    selected = request.args.get('patient_id', type=int)
+    if selected is not None and not any(p['id'] == selected for p in patients):
+        row = conn.execute('SELECT id, first_name, last_name FROM patients WHERE id = ?', (selected,)).fetchone()
+        if row:
+            patients = [row] + list(patients)
+    doctors = refcache.doctor_choices(conn)
     conn.close()
-    return render_template('add_treatment.html', patients=patients, doctors=doctors)
+    return render_template('add_treatment.html', patients=patients, doctors=doctors, q=q, selected=selected)
 
 
 @doctor_bp.route('/login', methods=['GET', 'POST'])
 def login():
     from flask import session, flash
-    conn = get_conn()
+    conn = get_db()
     if request.method == 'POST':
         username = request.form.get('username','').strip()
         password = request.form.get('password','')
-        # username is f_name + l_name (no space)
-        # try to find matching doctor
-        row = conn.execute("SELECT * FROM doctors WHERE (f_name || l_name) = ? AND password = ?", (username, password)).fetchone()
+        # username is f_name + l_name (no space), any case; see accounts.py
+        row = accounts.authenticate(conn, username, password)
         if row:
             session['doctor_logged_in'] = True
             session['doctor_id'] = row['doctor_id']
@@ -96,7 +125,7 @@ def logout():
 @doctor_bp.route('/treatment/edit/<int:tid>', methods=['GET', 'POST'])
 def edit_treatment(tid):
     from flask import session, flash
-    conn = get_conn()
+    conn = get_db()
     treatment = conn.execute('SELECT t.*, p.first_name || " " || p.last_name AS patient_name FROM treatments t LEFT JOIN patients p ON p.id = t.patient_id WHERE t.id = ?', (tid,)).fetchone()
     if not treatment:
         conn.close()
@@ -111,9 +140,13 @@ def edit_treatment(tid):
 
     if request.method == 'POST':
         desc = request.form.get('description')
-        conn.execute('UPDATE treatments SET description = ? WHERE id = ?', (desc, tid))
-        conn.commit()
         conn.close()
+        try:
+            execute_write('UPDATE treatments SET description = ? WHERE id = ?', (desc, tid))
+        except WriteTimeout as e:
+            flash(str(e))
+            return redirect(url_for('doctor.view_logs'))
+        timeline.invalidate(treatment['patient_id'])
         flash('Treatment updated')
         return redirect(url_for('doctor.view_logs'))
 
@@ -123,19 +156,20 @@ def edit_treatment(tid):
 
 @doctor_bp.route('/doctors')
 def list_doctors():
-    conn = get_conn()
-    doctors = conn.execute('SELECT * FROM doctors ORDER BY created_at DESC').fetchall()
+    conn = get_db()
+    page = paginate_rows(refcache.doctors(conn), keys=('created_at', 'doctor_id'))
     conn.close()
-    return render_template('doctors.html', doctors=doctors)
+    return render_template('doctors.html', doctors=page.rows, page=page)
 
 
 @doctor_bp.route('/profile/<int:did>')
 def doctor_profile(did):
-    conn = get_conn()
-    doc = conn.execute('SELECT * FROM doctors WHERE doctor_id = ?', (did,)).fetchone()
-    treatments = conn.execute('SELECT * FROM treatments WHERE doctor_id = ? ORDER BY start_date DESC', (did,)).fetchall()
+    conn = get_db()
+    doc = refcache.get_doctor(conn, did)
+    page = paginate(conn, 'SELECT * FROM treatments WHERE doctor_id = ? AND {keyset} ORDER BY {order} LIMIT ?',
+                    (did,), keys=(('start_date', 'start_date'), ('id', 'id')))
     conn.close()
-    return render_template('doctor_profile.html', doctor=doc, treatments=treatments)
+    return render_template('doctor_profile.html', doctor=doc, treatments=page.rows, page=page)
 
 
 @doctor_bp.route('/patients')
@@ -146,7 +180,7 @@ def my_patients():
         flash('Please login as doctor')
         return redirect(url_for('doctor.login'))
     did = session.get('doctor_id')
-    conn = get_conn()
+    conn = get_db()
     patients = conn.execute('SELECT id, first_name, last_name, phone FROM patients WHERE doctor = ?', (did,)).fetchall()
     conn.close()
     return render_template('doctor_patients.html', patients=patients)
@@ -160,17 +194,29 @@ def dashboard():
         flash('Please login as doctor')
         return redirect(url_for('doctor.login'))
     did = session.get('doctor_id')
-    conn = get_conn()
-    # select appointments for today for this doctor
+    conn = get_db()
+    # select appointments for today for this doctor. appointment_datetime is stored as
+    # 'YYYY-MM-DD HH:MM', so a range on the bare column is an index range seek
     rows = conn.execute('''
         SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name
         FROM appointments a
         LEFT JOIN patients p ON p.id = a.patient_id
-        WHERE a.doctor_id = ? AND date(a.appointment_datetime) = date('now') AND a.status IN ('booked','confirmed')
+        WHERE a.doctor_id = ? AND a.status IN ('booked','confirmed')
+          AND a.appointment_datetime >= date('now') AND a.appointment_datetime < date('now', '+1 day')
         ORDER BY a.appointment_datetime ASC
     ''', (did,)).fetchall()
+    # next few appointments after today
+    upcoming = conn.execute('''
+        SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name
+        FROM appointments a
+        LEFT JOIN patients p ON p.id = a.patient_id
+        WHERE a.doctor_id = ? AND a.status IN ('booked','confirmed')
+          AND a.appointment_datetime >= date('now', '+1 day')
+        ORDER BY a.appointment_datetime ASC
+        LIMIT ?
+    ''', (did, UPCOMING_LIMIT)).fetchall()
     conn.close()
-    return render_template('doctor_dashboard.html', rows=rows)
+    return render_template('doctor_dashboard.html', rows=rows, upcoming=upcoming)
 
 
 @doctor_bp.route('/appointments')
@@ -181,7 +227,7 @@ def view_appointments_doctor():
         flash('Please login as doctor')
         return redirect(url_for('doctor.login'))
     did = session.get('doctor_id')
-    conn = get_conn()
+    conn = get_db()
     rows = conn.execute('''
         SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name
         FROM appointments a
@@ -201,7 +247,7 @@ def open_appointment(aid):
         flash('Please login as doctor')
         return redirect(url_for('doctor.login'))
     did = session.get('doctor_id')
-    conn = get_conn()
+    conn = get_db()
     appt = conn.execute('''
         SELECT a.*, p.first_name || ' ' || p.last_name AS patient_name, p.id AS patient_id
         FROM appointments a
@@ -222,14 +268,41 @@ def open_appointment(aid):
     # handle adding a treatment note
     if request.method == 'POST':
         details = request.form.get('details') or ''
-        conn.execute('INSERT INTO treatments (patient_id, doctor_id, description, start_date) VALUES (?, ?, ?, datetime("now"))', (appt['patient_id'], did, details))
-        conn.commit()
-        flash('Treatment note added')
+        try:
+            execute_write('INSERT INTO treatments (patient_id, doctor_id, description, start_date) VALUES (?, ?, ?, datetime("now"))', (appt['patient_id'], did, details))
+        except WriteTimeout as e:
+            # may still commit (e.committed is None); the chart catches up within TIMELINE_TTL
+            flash(str(e))
+        else:
+            timeline.invalidate(appt['patient_id'])
+            flash('Treatment note added')
 
-    # reload treatments for the patient
-    treatments = conn.execute('SELECT * FROM treatments WHERE patient_id = ? ORDER BY start_date DESC', (appt['patient_id'],)).fetchall()
+    # the patient's chart, newest first (cached until the next write for this patient)
+    page = paginate_rows(timeline.events(conn, appt['patient_id']), keys=('at', 'kind', 'id'))
     conn.close()
-    return render_template('doctor_appointment.html', appointment=appt, treatments=treatments)
+    return render_template('doctor_appointment.html', appointment=appt, events=page.rows, page=page)
+
+
+def _prescription_items(conn, raw):
+    """Validated items for prescribing.prescribe, with medication ids the cache
+    already knows, so the writer only resolves new names."""
+    items = prescribing.clean_items(raw)
+    for item in items:
+        # 'aspirin ' is the catalogue's 'Aspirin', not a new medication
+        known = refcache.medication_by_name(conn, item['name']) or refcache.medication_by_folded_name(conn, item['name'])
+        if known is not None:
+            item['medication_id'] = known['id']
+            if item['unit_price'] is None:
+                item['unit_price'] = known['price'] or 0
+    return items
+
+
+def _write_prescription(pid, did, items, notes):
+    summary = run_write(prescribing.prescribe, pid, did, items, notes)
+    if summary['created']:
+        refcache.invalidate('medications')
+    timeline.invalidate(pid)
+    return summary
 
 
 @doctor_bp.route('/patient/<int:pid>', methods=['GET', 'POST'])
@@ -240,7 +313,7 @@ def view_patient(pid):
         flash('Please login as doctor')
         return redirect(url_for('doctor.login'))
     did = session.get('doctor_id')
-    conn = get_conn()
+    conn = get_db()
     patient = conn.execute('SELECT * FROM patients WHERE id = ?', (pid,)).fetchone()
     if not patient:
         conn.close()
@@ -252,31 +325,84 @@ def view_patient(pid):
         action = request.form.get('action')
         if action == 'add_symptom':
             desc = request.form.get('description')
-            conn.execute('INSERT INTO treatments (patient_id, doctor_id, description, start_date) VALUES (?, ?, ?, datetime("now"))', (pid, did, desc))
-            conn.commit()
-            flash('Symptom / treatment note added')
+            try:
+                execute_write('INSERT INTO treatments (patient_id, doctor_id, description, start_date) VALUES (?, ?, ?, datetime("now"))', (pid, did, desc))
+            except WriteTimeout as e:
+                flash(str(e))
+            else:
+                timeline.invalidate(pid)
+                flash('Symptom / treatment note added')
         elif action == 'prescribe':
-            med_name = request.form.get('medication_name')
-            dosage = request.form.get('dosage')
-            qty = int(request.form.get('quantity') or 1)
-            unit_price = float(request.form.get('unit_price') or 0)
-            # ensure medication exists (simple upsert)
-            m = conn.execute('SELECT id FROM medications WHERE name = ?', (med_name,)).fetchone()
-            if not m:
-                cur = conn.execute('INSERT INTO medications (name, description, price) VALUES (?, ?, ?)', (med_name, '', unit_price))
-                medication_id = cur.lastrowid
+            # one row per medication: medication_name / dosage / quantity / unit_price repeat
+            form = request.form
+            raw = [{'name': name, 'dosage': dosage, 'quantity': quantity, 'unit_price': unit_price}
+                   for name, dosage, quantity, unit_price in zip(
+                       form.getlist('medication_name'), form.getlist('dosage'),
+                       form.getlist('quantity'), form.getlist('unit_price'))]
+            try:
+                items = _prescription_items(conn, raw)
+                summary = _write_prescription(pid, did, items, form.get('notes') or '')
+            except (ValueError, WriteTimeout) as e:
+                # on a WriteTimeout the prescription may still be written (e.committed is None)
+                flash(str(e))
             else:
-                medication_id = m['id']
-
-            # create prescription
-            cur = conn.execute('INSERT INTO prescriptions (patient_id, doctor_id, notes) VALUES (?, ?, ?)', (pid, did, request.form.get('notes') or ''))
-            presc_id = cur.lastrowid
-            # add item
-            conn.execute('INSERT INTO prescription_items (prescription_id, medication_id, dosage, quantity, unit_price) VALUES (?, ?, ?, ?, ?)', (presc_id, medication_id, dosage, qty, unit_price))
-            conn.commit()
-            flash('Prescription created')
-
-    treatments = conn.execute('SELECT * FROM treatments WHERE patient_id = ? ORDER BY start_date DESC', (pid,)).fetchall()
-    prescriptions = conn.execute('SELECT * FROM prescriptions WHERE patient_id = ? ORDER BY created_at DESC', (pid,)).fetchall()
+                flash(f"Prescription created ({summary['items']} item(s), ${summary['total']:.2f})")
+
+    page = paginate_rows(timeline.events(conn, pid), keys=('at', 'kind', 'id'))
+    conn.close()
+    return render_template('doctor_patient.html', patient=patient, events=page.rows, page=page)
+
+
+@doctor_bp.route('/patient/<int:pid>/prescriptions', methods=['POST'])
+def prescribe_batch(pid):
+    """JSON batch prescribe: {"items": [{"name", "dosage", "quantity", "unit_price"}, ...], "notes": ""}."""
+    from flask import session
+    if not session.get('doctor_logged_in'):
+        return jsonify({'error': 'login required'}), 401
+    data = request.get_json(silent=True) or {}
+    conn = get_db()
+    if not conn.execute('SELECT 1 FROM patients WHERE id = ?', (pid,)).fetchone():
+        conn.close()
+        return jsonify({'error': 'patient not found'}), 404
+    try:
+        items = _prescription_items(conn, data.get('items'))
+    except (ValueError, AttributeError) as e:
+        conn.close()
+        return jsonify({'error': str(e) if isinstance(e, ValueError) else 'items must be objects'}), 400
+    conn.close()
+    try:
+        summary = _write_prescription(pid, session.get('doctor_id'), items, data.get('notes') or '')
+    except WriteTimeout as e:
+        # committed is null when the prescription may still be written
+        return jsonify({'error': str(e), 'committed': e.committed}), 503
+    return jsonify(summary), 201
+
+
+@doctor_bp.route('/medications/autocomplete')
+def medication_autocomplete():
+    """JSON suggestions for the prescription form: ?q=<prefix>[&limit=N]."""
+    from flask import session
+    if not session.get('doctor_logged_in'):
+        return jsonify({'error': 'login required'}), 401
+    limit = max(1, min(request.args.get('limit', refcache.COMPLETIONS, type=int), 50))
+    conn = get_db()
+    found = refcache.medication_completions(conn, request.args.get('q', ''), limit)
+    conn.close()
+    return jsonify([{'id': m['id'], 'name': m['name'], 'price': m['price']} for m in found])
+
+
+@doctor_bp.route('/patient/<int:pid>/timeline')
+def patient_timeline(pid):
+    """JSON page of the patient's timeline; ?after= / ?before= cursors as on the chart page."""
+    from flask import session
+    if not session.get('doctor_logged_in'):
+        return jsonify({'error': 'login required'}), 401
+    conn = get_db()
+    page = paginate_rows(timeline.events(conn, pid), keys=('at', 'kind', 'id'))
     conn.close()
-    return render_template('doctor_patient.html', patient=patient, treatments=treatments, prescriptions=prescriptions)
+    return jsonify({
+        'patient_id': pid,
+        'events': page.rows,
+        'next': page.next_cursor,
+        'prev': page.prev_cursor,
+    })
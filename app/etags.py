@@ -0,0 +1,87 @@
+"""ETags for the JSON listings (api_routes.py) from per-table change counters.
+
+Migration 13 adds 'appointments' and 'patients' rows to ``cache_versions``
+(refcache.py already keeps 'doctors' and 'medications' there). Triggers bump
+them on every change to the listed columns. A listing's ETag is a hash of the
+versions of the tables it reads, the request path with its query string and
+the logged-in user. Answering ``If-None-Match`` therefore takes one primary
+key lookup and no listing query. The versions are read on the request's
+snapshot connection, so they always describe the same data the listing would
+return. Processes share them, so an ETag from one worker is valid on another.
+"""
+import hashlib
+
+from flask import current_app, jsonify, request
+
+SCHEMA = """
+INSERT OR IGNORE INTO cache_versions(name) VALUES ('appointments');
+INSERT OR IGNORE INTO cache_versions(name) VALUES ('patients');
+
+CREATE TRIGGER IF NOT EXISTS trg_cache_appointments_insert AFTER INSERT ON appointments
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'appointments';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_cache_appointments_update AFTER UPDATE ON appointments
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'appointments';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_cache_appointments_delete AFTER DELETE ON appointments
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'appointments';
+END;
+-- archive.py moves rows (appointments delete + archive insert); patient deletes cascade
+CREATE TRIGGER IF NOT EXISTS trg_cache_appointments_archive_insert AFTER INSERT ON appointments_archive
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'appointments';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_cache_appointments_archive_delete AFTER DELETE ON appointments_archive
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'appointments';
+END;
+
+-- listings show patient names only; new patients have no appointments yet
+CREATE TRIGGER IF NOT EXISTS trg_cache_patients_update AFTER UPDATE OF first_name, last_name ON patients
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'patients';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_cache_patients_delete AFTER DELETE ON patients
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'patients';
+END;
+"""
+
+
+def versions(conn, tables):
+    """{table: version} for the given tables; None if any counter is missing."""
+    marks = ', '.join('?' for _ in tables)
+    rows = dict(conn.execute(f'SELECT name, version FROM cache_versions WHERE name IN ({marks})', tuple(tables)))
+    if len(rows) != len(tables):
+        return None
+    return rows
+
+
+def listing_etag(conn, tables, scope=None):
+    """The ETag of the current request's listing over ``tables``, or None (no counters)."""
+    found = versions(conn, tables)
+    if found is None:
+        return None
+    key = repr((request.full_path, scope, sorted(found.items())))
+    return hashlib.sha1(key.encode()).hexdigest()[:24]
+
+
+def conditional_json(conn, tables, build, scope=None):
+    """304 if the client's If-None-Match still matches, else ``jsonify(build(conn))``.
+
+    ``build`` runs only for a changed (or first) request; ``scope`` is whatever
+    else the result depends on, such as the logged-in user.
+    """
+    etag = listing_etag(conn, tables, scope)
+    if etag is not None and request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build(conn))
+    if etag is not None:
+        response.set_etag(etag)
+        # may be stored, but must be revalidated (cheaply, above) on every use
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,274 @@
+"""Deterministic synthetic data generator for benchmarks and load testing.
+
+Builds a fresh database with the create_hms_db schema and fills it with
+doctors, patients, medications, rooms, appointments, treatments, prescriptions
+and lab tests. Charges go through the normal INSERTs so the billing triggers
+create the bills; a share of open bills is settled as the history advances,
+so billing stays consistent (each bill total equals the sum of its items).
+The same --seed (and --today) always produces the same data.
+
+    python generate_data.py bench.db --doctors 200 --patients 100000 --appointments 300000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from io import StringIO
+
+import db
+from create_hms_db import create_hms_db
+from scheduling import CANONICAL_FORMAT
+
+FIRST_NAMES = ['James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William',
+               'Elizabeth', 'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah',
+               'Charles', 'Karen', 'Wei', 'Priya', 'Ahmed', 'Sofia', 'Kenji', 'Amara', 'Luis', 'Olga']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+              'Martinez', 'Hernandez', 'Lopez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson',
+              'Martin', 'Lee', 'Patel', 'Chen', 'Khan', 'Novak', 'Tanaka', 'Okafor', 'Silva', 'Ivanova']
+STREETS = ['Main St', 'Oak Ave', 'Maple Dr', 'Cedar Ln', 'Park Rd', 'Elm St', 'Pine St', 'Lake View']
+DEPARTMENTS = {
+    'Cardiology': 'Cardiologist', 'Neurology': 'Neurologist', 'Orthopedics': 'Orthopedic Surgeon',
+    'Pediatrics': 'Pediatrician', 'General Medicine': 'Physician', 'Dermatology': 'Dermatologist',
+    'Oncology': 'Oncologist', 'Radiology': 'Radiologist',
+}
+AVAILABILITY = ['Mon-Fri 09:00-17:00', 'Mon-Wed 08:00-14:00', 'Thu-Sat 10:00-18:00', 'Mon-Fri 13:00-21:00']
+SYMPTOMS = ['fever', 'persistent cough', 'chest pain', 'migraine', 'back pain', 'rash', 'fatigue',
+            'shortness of breath', 'joint swelling', 'abdominal pain', 'dizziness', 'sore throat']
+TREATMENTS = ['consultation', 'x-ray', 'blood panel review', 'physiotherapy session', 'ECG', 'MRI review',
+              'wound dressing', 'follow-up visit', 'vaccination', 'minor procedure']
+DRUG_STEMS = ['amoxi', 'ibu', 'para', 'metfor', 'atorva', 'lisino', 'omepra', 'cetiri', 'predni', 'azithro',
+              'doxy', 'sertra', 'losar', 'gaba', 'levo', 'hydro', 'clopi', 'furo', 'warfa', 'insu']
+DRUG_SUFFIXES = ['cillin', 'profen', 'cetamol', 'min', 'statin', 'pril', 'zole', 'zine', 'sone', 'mycin',
+                 'cycline', 'line', 'tan', 'pentin', 'thyroxine', 'chlorothiazide', 'dogrel', 'semide', 'rin', 'lin']
+LAB_TESTS = ['CBC', 'Lipid panel', 'HbA1c', 'Liver function', 'Urinalysis', 'TSH', 'Vitamin D', 'CRP']
+APPOINTMENT_STATUSES = [('completed', 45), ('cancelled', 10), ('confirmed', 25), ('booked', 20)]
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Generator:
+    def __init__(self, conn, seed=42, today=None, days_back=365, days_ahead=60, batch_size=5000, paid_fraction=0.7):
+        self.conn = conn
+        self.rnd = random.Random(seed)
+        # appointments are spread around "today" so dashboards have something to show
+        self.now = datetime.combine(today or datetime.now().date(), datetime.min.time())
+        self.days_back = days_back
+        self.days_ahead = days_ahead
+        self.batch_size = batch_size
+        self.paid_fraction = paid_fraction
+        self.doctor_ids = []
+        self.doctor_department = {}
+
+    def _insert(self, sql, rows):
+        total = 0
+        for chunk in _chunks(rows, self.batch_size):
+            self.conn.execute('BEGIN;')
+            self.conn.executemany(sql, chunk)
+            self.conn.commit()
+            total += len(chunk)
+        return total
+
+    def _datetime(self, past_only=False):
+        # quarter-hour slots inside a 08:00-18:00 working day
+        ahead = 0 if past_only else self.days_ahead
+        day = self.now.date() + timedelta(days=self.rnd.randint(-self.days_back, ahead))
+        slot = self.rnd.randint(0, 39)
+        return datetime(day.year, day.month, day.day, 8 + slot // 4, (slot % 4) * 15)
+
+    def doctors(self, n):
+        rnd = self.rnd
+        departments = list(DEPARTMENTS)
+        rows = []
+        for i in range(n):
+            dept = departments[i % len(departments)]
+            rows.append((rnd.choice(FIRST_NAMES), f'{rnd.choice(LAST_NAMES)}{i + 1}', DEPARTMENTS[dept],
+                         f'555-{1000 + i:04d}', dept, rnd.choice(AVAILABILITY), f'pw{i + 1}'))
+        self._insert('INSERT INTO doctors (f_name, l_name, specialization, contact, department, availability, password) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        for did, dept in self.conn.execute('SELECT doctor_id, department FROM doctors ORDER BY doctor_id'):
+            self.doctor_ids.append(did)
+            self.doctor_department[did] = dept
+        return n
+
+    def patients(self, n):
+        rnd = self.rnd
+        departments = list(DEPARTMENTS)
+
+        def rows():
+            for i in range(n):
+                doctor = rnd.choice(self.doctor_ids) if self.doctor_ids and rnd.random() < 0.8 else None
+                dob = datetime(1940, 1, 1) + timedelta(days=rnd.randint(0, 30000))
+                yield (rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES), dob.strftime('%Y-%m-%d'),
+                       f'555-{rnd.randint(0, 9999999):07d}', f'{rnd.randint(1, 9999)} {rnd.choice(STREETS)}',
+                       doctor, self.doctor_department.get(doctor) or rnd.choice(departments))
+        return self._insert('INSERT INTO patients (first_name, last_name, dob, phone, address, doctor, department) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?)', rows())
+
+    def medications(self, n):
+        rnd = self.rnd
+
+        def rows():
+            for i in range(n):
+                name = f'{DRUG_STEMS[i % len(DRUG_STEMS)]}{DRUG_SUFFIXES[(i // len(DRUG_STEMS)) % len(DRUG_SUFFIXES)]}'
+                if i >= len(DRUG_STEMS) * len(DRUG_SUFFIXES):
+                    name = f'{name} {i // (len(DRUG_STEMS) * len(DRUG_SUFFIXES)) * 50}mg'
+                yield (name.capitalize(), 'synthetic', round(rnd.uniform(1, 80), 2))
+        return self._insert('INSERT INTO medications (name, description, price) VALUES (?, ?, ?)', rows())
+
+    def rooms(self, n):
+        rnd = self.rnd
+        rows = [(f'{100 + i}', rnd.choice(['ward', 'private', 'icu']), rnd.choice([80, 150, 400])) for i in range(n)]
+        return self._insert('INSERT INTO rooms (room_number, type, rate_per_day) VALUES (?, ?, ?)', rows)
+
+    def appointments(self, n, patient_count):
+        rnd = self.rnd
+        statuses = [s for s, _ in APPOINTMENT_STATUSES]
+        weights = [w for _, w in APPOINTMENT_STATUSES]
+
+        def rows():
+            for _ in range(n):
+                status = rnd.choices(statuses, weights)[0]
+                when = self._datetime(past_only=status == 'completed')
+                doctor = None if status == 'booked' else rnd.choice(self.doctor_ids)
+                yield (rnd.randint(1, patient_count), doctor, when.strftime(CANONICAL_FORMAT), status,
+                       rnd.choice(SYMPTOMS), rnd.choice([0, 50, 75, 120]))
+        return self._insert('INSERT INTO appointments (patient_id, doctor_id, appointment_datetime, status, notes, fee) '
+                            'VALUES (?, ?, ?, ?, ?, ?)', rows())
+
+    def settle_bills(self):
+        # pay a share of the currently open bills so later charges open new ones
+        open_ids = [r[0] for r in self.conn.execute('SELECT id FROM bills WHERE paid = 0 ORDER BY id')]
+        paid = [(bid,) for bid in open_ids if self.rnd.random() < self.paid_fraction]
+        self.conn.execute('BEGIN;')
+        self.conn.executemany("UPDATE bills SET paid = 1, paid_at = datetime('now') WHERE id = ?", paid)
+        self.conn.commit()
+
+    def treatments(self, n, patient_count):
+        rnd = self.rnd
+        made = 0
+        # chunked so bills get settled between rounds of charges
+        for chunk in _chunks(range(n), self.batch_size):
+            rows = []
+            for _ in chunk:
+                start = self._datetime(past_only=True)
+                rows.append((rnd.randint(1, patient_count), rnd.choice(self.doctor_ids),
+                             f'{rnd.choice(TREATMENTS)} for {rnd.choice(SYMPTOMS)}',
+                             start.strftime('%Y-%m-%d %H:%M:%S'), round(rnd.uniform(20, 900), 2),
+                             rnd.choice(['', 'stable', 'review in two weeks', 'referred'])))
+            made += self._insert('INSERT INTO treatments (patient_id, doctor_id, description, start_date, cost, notes) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.settle_bills()
+        return made
+
+    def prescriptions(self, n, patient_count, medication_count):
+        rnd = self.rnd
+        made = 0
+        prices = dict(self.conn.execute('SELECT id, price FROM medications').fetchall())
+        for chunk in _chunks(range(n), self.batch_size):
+            self.conn.execute('BEGIN;')
+            items = []
+            for _ in chunk:
+                created = self._datetime(past_only=True).strftime('%Y-%m-%d %H:%M:%S')
+                cur = self.conn.execute('INSERT INTO prescriptions (patient_id, doctor_id, created_at, notes) VALUES (?, ?, ?, ?)',
+                                        (rnd.randint(1, patient_count), rnd.choice(self.doctor_ids), created,
+                                         rnd.choice(['', 'after meals', 'as needed', 'twice daily'])))
+                for _ in range(rnd.randint(1, 3)):
+                    med = rnd.randint(1, medication_count)
+                    items.append((cur.lastrowid, med, rnd.choice(['1x daily', '2x daily', '5ml']),
+                                  rnd.randint(1, 30), prices.get(med, 0)))
+            self.conn.executemany('INSERT INTO prescription_items (prescription_id, medication_id, dosage, quantity, unit_price) '
+                                  'VALUES (?, ?, ?, ?, ?)', items)
+            self.conn.commit()
+            made += len(chunk)
+            self.settle_bills()
+        return made
+
+    def lab_tests(self, n, patient_count):
+        rnd = self.rnd
+        rows = []
+        for _ in range(n):
+            rows.append((rnd.randint(1, patient_count), rnd.choice(self.doctor_ids), rnd.choice(LAB_TESTS),
+                         self._datetime(past_only=True).strftime('%Y-%m-%d %H:%M:%S'), round(rnd.uniform(15, 250), 2)))
+        self._insert('INSERT INTO lab_tests (patient_id, doctor_id, test_name, requested_at, cost) VALUES (?, ?, ?, ?, ?)', rows)
+        # completing a test is what bills it
+        ids = [r[0] for r in self.conn.execute('SELECT id FROM lab_tests ORDER BY id')]
+        done = [(tid,) for tid in ids if self.rnd.random() < 0.8]
+        self._insert("UPDATE lab_tests SET status = 'completed', performed_at = requested_at, result = 'normal' WHERE id = ?", done)
+        self.settle_bills()
+        return n
+
+
+def generate(path, doctors=50, patients=5000, appointments=15000, treatments=10000, prescriptions=5000,
+             lab_tests=2000, medications=400, rooms=100, seed=42, today=None, batch_size=5000, paid_fraction=0.7):
+    with redirect_stdout(StringIO()):
+        create_hms_db(path)
+    conn = db.connect(path)
+    gen = Generator(conn, seed=seed, today=today, batch_size=batch_size, paid_fraction=paid_fraction)
+    counts = {}
+    try:
+        for name, step in [
+            ('doctors', lambda: gen.doctors(doctors)),
+            ('patients', lambda: gen.patients(patients)),
+            ('medications', lambda: gen.medications(medications)),
+            ('rooms', lambda: gen.rooms(rooms)),
+            ('appointments', lambda: gen.appointments(appointments, patients)),
+            ('treatments', lambda: gen.treatments(treatments, patients)),
+            ('prescriptions', lambda: gen.prescriptions(prescriptions, patients, medications)),
+            ('lab_tests', lambda: gen.lab_tests(lab_tests, patients)),
+        ]:
+            start = time.perf_counter()
+            counts[name] = step()
+            print(f'  {name:<14}{counts[name]:>10,}  {time.perf_counter() - start:6.2f}s')
+        conn.execute('PRAGMA optimize;')
+    finally:
+        conn.close()
+    return counts
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Generate a deterministic synthetic HMS database.')
+    ap.add_argument('path', help='database file to create')
+    ap.add_argument('--doctors', type=int, default=50)
+    ap.add_argument('--patients', type=int, default=5000)
+    ap.add_argument('--appointments', type=int, default=15000)
+    ap.add_argument('--treatments', type=int, default=10000)
+    ap.add_argument('--prescriptions', type=int, default=5000)
+    ap.add_argument('--lab-tests', type=int, default=2000)
+    ap.add_argument('--medications', type=int, default=400)
+    ap.add_argument('--rooms', type=int, default=100)
+    ap.add_argument('--paid-fraction', type=float, default=0.7, help='share of open bills settled after each batch')
+    ap.add_argument('--batch-size', type=int, default=5000)
+    ap.add_argument('--seed', type=int, default=42)
+    ap.add_argument('--today', type=date.fromisoformat, help='anchor date YYYY-MM-DD (default: today)')
+    ap.add_argument('--force', action='store_true', help='overwrite an existing file')
+    args = ap.parse_args(argv)
+    if min(args.doctors, args.patients, args.medications) < 1:
+        ap.error('--doctors, --patients and --medications must be at least 1')
+    if os.path.exists(args.path):
+        if not args.force:
+            ap.error(f'{args.path} exists (use --force to overwrite)')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+    print(f'Generating {args.path} (seed {args.seed})')
+    start = time.perf_counter()
+    generate(args.path, args.doctors, args.patients, args.appointments, args.treatments, args.prescriptions,
+             args.lab_tests, args.medications, args.rooms, args.seed, args.today, args.batch_size, args.paid_fraction)
+    print(f'Done in {time.perf_counter() - start:.1f}s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""Bulk import of patients, doctors, rooms and medications from CSV or JSONL.
+
+Rows are streamed from the file, validated, and inserted with ``executemany``
+in batches; each batch is one transaction. Invalid rows are reported and
+skipped. Column names follow the database columns (see IMPORT_SPECS).
+
+    python import_data.py patients new_patients.csv
+    python import_data.py doctors staff.jsonl --batch-size 10000 --db other.db
+"""
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+import time
+from datetime import date
+
+import accounts
+import db
+import migrations
+
+
+def _text(value):
+    value = '' if value is None else str(value).strip()
+    return value or None
+
+
+def _username(value):
+    # doctors without one get FirstNameLastName from the insert trigger (accounts.py)
+    return accounts.normalize_username(_text(value)) or None
+
+
+def _int(value):
+    value = _text(value)
+    return None if value is None else int(value)
+
+
+def _float(value):
+    value = _text(value)
+    return None if value is None else float(value)
+
+
+def _date(value):
+    value = _text(value)
+    if value is None:
+        return None
+    # fromisoformat is C-implemented; strptime would dominate large imports
+    return date.fromisoformat(value).isoformat()
+
+
+# table -> (columns with converter, required columns)
+IMPORT_SPECS = {
+    'patients': (
+        [('first_name', _text), ('last_name', _text), ('dob', _date), ('phone', _text),
+         ('address', _text), ('doctor', _int), ('department', _text)],
+        {'first_name', 'last_name'},
+    ),
+    'doctors': (
+        [('f_name', _text), ('l_name', _text), ('specialization', _text), ('contact', _text),
+         ('department', _text), ('availability', _text), ('password', _text), ('username', _username)],
+        {'f_name', 'l_name'},
+    ),
+    'rooms': (
+        [('room_number', _text), ('type', _text), ('rate_per_day', _float)],
+        {'room_number'},
+    ),
+    'medications': (
+        [('name', _text), ('description', _text), ('price', _float)],
+        {'name'},
+    ),
+}
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_records(path, fmt=None):
+    """Yield (line number, dict) from a CSV (with header) or JSONL file; '-' is stdin."""
+    if fmt is None:
+        fmt = 'jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+    fh = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    try:
+        if fmt == 'csv':
+            for lineno, record in enumerate(csv.DictReader(fh), start=2):
+                yield lineno, record
+        else:
+            for lineno, line in enumerate(fh, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as ex:
+                    yield lineno, RowError(f'invalid JSON: {ex}')
+                    continue
+                yield lineno, record
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+
+def validate(record, spec):
+    """Convert one record to a parameter tuple, raising RowError if it is invalid."""
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise RowError('expected an object / CSV row')
+    columns, required = spec
+    values = []
+    for name, convert in columns:
+        try:
+            value = convert(record.get(name))
+        except (TypeError, ValueError):
+            raise RowError(f'bad value for {name}: {record.get(name)!r}')
+        if value is None and name in required:
+            raise RowError(f'missing {name}')
+        values.append(value)
+    return tuple(values)
+
+
+class Importer:
+    def __init__(self, conn, table, batch_size=5000, max_errors_shown=20):
+        self.conn = conn
+        self.table = table
+        self.spec = IMPORT_SPECS[table]
+        self.batch_size = batch_size
+        self.max_errors_shown = max_errors_shown
+        cols = [name for name, _ in self.spec[0]]
+        self.sql = f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})"
+        self.read = self.inserted = self.rejected = 0
+
+    def reject(self, lineno, reason):
+        self.rejected += 1
+        if self.rejected <= self.max_errors_shown:
+            print(f'  line {lineno}: {reason}')
+        elif self.rejected == self.max_errors_shown + 1:
+            print('  (further errors not shown)')
+
+    def flush(self, batch):
+        if not batch:
+            return
+        try:
+            self.conn.execute('BEGIN;')
+            self.conn.executemany(self.sql, [params for _, params in batch])
+            self.conn.commit()
+            self.inserted += len(batch)
+            return
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+        # a constraint failed somewhere in the batch: redo it row by row to find out where
+        self.conn.execute('BEGIN;')
+        for lineno, params in batch:
+            try:
+                self.conn.execute(self.sql, params)
+                self.inserted += 1
+            except sqlite3.IntegrityError as ex:
+                self.reject(lineno, str(ex))
+        self.conn.commit()
+
+    def run(self, records):
+        batch = []
+        for lineno, record in records:
+            self.read += 1
+            try:
+                batch.append((lineno, validate(record, self.spec)))
+            except RowError as ex:
+                self.reject(lineno, ex)
+                continue
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        self.flush(batch)
+
+
+def import_file(database, table, path, fmt=None, batch_size=5000):
+    conn = db.connect(database)
+    try:
+        migrations.migrate(conn)
+        importer = Importer(conn, table, batch_size)
+        start = time.perf_counter()
+        importer.run(read_records(path, fmt))
+        elapsed = time.perf_counter() - start
+    finally:
+        conn.close()
+    rate = importer.inserted / elapsed if elapsed > 0 else 0
+    print(f'{table}: read {importer.read}, inserted {importer.inserted}, rejected {importer.rejected} '
+          f'in {elapsed:.2f}s ({rate:,.0f} rows/s)')
+    return importer
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Bulk import HMS reference data from CSV or JSONL.')
+    ap.add_argument('table', choices=sorted(IMPORT_SPECS))
+    ap.add_argument('path', help="CSV/JSONL file ('-' for stdin)")
+    ap.add_argument('--format', choices=['csv', 'jsonl'], help='default: from the file extension')
+    ap.add_argument('--batch-size', type=int, default=5000, help='rows per transaction (default 5000)')
+    ap.add_argument('--db', default=db.DATABASE, help='database path')
+    args = ap.parse_args(argv)
+    if args.batch_size < 1:
+        ap.error('--batch-size must be positive')
+    importer = import_file(args.db, args.table, args.path, args.format, args.batch_size)
+    return 1 if importer.rejected else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,455 @@
+"""Versioned schema migrations for the HMS database.
+
+Each migration has a version number; the highest applied version is stored in
+``PRAGMA user_version`` so checking whether anything needs to run is a single
+header read. Migrations run in order, each one in its own transaction.
+
+Databases created before versioning (user_version 0) first get the legacy
+column/constraint fixes in LEGACY_STEPS. Steps that rebuild a large table use
+``rebuild_table``, which copies rows in committed batches and resumes where it
+stopped if interrupted.
+"""
+import sqlite3
+
+import accounts
+import archive
+import db
+import etags
+import prescribing
+import refcache
+import rollups
+import scheduling
+import search
+import stats
+
+
+# rows copied per transaction by rebuild_table
+REBUILD_BATCH = 5000
+
+
+def run_script(conn, script):
+    """Execute a multi-statement script inside the caller's transaction.
+
+    ``executescript()`` would COMMIT first, so statements are split and run one by one.
+    """
+    buf = ''
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            conn.execute(buf)
+            buf = ''
+
+
+def rebuild_table(conn, table, create_sql, key='id', batch_size=REBUILD_BATCH):
+    """Recreate ``table`` from ``create_sql`` (CREATE TABLE IF NOT EXISTS {table} ...).
+
+    Rows are copied in ``key`` order, ``batch_size`` per transaction, so other
+    connections can write between batches; triggers on the old table mirror those
+    writes into the new one. Progress is kept in ``migration_progress``, so if the
+    process stops a second run carries on after the last copied batch. The old
+    table is then dropped and the new one renamed in place, and the old table's
+    indexes and triggers are recreated. Called inside migrate()'s transaction; it
+    commits between batches. Returns the number of rows copied by this call.
+    """
+    new = f'{table}_rebuild'
+    for (child,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+        if any(fk[2] == table for fk in conn.execute(f'PRAGMA foreign_key_list({child})')):
+            # dropping the old table would cascade into its child rows
+            raise sqlite3.OperationalError(f'cannot rebuild {table}: referenced by {child}')
+    conn.execute(create_sql.format(table=new))
+    new_columns = {row[1] for row in conn.execute(f'PRAGMA table_info({new})')}
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})') if row[1] in new_columns]
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'NEW.{c}' for c in columns)
+    run_script(conn, f"""
+    CREATE TABLE IF NOT EXISTS migration_progress (
+        name TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO migration_progress(name) VALUES ('{table}');
+
+    CREATE TRIGGER IF NOT EXISTS trg_rebuild_{table}_insert AFTER INSERT ON {table}
+    BEGIN
+        INSERT OR REPLACE INTO {new} ({column_list}) VALUES ({new_values});
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_rebuild_{table}_update AFTER UPDATE ON {table}
+    BEGIN
+        DELETE FROM {new} WHERE {key} = OLD.{key};
+        INSERT OR REPLACE INTO {new} ({column_list}) VALUES ({new_values});
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_rebuild_{table}_delete AFTER DELETE ON {table}
+    BEGIN
+        DELETE FROM {new} WHERE {key} = OLD.{key};
+    END;
+    """)
+    last_id = conn.execute('SELECT last_id FROM migration_progress WHERE name = ?', (table,)).fetchone()[0]
+    copied = 0
+    while True:
+        conn.commit()
+        conn.execute('BEGIN IMMEDIATE;')
+        upto, count = conn.execute(
+            f'SELECT MAX({key}), COUNT(*) FROM (SELECT {key} FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?)',
+            (last_id, batch_size)).fetchone()
+        if not count:
+            break
+        # rows the triggers already mirrored are newer than the old table's copy: keep them
+        conn.execute(f'INSERT OR IGNORE INTO {new} ({column_list}) SELECT {column_list} FROM {table} '
+                     f'WHERE {key} > ? AND {key} <= ?', (last_id, upto))
+        conn.execute('UPDATE migration_progress SET last_id = ? WHERE name = ?', (upto, table))
+        last_id = upto
+        copied += count
+    # swap, in the same transaction as the last (empty) batch check
+    extras = [sql for (sql,) in conn.execute("""
+        SELECT sql FROM sqlite_master
+        WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL AND name NOT LIKE 'trg_rebuild_%'
+    """, (table,))]
+    conn.execute(f'DROP TABLE {table}')
+    # triggers on other tables may name the table; don't let RENAME re-check or rewrite them
+    conn.execute('PRAGMA legacy_alter_table = ON;')
+    try:
+        conn.execute(f'ALTER TABLE {new} RENAME TO {table}')
+    finally:
+        conn.execute('PRAGMA legacy_alter_table = OFF;')
+    for sql in extras:
+        conn.execute(sql)
+    conn.execute('DELETE FROM migration_progress WHERE name = ?', (table,))
+    return copied
+
+
+# --------------------------
+# Legacy fixes (user_version 0)
+# --------------------------
+def _columns(conn, table):
+    return {row[1]: row for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def _legacy_doctor_password(conn):
+    if 'password' in _columns(conn, 'doctors'):
+        return False
+    conn.execute('ALTER TABLE doctors ADD COLUMN password TEXT;')
+    return True
+
+
+def _legacy_patient_doctor_department(conn):
+    columns = _columns(conn, 'patients')
+    changed = False
+    for name, sql_type in (('doctor', 'INTEGER'), ('department', 'TEXT')):
+        if name not in columns:
+            conn.execute(f'ALTER TABLE patients ADD COLUMN {name} {sql_type};')
+            changed = True
+    return changed
+
+
+def _legacy_appointment_actions(conn):
+    if 'actions' in _columns(conn, 'appointments'):
+        return False
+    conn.execute('ALTER TABLE appointments ADD COLUMN actions TEXT;')
+    return True
+
+
+def _legacy_appointment_nullable_doctor(conn):
+    doctor_id = _columns(conn, 'appointments').get('doctor_id')
+    if doctor_id is None or not doctor_id[3]:
+        return False
+    # appointments created with doctor_id NOT NULL can't hold unassigned bookings
+    copied = rebuild_table(conn, 'appointments', """
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+            doctor_id INTEGER REFERENCES doctors(doctor_id) ON DELETE SET NULL,
+            appointment_datetime TEXT NOT NULL,
+            status TEXT NOT NULL CHECK(status IN ('booked','confirmed','cancelled','completed')) DEFAULT 'booked',
+            notes TEXT,
+            fee REAL DEFAULT 0,
+            actions TEXT
+        )
+    """)
+    print(f"Rebuilt appointments with a nullable doctor_id ({copied} row(s) copied in this run).")
+    return True
+
+
+# (description, function) -- each checks whether its fix is still needed and returns
+# True if it changed anything; they run in order before migration 1
+LEGACY_STEPS = [
+    ("doctors.password column", _legacy_doctor_password),
+    ("patients.doctor / patients.department columns", _legacy_patient_doctor_department),
+    ("appointments.actions column", _legacy_appointment_actions),
+    ("nullable appointments.doctor_id", _legacy_appointment_nullable_doctor),
+]
+
+
+# --------------------------
+# Migration steps
+# --------------------------
+def _m001_hot_path_indexes(conn):
+    # composite / covering indexes for the WHERE + ORDER BY patterns used by the routes
+    run_script(conn, """
+    -- doctor.dashboard / doctor.view_appointments_doctor: doctor_id = ? AND status IN (...) ORDER BY appointment_datetime
+    CREATE INDEX IF NOT EXISTS idx_appointments_doctor_status_dt ON appointments(doctor_id, status, appointment_datetime);
+    -- admin.appointments: status = 'booked' ORDER BY appointment_datetime
+    CREATE INDEX IF NOT EXISTS idx_appointments_status_dt ON appointments(status, appointment_datetime);
+    -- patient.view_appointments / admin.update_patient: patient_id = ? ORDER BY appointment_datetime
+    CREATE INDEX IF NOT EXISTS idx_appointments_patient_dt ON appointments(patient_id, appointment_datetime);
+
+    -- doctor.my_patients: doctor = ? (covers the selected columns)
+    CREATE INDEX IF NOT EXISTS idx_patients_doctor ON patients(doctor, first_name, last_name, phone);
+
+    -- doctor.view_patient / doctor.open_appointment: patient_id = ? ORDER BY start_date
+    CREATE INDEX IF NOT EXISTS idx_treatments_patient_start ON treatments(patient_id, start_date);
+    -- doctor.doctor_profile: doctor_id = ? ORDER BY start_date
+    CREATE INDEX IF NOT EXISTS idx_treatments_doctor_start ON treatments(doctor_id, start_date);
+
+    -- doctor.view_patient: prescriptions for a patient ORDER BY created_at
+    CREATE INDEX IF NOT EXISTS idx_prescriptions_patient_created ON prescriptions(patient_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_prescription_items_prescription ON prescription_items(prescription_id);
+
+    -- billing triggers: patient_id = ? AND paid = 0 ORDER BY created_at DESC LIMIT 1
+    CREATE INDEX IF NOT EXISTS idx_bills_patient_paid_created ON bills(patient_id, paid, created_at);
+    -- admin.bills: ORDER BY created_at DESC
+    CREATE INDEX IF NOT EXISTS idx_bills_created ON bills(created_at);
+    CREATE INDEX IF NOT EXISTS idx_bill_items_bill ON bill_items(bill_id);
+
+    -- admin.doctors / doctor.list_doctors: ORDER BY created_at DESC
+    CREATE INDEX IF NOT EXISTS idx_doctors_created ON doctors(created_at);
+
+    -- child side of ON DELETE CASCADE foreign keys (patient delete)
+    CREATE INDEX IF NOT EXISTS idx_lab_tests_patient ON lab_tests(patient_id);
+    CREATE INDEX IF NOT EXISTS idx_room_assignments_patient ON room_assignments(patient_id);
+    CREATE INDEX IF NOT EXISTS idx_med_dispense_item ON med_dispense(prescription_item_id);
+    """)
+
+
+def _m002_canonical_appointment_datetimes(conn, batch_size=1000):
+    # rewrite free-form appointment datetimes as 'YYYY-MM-DD HH:MM' so day/upcoming
+    # lookups can be index range seeks; rows already in canonical form are skipped
+    fixed = skipped = 0
+    last_id = 0
+    while True:
+        chunk = conn.execute("""
+            SELECT id, appointment_datetime FROM appointments
+            WHERE id > ?
+              AND appointment_datetime NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]'
+            ORDER BY id LIMIT ?
+        """, (last_id, batch_size)).fetchall()
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        updates = []
+        for aid, value in chunk:
+            parsed = scheduling.parse_appointment_datetime(value)
+            if parsed is None:
+                skipped += 1
+                continue
+            updates.append((parsed.strftime(scheduling.CANONICAL_FORMAT), aid))
+        conn.executemany('UPDATE appointments SET appointment_datetime = ? WHERE id = ?', updates)
+        fixed += len(updates)
+    if fixed or skipped:
+        print(f"Normalized {fixed} appointment datetime(s); {skipped} unrecognised value(s) left unchanged.")
+
+
+def _m003_stats_counters(conn):
+    # trigger-maintained dashboard counters, seeded from the current tables
+    run_script(conn, stats.SCHEMA)
+    stats.rebuild(conn)
+
+
+def _m004_open_bill_per_patient(conn):
+    # the billing triggers always used the newest open bill; fold any older open
+    # bills into it so at most one unpaid bill per patient remains
+    dupes = conn.execute("""
+        SELECT patient_id, MAX(id) FROM bills
+        WHERE paid = 0 GROUP BY patient_id HAVING COUNT(*) > 1
+    """).fetchall()
+    for patient_id, keep_id in dupes:
+        conn.execute("""
+            UPDATE bills SET total_amount = (
+                SELECT COALESCE(SUM(total_amount), 0) FROM bills WHERE patient_id = ? AND paid = 0
+            ) WHERE id = ?
+        """, (patient_id, keep_id))
+        conn.execute("""
+            UPDATE bill_items SET bill_id = ?
+            WHERE bill_id IN (SELECT id FROM bills WHERE patient_id = ? AND paid = 0 AND id != ?)
+        """, (keep_id, patient_id, keep_id))
+        conn.execute('DELETE FROM bills WHERE patient_id = ? AND paid = 0 AND id != ?', (patient_id, keep_id))
+    if dupes:
+        print(f"Merged duplicate open bills for {len(dupes)} patient(s).")
+    run_script(conn, """
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_bills_open_patient ON bills(patient_id) WHERE paid = 0;
+    DROP TRIGGER IF EXISTS trg_ensure_open_bill_after_insert_treatment;
+    DROP TRIGGER IF EXISTS trg_prescription_item_after_insert;
+    DROP TRIGGER IF EXISTS trg_lab_test_after_update_completed;
+    """)
+    # the prescription item trigger reads NEW.batched
+    _add_batched_column(conn)
+    # imported here: create_hms_db imports this module
+    from create_hms_db import BILLING_TRIGGERS
+    run_script(conn, BILLING_TRIGGERS)
+
+
+def _m005_cache_versions(conn):
+    # version counters for the in-process doctor / medication caches (refcache.py)
+    run_script(conn, refcache.SCHEMA)
+
+
+def _m006_patient_search(conn):
+    # FTS5 index for the admin patient search, filled from the existing rows
+    run_script(conn, search.PATIENT_SCHEMA)
+    search.rebuild_patients(conn)
+
+
+def _m007_notes_search(conn):
+    # FTS5 index over the clinical text for the doctor notes search; appointments.actions
+    # is normally added by the legacy fixes, but the triggers need it either way
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(appointments)')}
+    if 'actions' not in columns:
+        conn.execute('ALTER TABLE appointments ADD COLUMN actions TEXT;')
+    run_script(conn, search.NOTES_SCHEMA)
+    run_script(conn, search.NOTES_OWNER_SCHEMA)
+    search.rebuild_notes(conn)
+
+
+def _m008_archive_tables(conn):
+    # cold tables for archive.py, counted on the dashboard and kept in the notes search
+    run_script(conn, archive.SCHEMA)
+    run_script(conn, stats.ARCHIVE_SCHEMA)
+    run_script(conn, search.NOTES_ARCHIVE_SCHEMA)
+    run_script(conn, search.NOTES_ARCHIVE_OWNER_SCHEMA)
+
+
+def _m009_reporting_rollups(conn):
+    # daily rollups for the admin reports page, counted once here and refreshed
+    # incrementally afterwards (rollups.refresh)
+    run_script(conn, rollups.SCHEMA)
+    rollups.rebuild(conn)
+
+
+def _m010_schedule_versions(conn):
+    # per-doctor change counters for the in-memory conflict index (scheduling.SCHEDULE)
+    run_script(conn, scheduling.SCHEMA)
+
+
+def _m011_doctor_usernames(conn):
+    # indexed login name instead of matching (f_name || l_name) on every login
+    if 'username' not in _columns(conn, 'doctors'):
+        conn.execute('ALTER TABLE doctors ADD COLUMN username TEXT')
+    accounts.backfill(conn)
+    run_script(conn, accounts.SCHEMA)
+    run_script(conn, accounts.USERNAME_TRIGGER)
+
+
+def _add_batched_column(conn):
+    if 'batched' not in _columns(conn, 'prescription_items'):
+        conn.execute('ALTER TABLE prescription_items ADD COLUMN batched INTEGER NOT NULL DEFAULT 0')
+
+
+def _m012_batched_prescriptions(conn):
+    # indexed medication lookup by name, and items billed per prescription by
+    # prescribing.prescribe instead of the per-item trigger: re-apply the one
+    # trigger definition (create_hms_db.BILLING_TRIGGERS), which skips batched items
+    _add_batched_column(conn)
+    run_script(conn, prescribing.SCHEMA)
+    from create_hms_db import BILLING_TRIGGERS
+    run_script(conn, 'DROP TRIGGER IF EXISTS trg_prescription_item_after_insert;')
+    run_script(conn, BILLING_TRIGGERS)
+
+
+def _m013_listing_versions(conn):
+    # change counters behind the JSON listings' ETags (api_routes.py)
+    run_script(conn, etags.SCHEMA)
+
+
+def _m014_notes_owner_guard(conn):
+    # re-tag notes only when a patient's doctor actually changes
+    run_script(conn, search.NOTES_OWNER_SCHEMA)
+    run_script(conn, search.NOTES_ARCHIVE_OWNER_SCHEMA)
+
+
+def _m015_doctor_username_trigger(conn):
+    # the insert trigger numbers same-name doctors like accounts.unique_username
+    run_script(conn, accounts.USERNAME_TRIGGER)
+
+
+# (version, description, function) -- append new steps at the end, never renumber
+MIGRATIONS = [
+    (1, 'indexes for hot query paths', _m001_hot_path_indexes),
+    (2, 'canonical appointment datetimes', _m002_canonical_appointment_datetimes),
+    (3, 'trigger-maintained stats counters', _m003_stats_counters),
+    (4, 'single open bill per patient for billing triggers', _m004_open_bill_per_patient),
+    (5, 'reference data cache versions', _m005_cache_versions),
+    (6, 'full-text patient search', _m006_patient_search),
+    (7, 'full-text search over clinical notes', _m007_notes_search),
+    (8, 'archive tables for old appointments and paid bills', _m008_archive_tables),
+    (9, 'daily reporting rollups', _m009_reporting_rollups),
+    (10, 'per-doctor schedule versions', _m010_schedule_versions),
+    (11, 'unique doctor usernames', _m011_doctor_usernames),
+    (12, 'multi-item prescriptions billed once', _m012_batched_prescriptions),
+    (13, 'change counters for listing ETags', _m013_listing_versions),
+    (14, 'notes owner trigger only on a doctor change', _m014_notes_owner_guard),
+    (15, 'one numbering scheme for doctor usernames', _m015_doctor_username_trigger),
+]
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version;').fetchone()[0]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def _apply(conn, step, number=None):
+    # one step per transaction (rebuild_table also commits between its batches);
+    # user_version moves only when the step has finished
+    try:
+        conn.execute('BEGIN IMMEDIATE;')
+        result = step(conn)
+        if number is not None:
+            conn.execute(f'PRAGMA user_version = {int(number)};')
+        conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    return result
+
+
+def migrate(conn):
+    """Apply every migration newer than the database's user_version. Returns versions applied."""
+    applied = []
+    version = current_version(conn)
+    if version >= latest_version():
+        return applied
+    # nothing to migrate until create_hms_db has created the base schema
+    has_schema = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'appointments'").fetchone()
+    if not has_schema:
+        return applied
+    if version == 0:
+        for description, step in LEGACY_STEPS:
+            if _apply(conn, step):
+                print(f"Applied legacy fix: {description}")
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        _apply(conn, step, number)
+        print(f"Applied migration {number}: {description}")
+        applied.append(number)
+    if applied:
+        # refresh planner statistics for the new indexes
+        conn.execute('PRAGMA optimize;')
+    return applied
+
+
+def migrate_database(database=db.DATABASE):
+    conn = db.connect(database)
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    try:
+        done = migrate_database()
+    except sqlite3.Error as ex:
+        raise SystemExit(f'migration failed: {ex}')
+    print(f"Schema at version {latest_version()} ({len(done)} migration(s) applied).")
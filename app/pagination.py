@@ -0,0 +1,172 @@
+"""Keyset (cursor) pagination for the large admin and doctor listings.
+
+Instead of OFFSET, each page remembers the sort key of its first and last row.
+The next page asks for rows strictly "after" the last key, the previous page for
+rows "before" the first key, so every page is one index range seek of
+``limit + 1`` rows no matter how deep the user pages.
+
+Listing SQL uses two placeholders filled in here:
+
+    SELECT ... FROM treatments t ... WHERE t.doctor_id = ? AND {keyset}
+    ORDER BY {order} LIMIT ?
+
+``{keyset}`` must come after any other ``?`` parameters of the query.
+"""
+import base64
+import bisect
+import json
+
+from flask import request, url_for
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class Page:
+    def __init__(self, rows, limit, next_cursor=None, prev_cursor=None):
+        self.rows = rows
+        self.limit = limit
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def _url(self, **cursor):
+        # keep the page's other query arguments (filters such as ?archived=1)
+        args = {k: v for k, v in request.args.items() if k not in ('after', 'before', 'limit')}
+        args.update(request.view_args or {})
+        args.update(cursor)
+        if self.limit != PAGE_SIZE:
+            args['limit'] = self.limit
+        return url_for(request.endpoint, **args)
+
+    @property
+    def next_url(self):
+        return self._url(after=self.next_cursor) if self.next_cursor else None
+
+    @property
+    def prev_url(self):
+        return self._url(before=self.prev_cursor) if self.prev_cursor else None
+
+    @property
+    def first_url(self):
+        return self._url() if self.prev_cursor else None
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, size):
+    """Decode a cursor token; returns None for anything malformed (falls back to page 1)."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    # key values are bound as SQL parameters: only scalars sqlite3 accepts
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (str, int, float, type(None))):
+            return None
+    return values
+
+
+def page_size():
+    try:
+        limit = int(request.args.get('limit', PAGE_SIZE))
+    except ValueError:
+        limit = PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def paginate(conn, sql, params=(), keys=(('id', 'id'),), descending=True):
+    """Run one page of a keyset-paginated listing for the current request.
+
+    ``keys`` are (sql expression, result column) pairs forming a unique sort key,
+    e.g. (('b.created_at', 'created_at'), ('b.id', 'id')).
+    """
+    limit = page_size()
+    exprs = [expr for expr, _ in keys]
+    after = decode_cursor(request.args.get('after'), len(keys))
+    before = None if after else decode_cursor(request.args.get('before'), len(keys))
+
+    lhs = exprs[0] if len(exprs) == 1 else '(' + ', '.join(exprs) + ')'
+    rhs = '?' if len(exprs) == 1 else '(' + ', '.join('?' for _ in exprs) + ')'
+    # "after" follows the listing order; "before" walks it backwards
+    forward_op, backward_op = ('<', '>') if descending else ('>', '<')
+    forward_dir, backward_dir = ('DESC', 'ASC') if descending else ('ASC', 'DESC')
+
+    if before is not None:
+        keyset, cursor, direction = f'{lhs} {backward_op} {rhs}', before, backward_dir
+    elif after is not None:
+        keyset, cursor, direction = f'{lhs} {forward_op} {rhs}', after, forward_dir
+    else:
+        keyset, cursor, direction = '1', [], forward_dir
+    order = ', '.join(f'{expr} {direction}' for expr in exprs)
+
+    query = sql.format(keyset=keyset, order=order)
+    rows = conn.execute(query, tuple(params) + tuple(cursor) + (limit + 1,)).fetchall()
+    return _page(rows, limit, [col for _, col in keys], after, before)
+
+
+def paginate_rows(rows, keys=('id',), descending=True):
+    """Same cursors and pages as ``paginate`` over an in-memory list (e.g. a cached table).
+
+    ``rows`` must be sorted ascending by the ``keys`` columns; each page is a bisect.
+    """
+    limit = page_size()
+    after = decode_cursor(request.args.get('after'), len(keys))
+    before = None if after else decode_cursor(request.args.get('before'), len(keys))
+
+    def key(row):
+        return tuple(row[col] for col in keys)
+
+    try:
+        if before is not None:
+            cursor, forward = tuple(before), not descending
+        elif after is not None:
+            cursor, forward = tuple(after), descending
+        else:
+            cursor, forward = None, descending
+        # "forward" here means walking the list towards smaller keys
+        if cursor is None:
+            hi, lo = len(rows), 0
+        elif forward:
+            hi, lo = bisect.bisect_left(rows, cursor, key=key), 0
+        else:
+            hi, lo = len(rows), bisect.bisect_right(rows, cursor, key=key)
+    except TypeError:
+        # cursor values of the wrong type: start over at page 1
+        after = before = None
+        hi, lo, forward = len(rows), 0, descending
+    if forward:
+        chunk = rows[max(lo, hi - limit - 1):hi][::-1]
+    else:
+        chunk = rows[lo:lo + limit + 1]
+    return _page(chunk, limit, keys, after, before)
+
+
+def _page(rows, limit, columns, after, before):
+    """Trim the limit + 1 fetched rows to a page and work out its cursors."""
+    has_more = len(rows) > limit
+    rows = list(rows[:limit])
+
+    def key_of(row):
+        return encode_cursor([row[col] for col in columns])
+
+    next_cursor = prev_cursor = None
+    if before is not None:
+        rows.reverse()
+        if rows:
+            next_cursor = key_of(rows[-1])
+            if has_more:
+                prev_cursor = key_of(rows[0])
+    else:
+        if rows and has_more:
+            next_cursor = key_of(rows[-1])
+        if rows and after is not None:
+            prev_cursor = key_of(rows[0])
+    return Page(rows, limit, next_cursor, prev_cursor)
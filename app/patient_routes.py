@@ -1,22 +1,12 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-import sqlite3
-import os
+from db import get_db
+from writer import execute_write, WriteTimeout
+from scheduling import normalize_appointment_datetime
+import archive
+import timeline
 
 patient_bp = Blueprint('patient', __name__)
 
-# DB path relative to this module
-DATABASE = os.path.join(os.path.dirname(__file__), 'hospital_management.db')
-
-def get_db():
-    # increase timeout and allow connections from different threads
-    conn = sqlite3.connect(DATABASE, timeout=30, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    try:
-        conn.execute('PRAGMA foreign_keys = ON;')
-    except Exception:
-        pass
-    return conn
-
 
 @patient_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -67,14 +57,21 @@ def book_appointment():
         time = request.form.get('time')
         notes = request.form.get('reason') or request.form.get('notes')
 
-        # combine date and time if provided
-        appt_dt = date
-        if time:
-            appt_dt = f"{date} {time}"
+        # combine date and time into the canonical 'YYYY-MM-DD HH:MM' form
+        appt_dt = normalize_appointment_datetime(date, time)
+        if appt_dt is None:
+            conn.close()
+            flash('Please enter a valid date and time', 'danger')
+            return render_template('patient_book.html')
 
-        conn.execute('INSERT INTO appointments (patient_id, doctor_id, appointment_datetime, notes) VALUES (?, ?, ?, ?)', (session['patient_id'], doctor_id, appt_dt, notes))
-        conn.commit()
         conn.close()
+        try:
+            execute_write('INSERT INTO appointments (patient_id, doctor_id, appointment_datetime, notes) VALUES (?, ?, ?, ?)', (session['patient_id'], doctor_id, appt_dt, notes))
+        except WriteTimeout as e:
+            # the booking may still go in (e.committed is None): the list shows it
+            flash(str(e), 'danger')
+            return redirect(url_for('patient.view_appointments'))
+        timeline.invalidate(session['patient_id'])
         flash('Appointment booked successfully and is pending admin approval', 'success')
         return redirect(url_for('patient.view_appointments'))
 
@@ -87,10 +84,12 @@ def book_appointment():
 def view_appointments():
     if 'patient_id' not in session:
         return redirect(url_for('patient.login'))
+    # ?archived=1 adds appointments moved to the archive (see archive.py)
+    show_archived = request.args.get('archived') == '1'
     conn = get_db()
-    rows = conn.execute('SELECT a.*, d.f_name || " " || d.l_name AS doctor_name FROM appointments a LEFT JOIN doctors d ON d.doctor_id = a.doctor_id WHERE a.patient_id = ? ORDER BY a.appointment_datetime DESC', (session['patient_id'],)).fetchall()
+    rows = conn.execute(f'SELECT a.*, d.f_name || " " || d.l_name AS doctor_name FROM {archive.appointments_source(show_archived)} a LEFT JOIN doctors d ON d.doctor_id = a.doctor_id WHERE a.patient_id = ? ORDER BY a.appointment_datetime DESC', (session['patient_id'],)).fetchall()
     conn.close()
-    return render_template('patient_appointments.html', rows=rows)
+    return render_template('patient_appointments.html', rows=rows, show_archived=show_archived)
 
 
 @patient_bp.route('/appointments/cancel/<int:aid>', methods=['POST'])
@@ -110,8 +109,12 @@ def cancel_appointment(aid):
         flash('Not authorized to cancel this appointment', 'danger')
         return redirect(url_for('patient.view_appointments'))
 
-    conn.execute("UPDATE appointments SET status = 'cancelled' WHERE id = ?", (aid,))
-    conn.commit()
     conn.close()
+    try:
+        execute_write("UPDATE appointments SET status = 'cancelled' WHERE id = ?", (aid,))
+    except WriteTimeout as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('patient.view_appointments'))
+    timeline.invalidate(appt['patient_id'])
     flash('Appointment cancelled', 'success')
     return redirect(url_for('patient.view_appointments'))
@@ -0,0 +1,124 @@
+"""Prescriptions with any number of items, written and billed as one unit.
+
+``prescribe`` is a writer unit (writer.run_write) for a whole prescription:
+
+* the medication names not already resolved by the caller (refcache) are
+  looked up in one ``name IN (...)`` query on idx_medications_name, and
+  unknown names are added to the catalogue;
+* the prescription row and all its items go in with one ``executemany``;
+* the patient's open bill gets all the items in one INSERT ... SELECT into
+  ``bill_items`` and a single total update.
+
+The per-item billing trigger (create_hms_db.BILLING_TRIGGERS) would do the same
+three statements for every item. It skips rows inserted with
+``prescription_items.batched = 1`` (added by migration 12). Rows inserted any
+other way (generate_data, ad-hoc SQL) are still billed by the trigger.
+"""
+
+MAX_ITEMS = 50
+
+SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_medications_name ON medications(name);
+"""
+
+
+def clean_items(raw):
+    """Validate a list of item dicts (name, dosage, quantity, unit_price).
+
+    Returns the cleaned list; raises ValueError with a message for the user.
+    ``unit_price`` may be left out, in which case the catalogue price is used.
+    """
+    items = []
+    for n, item in enumerate(raw or (), 1):
+        name = (item.get('name') or item.get('medication_name') or '').strip()
+        if not name:
+            continue
+        try:
+            quantity = int(item.get('quantity') or 1)
+            price = item.get('unit_price')
+            unit_price = None if price in (None, '') else float(price)
+        except (TypeError, ValueError):
+            raise ValueError(f'Item {n} ({name}): quantity and unit price must be numbers')
+        if quantity < 1 or (unit_price is not None and unit_price < 0):
+            raise ValueError(f'Item {n} ({name}): quantity must be at least 1 and the price not negative')
+        # ids come from the catalogue only (doctor_routes._prescription_items /
+        # prescribe); a caller-supplied medication_id is ignored
+        items.append({'name': name, 'dosage': (item.get('dosage') or '').strip() or None,
+                      'quantity': quantity, 'unit_price': unit_price,
+                      'medication_id': None})
+    if not items:
+        raise ValueError('Add at least one medication')
+    if len(items) > MAX_ITEMS:
+        raise ValueError(f'At most {MAX_ITEMS} medications per prescription')
+    return items
+
+
+def resolve_medications(conn, names):
+    """name -> (id, price) for the names in the catalogue, lowest id first (as refcache)."""
+    names = sorted(set(names))
+    if not names:
+        return {}
+    marks = ', '.join('?' for _ in names)
+    found = {}
+    # idx_medications_name: one index probe per name
+    for row in conn.execute(f'SELECT id, name, price FROM medications WHERE name IN ({marks}) ORDER BY id', names):
+        found.setdefault(row[1], (row[0], row[2]))
+    return found
+
+
+def prescribe(conn, patient_id, doctor_id, items, notes=''):
+    """Write unit: one prescription with ``items`` (from clean_items), billed once.
+
+    Returns a summary dict with the prescription id, item count, amount billed
+    and the names added to the medication catalogue.
+    """
+    unresolved = [item['name'] for item in items if item.get('medication_id') is None]
+    known = resolve_medications(conn, unresolved)
+    created = sorted({name for name in unresolved if name not in known})
+    if created:
+        prices = {}
+        for item in items:
+            if item['name'] in created:
+                prices.setdefault(item['name'], item['unit_price'] or 0)
+        conn.executemany('INSERT INTO medications (name, description, price) VALUES (?, ?, ?)',
+                         [(name, '', prices[name]) for name in created])
+        known.update(resolve_medications(conn, created))
+
+    rows = []
+    total = 0.0
+    for item in items:
+        medication_id = item.get('medication_id')
+        catalogue_price = None
+        if medication_id is None:
+            medication_id, catalogue_price = known[item['name']]
+        unit_price = item['unit_price']
+        if unit_price is None:
+            unit_price = catalogue_price or 0
+        total += unit_price * item['quantity']
+        rows.append((medication_id, item['dosage'], item['quantity'], unit_price))
+
+    cur = conn.execute('INSERT INTO prescriptions (patient_id, doctor_id, notes) VALUES (?, ?, ?)',
+                       (patient_id, doctor_id, notes))
+    prescription_id = cur.lastrowid
+    conn.executemany('INSERT INTO prescription_items (prescription_id, medication_id, dosage, quantity, unit_price, batched) '
+                     'VALUES (?, ?, ?, ?, ?, 1)', [(prescription_id, *row) for row in rows])
+
+    # what the trigger does per item, once for the whole prescription
+    conn.execute("""
+        INSERT INTO bills(patient_id, total_amount, paid, created_at)
+        SELECT ?, 0, 0, datetime('now')
+        WHERE NOT EXISTS (SELECT 1 FROM bills WHERE patient_id = ? AND paid = 0)
+    """, (patient_id, patient_id))
+    conn.execute("""
+        INSERT INTO bill_items(bill_id, item_type, item_ref, description, amount, created_at)
+        SELECT b.id, 'medication', i.id, m.name,
+               COALESCE(i.unit_price,0) * COALESCE(i.quantity,1), datetime('now')
+        FROM prescription_items i
+        JOIN bills b ON b.patient_id = ? AND b.paid = 0
+        LEFT JOIN medications m ON m.id = i.medication_id
+        WHERE i.prescription_id = ?
+        ORDER BY i.id
+    """, (patient_id, prescription_id))
+    conn.execute('UPDATE bills SET total_amount = total_amount + ? WHERE patient_id = ? AND paid = 0',
+                 (total, patient_id))
+    return {'prescription_id': prescription_id, 'items': len(rows), 'total': round(total, 2), 'created': created}
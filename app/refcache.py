@@ -0,0 +1,242 @@
+"""In-process cache of reference data: doctors and medications.
+
+Both tables change rarely but are read on almost every admin/doctor page
+(doctor dropdowns, the doctor listings, medication lookups when prescribing).
+Each process keeps one copy per table, tagged with a version number. The
+medication name autocomplete has its own prefix index over the same table,
+versioned (and invalidated) together with it.
+
+Versions live in the ``cache_versions`` table and are bumped by triggers on
+every INSERT/UPDATE/DELETE (migration 5), so changes made by another worker
+process, the import script or the writer thread are all seen. A process
+re-reads the version at most once every CHECK_INTERVAL seconds, and reloads the
+table only when the version moved. Inside that window pages are served without
+touching SQLite. Routes that change a table call ``invalidate()`` so this
+process sees the change immediately.
+"""
+import bisect
+import os
+import sqlite3
+import threading
+import time
+
+# seconds between version checks (how stale another process's change can be)
+CHECK_INTERVAL = float(os.environ.get('HMS_CACHE_CHECK_INTERVAL', 1.0))
+# suggestions returned by medication_completions
+COMPLETIONS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO cache_versions(name) VALUES ('doctors');
+INSERT OR IGNORE INTO cache_versions(name) VALUES ('medications');
+
+CREATE TRIGGER IF NOT EXISTS trg_cache_doctors_insert AFTER INSERT ON doctors
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'doctors';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_cache_doctors_update AFTER UPDATE ON doctors
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'doctors';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_cache_doctors_delete AFTER DELETE ON doctors
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'doctors';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_cache_medications_insert AFTER INSERT ON medications
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'medications';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_cache_medications_update AFTER UPDATE ON medications
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'medications';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_cache_medications_delete AFTER DELETE ON medications
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'medications';
+END;
+"""
+
+
+def read_version(conn, name):
+    try:
+        row = conn.execute('SELECT version FROM cache_versions WHERE name = ?', (name,)).fetchone()
+    except sqlite3.OperationalError:
+        # not migrated yet: never trust the cache
+        return None
+    return row[0] if row else None
+
+
+class VersionedCache:
+    """One cached value built by ``loader(conn)``, reloaded when its DB version changes."""
+
+    def __init__(self, name, loader, check_interval=CHECK_INTERVAL):
+        self.name = name
+        self.loader = loader
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._value = None
+        self._version = None
+        self._checked = 0.0
+        self._stats = {'hits': 0, 'checks': 0, 'loads': 0, 'invalidations': 0}
+
+    def get(self, conn):
+        value = self._value
+        if value is not None and time.monotonic() - self._checked < self.check_interval:
+            self._stats['hits'] += 1
+            return value
+        with self._lock:
+            self._stats['checks'] += 1
+            version = read_version(conn, self.name)
+            if self._value is None or version is None or version != self._version:
+                self._stats['loads'] += 1
+                # on a GET's snapshot connection version and rows always match; elsewhere a
+                # concurrent write at worst costs one extra reload on the next check
+                self._value = self.loader(conn)
+                self._version = version
+            self._checked = time.monotonic()
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._version = None
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        out = dict(self._stats)
+        out['version'] = self._version
+        out['loaded'] = self._value is not None
+        return out
+
+
+# what the listings, profile and schedule checks show; passwords stay in the
+# database (accounts.authenticate reads them per login)
+DOCTOR_COLUMNS = 'doctor_id, f_name, l_name, specialization, contact, department, availability, created_at, username'
+
+
+def _load_doctors(conn):
+    rows = [dict(r) for r in conn.execute(f'SELECT {DOCTOR_COLUMNS} FROM doctors ORDER BY created_at, doctor_id')]
+    for r in rows:
+        # NULL sorts first in SQLite; '' keeps the Python keys comparable in the same order
+        r['created_at'] = r['created_at'] or ''
+    return {
+        # listing order of admin.doctors / doctor.list_doctors (ascending; pages walk it backwards)
+        'rows': rows,
+        'by_id': {r['doctor_id']: r for r in rows},
+        # dropdowns only need id and name
+        'choices': sorted(({'doctor_id': r['doctor_id'], 'f_name': r['f_name'], 'l_name': r['l_name']} for r in rows),
+                          key=lambda r: (r['f_name'], r['l_name'], r['doctor_id'])),
+    }
+
+
+def _load_medications(conn):
+    rows = [dict(r) for r in conn.execute('SELECT id, name, description, price FROM medications ORDER BY name, id')]
+    by_name = {}
+    for r in rows:
+        # the prescribe form looks medications up by exact name; keep the first (lowest id)
+        by_name.setdefault(r['name'], r)
+    return {'rows': rows, 'by_id': {r['id']: r for r in rows}, 'by_name': by_name}
+
+
+def fold_medication_name(name):
+    """'  Vitamin  D3 ' -> 'vitamin d3': the form names are compared in for autocomplete."""
+    return ' '.join((name or '').casefold().split())
+
+
+def _load_medication_prefixes(conn):
+    by_key = {}
+    for medication_id, name, price in conn.execute('SELECT id, name, price FROM medications ORDER BY id'):
+        key = fold_medication_name(name)
+        # names differing only in case/spacing are one suggestion, the oldest row
+        if key and key not in by_key:
+            by_key[key] = {'id': medication_id, 'name': name, 'price': price}
+    # every later word of a name is a second way in: 'd3' finds 'Vitamin D3'
+    words, owners = [], []
+    for key in by_key:
+        i = key.find(' ')
+        while i != -1:
+            words.append(key[i + 1:])
+            owners.append(key)
+            i = key.find(' ', i + 1)
+    order = sorted(range(len(words)), key=words.__getitem__)
+    return {
+        'keys': sorted(by_key),
+        'words': [words[i] for i in order],
+        'owners': [owners[i] for i in order],
+        'by_key': by_key,
+    }
+
+
+CACHES = {
+    'doctors': VersionedCache('doctors', _load_doctors),
+    'medications': VersionedCache('medications', _load_medications),
+    'medication_prefixes': VersionedCache('medications', _load_medication_prefixes),
+}
+
+
+def doctors(conn):
+    """All doctors as dicts, ordered by (created_at, doctor_id)."""
+    return CACHES['doctors'].get(conn)['rows']
+
+
+def doctor_choices(conn):
+    """(doctor_id, f_name, l_name) dicts sorted by name, for dropdowns."""
+    return CACHES['doctors'].get(conn)['choices']
+
+
+def get_doctor(conn, doctor_id):
+    try:
+        doctor_id = int(doctor_id)
+    except (TypeError, ValueError):
+        return None
+    return CACHES['doctors'].get(conn)['by_id'].get(doctor_id)
+
+
+def medications(conn):
+    return CACHES['medications'].get(conn)['rows']
+
+
+def medication_by_name(conn, name):
+    return CACHES['medications'].get(conn)['by_name'].get(name)
+
+
+def medication_by_folded_name(conn, name):
+    """The medication whose name matches ignoring case and spacing, or None."""
+    return CACHES['medication_prefixes'].get(conn)['by_key'].get(fold_medication_name(name))
+
+
+def medication_completions(conn, prefix, limit=COMPLETIONS):
+    """Medications whose name starts with ``prefix`` (case-insensitive), then those
+    with a later word starting with it; each list alphabetical. Two bisects on
+    the sorted key arrays plus ``limit`` steps, whatever the catalogue size."""
+    prefix = fold_medication_name(prefix)
+    if not prefix:
+        return []
+    index = CACHES['medication_prefixes'].get(conn)
+    by_key = index['by_key']
+    found = []
+    seen = set()
+    for keys, owners in ((index['keys'], index['keys']), (index['words'], index['owners'])):
+        i = bisect.bisect_left(keys, prefix)
+        while i < len(keys) and len(found) < limit and keys[i].startswith(prefix):
+            key = owners[i]
+            if key not in seen:
+                seen.add(key)
+                found.append(by_key[key])
+            i += 1
+    return found
+
+
+def invalidate(name=None):
+    """Drop the cached copy of one table (or all) in this process."""
+    for cache in CACHES.values():
+        if name is None or cache.name == name:
+            cache.invalidate()
+
+
+def cache_stats():
+    return {name: cache.stats() for name, cache in CACHES.items()}
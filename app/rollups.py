@@ -0,0 +1,343 @@
+"""Daily rollups for the admin reports page (migration 9).
+
+Reports read only these small tables, never ``bill_items``, ``appointments``
+or ``treatments``, so a month costs the same however much history there is:
+
+    rollup_revenue_daily        (day, item_type, department) -> items, amount
+    rollup_appointments_daily   (day, doctor_id, status)     -> appointments
+    rollup_treatments_daily     (day, doctor_id)             -> treatments, cost
+
+``refresh`` brings them up to date incrementally from a high-water mark per
+rollup, kept in ``rollup_state``:
+
+* bill items and treatments are append-only, so the mark is the last id rolled
+  up and only newer rows are read (archived bill items keep their ids and are
+  read from ``bill_items_archive`` the same way);
+* appointments change status, doctor and date, so triggers log the day(s) every
+  insert/update/delete touches in ``rollup_appointment_changes``; the mark is
+  the last change id, and only the logged days are recounted (hot + archived
+  rows, so archival does not change the counts).
+
+Revenue and treatments are a ledger of what was recorded: rows deleted later
+(e.g. with their patient) stay counted until ``rebuild``. Department is the
+department of the doctor behind the item, else the patient's, else ''.
+
+    python rollups.py refresh|rebuild [path/to/hospital_management.db]
+"""
+import sqlite3
+import sys
+import time
+
+import db
+
+# source rows (or logged appointment changes) per refresh transaction
+REFRESH_BATCH = 50000
+APPOINTMENT_STATUSES = ('booked', 'confirmed', 'completed', 'cancelled')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup_state (
+    name TEXT PRIMARY KEY,
+    high_water INTEGER NOT NULL DEFAULT 0,
+    refreshed_at TEXT
+);
+INSERT OR IGNORE INTO rollup_state(name) VALUES ('revenue');
+INSERT OR IGNORE INTO rollup_state(name) VALUES ('treatments');
+INSERT OR IGNORE INTO rollup_state(name) VALUES ('appointments');
+
+CREATE TABLE IF NOT EXISTS rollup_revenue_daily (
+    day TEXT NOT NULL,
+    item_type TEXT NOT NULL,
+    department TEXT NOT NULL,
+    items INTEGER NOT NULL DEFAULT 0,
+    amount REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, item_type, department)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollup_appointments_daily (
+    day TEXT NOT NULL,
+    doctor_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    appointments INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, doctor_id, status)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollup_treatments_daily (
+    day TEXT NOT NULL,
+    doctor_id INTEGER NOT NULL,
+    treatments INTEGER NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, doctor_id)
+) WITHOUT ROWID;
+
+-- days whose appointment counts may have changed since the last refresh;
+-- AUTOINCREMENT so ids are never reused after processed rows are deleted
+CREATE TABLE IF NOT EXISTS rollup_appointment_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    day TEXT NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_rollup_appointments_insert AFTER INSERT ON appointments
+BEGIN
+    INSERT INTO rollup_appointment_changes(day) VALUES (substr(NEW.appointment_datetime, 1, 10));
+END;
+CREATE TRIGGER IF NOT EXISTS trg_rollup_appointments_update
+AFTER UPDATE OF status, doctor_id, appointment_datetime ON appointments
+BEGIN
+    INSERT INTO rollup_appointment_changes(day) VALUES (substr(OLD.appointment_datetime, 1, 10));
+    INSERT INTO rollup_appointment_changes(day)
+    SELECT substr(NEW.appointment_datetime, 1, 10)
+    WHERE substr(NEW.appointment_datetime, 1, 10) <> substr(OLD.appointment_datetime, 1, 10);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_rollup_appointments_delete AFTER DELETE ON appointments
+BEGIN
+    INSERT INTO rollup_appointment_changes(day) VALUES (substr(OLD.appointment_datetime, 1, 10));
+END;
+
+-- recounting one day of archived appointments
+CREATE INDEX IF NOT EXISTS idx_appointments_archive_dt ON appointments_archive(appointment_datetime);
+"""
+
+# department of the doctor behind a bill item, else of the billed patient
+_ITEM_DEPARTMENT = """
+COALESCE(
+    CASE i.item_type
+        WHEN 'treatment' THEN (SELECT d.department FROM treatments t
+                               JOIN doctors d ON d.doctor_id = t.doctor_id WHERE t.id = i.item_ref)
+        WHEN 'medication' THEN (SELECT d.department FROM prescription_items pi
+                                JOIN prescriptions p ON p.id = pi.prescription_id
+                                JOIN doctors d ON d.doctor_id = p.doctor_id WHERE pi.id = i.item_ref)
+        WHEN 'lab_test' THEN (SELECT d.department FROM lab_tests l
+                              JOIN doctors d ON d.doctor_id = l.doctor_id WHERE l.id = i.item_ref)
+    END,
+    (SELECT p.department FROM patients p WHERE p.id = COALESCE(
+        (SELECT patient_id FROM bills WHERE id = i.bill_id),
+        (SELECT patient_id FROM bills_archive WHERE id = i.bill_id))),
+    '')
+"""
+
+_ITEM_COLUMNS = 'id, bill_id, item_type, item_ref, amount, created_at'
+
+
+def _mark(conn, name):
+    return conn.execute('SELECT high_water FROM rollup_state WHERE name = ?', (name,)).fetchone()[0]
+
+
+def _set_mark(conn, name, high_water):
+    conn.execute("UPDATE rollup_state SET high_water = ?, refreshed_at = datetime('now') WHERE name = ?",
+                 (high_water, name))
+
+
+def _refresh_revenue(conn, limit):
+    mark = _mark(conn, 'revenue')
+    top = conn.execute('SELECT MAX((SELECT MAX(id) FROM bill_items), '
+                       'COALESCE((SELECT MAX(id) FROM bill_items_archive), 0))').fetchone()[0]
+    if not top or top <= mark:
+        return 0
+    upto = min(mark + limit, top)
+    # both ranges are rowid range scans
+    conn.execute(f'''
+        INSERT INTO rollup_revenue_daily(day, item_type, department, items, amount)
+        SELECT substr(i.created_at, 1, 10), i.item_type, {_ITEM_DEPARTMENT}, COUNT(*), TOTAL(i.amount)
+        FROM (SELECT {_ITEM_COLUMNS} FROM bill_items WHERE id > :mark AND id <= :upto
+              UNION ALL
+              SELECT {_ITEM_COLUMNS} FROM bill_items_archive WHERE id > :mark AND id <= :upto) i
+        WHERE true
+        GROUP BY 1, 2, 3
+        ON CONFLICT(day, item_type, department) DO UPDATE
+        SET items = items + excluded.items, amount = amount + excluded.amount
+    ''', {'mark': mark, 'upto': upto})
+    _set_mark(conn, 'revenue', upto)
+    return upto - mark
+
+
+def _refresh_treatments(conn, limit):
+    mark = _mark(conn, 'treatments')
+    top = conn.execute('SELECT MAX(id) FROM treatments').fetchone()[0]
+    if not top or top <= mark:
+        return 0
+    upto = min(mark + limit, top)
+    conn.execute('''
+        INSERT INTO rollup_treatments_daily(day, doctor_id, treatments, cost)
+        SELECT COALESCE(substr(start_date, 1, 10), ''), COALESCE(doctor_id, 0), COUNT(*), TOTAL(cost)
+        FROM treatments
+        WHERE id > ? AND id <= ?
+        GROUP BY 1, 2
+        ON CONFLICT(day, doctor_id) DO UPDATE
+        SET treatments = treatments + excluded.treatments, cost = cost + excluded.cost
+    ''', (mark, upto))
+    _set_mark(conn, 'treatments', upto)
+    return upto - mark
+
+
+def _count_appointment_day(conn, day):
+    conn.execute('DELETE FROM rollup_appointments_daily WHERE day = ?', (day,))
+    marks = ', '.join('?' for _ in APPOINTMENT_STATUSES)
+    where = f'status IN ({marks}) AND appointment_datetime >= ? AND appointment_datetime < ?'
+    params = (*APPOINTMENT_STATUSES, day, f'{day}~')
+    # idx_appointments_status_dt / idx_appointments_archive_dt: one day's rows only
+    conn.execute(f'''
+        INSERT INTO rollup_appointments_daily(day, doctor_id, status, appointments)
+        SELECT ?, COALESCE(doctor_id, 0), status, COUNT(*)
+        FROM (SELECT doctor_id, status FROM appointments WHERE {where}
+              UNION ALL
+              SELECT doctor_id, status FROM appointments_archive WHERE {where})
+        GROUP BY 2, 3
+    ''', (day, *params, *params))
+
+
+def _refresh_appointments(conn, limit):
+    mark = _mark(conn, 'appointments')
+    upto = conn.execute('SELECT MAX(id) FROM (SELECT id FROM rollup_appointment_changes WHERE id > ? ORDER BY id LIMIT ?)',
+                        (mark, limit)).fetchone()[0]
+    if upto is None:
+        return 0
+    days = [r[0] for r in conn.execute('SELECT DISTINCT day FROM rollup_appointment_changes WHERE id > ? AND id <= ?',
+                                       (mark, upto))]
+    for day in days:
+        _count_appointment_day(conn, day)
+    conn.execute('DELETE FROM rollup_appointment_changes WHERE id <= ?', (upto,))
+    _set_mark(conn, 'appointments', upto)
+    return len(days)
+
+
+REFRESHERS = {
+    'revenue': _refresh_revenue,
+    'treatments': _refresh_treatments,
+    'appointments': _refresh_appointments,
+}
+
+
+def refresh_step(conn, limit=REFRESH_BATCH):
+    """Roll up at most ``limit`` new rows per rollup; caller commits.
+
+    Returns {rollup: ids covered (bill items, treatments) or days recounted
+    (appointments)}; all zeros means up to date.
+    """
+    return {name: fn(conn, limit) for name, fn in REFRESHERS.items()}
+
+
+def refresh(conn, limit=REFRESH_BATCH, progress=None):
+    """Bring every rollup up to date, one IMMEDIATE transaction per step.
+
+    Returns the number of steps that did work. ``progress(done)`` is called
+    after every committed step.
+    """
+    steps = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE;')
+        try:
+            done = refresh_step(conn, limit)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if not any(done.values()):
+            return steps
+        steps += 1
+        if progress:
+            progress(done)
+
+
+def rebuild(conn):
+    """Recount every rollup from scratch (also drops rows deleted since); caller commits."""
+    for table in ('rollup_revenue_daily', 'rollup_appointments_daily', 'rollup_treatments_daily'):
+        conn.execute(f'DELETE FROM {table}')
+    conn.execute('UPDATE rollup_state SET high_water = 0, refreshed_at = NULL')
+    conn.execute('DELETE FROM rollup_appointment_changes')
+    # appointments in one grouped pass instead of a day at a time
+    conn.execute(f'''
+        INSERT INTO rollup_appointments_daily(day, doctor_id, status, appointments)
+        SELECT substr(appointment_datetime, 1, 10), COALESCE(doctor_id, 0), status, COUNT(*)
+        FROM (SELECT doctor_id, status, appointment_datetime FROM appointments
+              UNION ALL
+              SELECT doctor_id, status, appointment_datetime FROM appointments_archive)
+        WHERE status IN ({', '.join(repr(s) for s in APPOINTMENT_STATUSES)})
+        GROUP BY 1, 2, 3
+    ''')
+    last_change = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'rollup_appointment_changes'").fetchone()
+    _set_mark(conn, 'appointments', last_change[0] if last_change else 0)
+    while _refresh_revenue(conn, REFRESH_BATCH):
+        pass
+    while _refresh_treatments(conn, REFRESH_BATCH):
+        pass
+
+
+def state(conn):
+    """{rollup: {'high_water', 'refreshed_at'}}, or {} before migration 9."""
+    try:
+        rows = conn.execute('SELECT name, high_water, refreshed_at FROM rollup_state').fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {name: {'high_water': mark, 'refreshed_at': at} for name, mark, at in rows}
+
+
+def pending(conn):
+    """True when source rows are newer than the rollups."""
+    marks = {name: s['high_water'] for name, s in state(conn).items()}
+    if not marks:
+        return False
+    row = conn.execute('''
+        SELECT EXISTS(SELECT 1 FROM bill_items WHERE id > :revenue)
+            OR EXISTS(SELECT 1 FROM bill_items_archive WHERE id > :revenue)
+            OR EXISTS(SELECT 1 FROM treatments WHERE id > :treatments)
+            OR EXISTS(SELECT 1 FROM rollup_appointment_changes WHERE id > :appointments)
+    ''', marks).fetchone()
+    return bool(row[0])
+
+
+def month_report(conn, start, end):
+    """Everything the reports page shows for days in [start, end), from the rollups only."""
+    params = (start, end)
+    return {
+        'revenue': [dict(r) for r in conn.execute('''
+            SELECT department, item_type, SUM(items) AS items, SUM(amount) AS amount
+            FROM rollup_revenue_daily WHERE day >= ? AND day < ?
+            GROUP BY department, item_type
+            ORDER BY department, item_type
+        ''', params)],
+        'revenue_by_day': [dict(r) for r in conn.execute('''
+            SELECT day, SUM(items) AS items, SUM(amount) AS amount
+            FROM rollup_revenue_daily WHERE day >= ? AND day < ?
+            GROUP BY day ORDER BY day
+        ''', params)],
+        'appointments': [dict(r) for r in conn.execute('''
+            SELECT doctor_id, status, SUM(appointments) AS appointments
+            FROM rollup_appointments_daily WHERE day >= ? AND day < ?
+            GROUP BY doctor_id, status
+        ''', params)],
+        'treatments': [dict(r) for r in conn.execute('''
+            SELECT doctor_id, SUM(treatments) AS treatments, SUM(cost) AS cost
+            FROM rollup_treatments_daily WHERE day >= ? AND day < ?
+            GROUP BY doctor_id
+            ORDER BY treatments DESC
+        ''', params)],
+    }
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else ''
+    if command not in ('refresh', 'rebuild'):
+        print('usage: python rollups.py refresh|rebuild [path/to/hospital_management.db]')
+        return 2
+    conn = db.connect(argv[2] if len(argv) > 2 else db.DATABASE)
+    start = time.perf_counter()
+    try:
+        if command == 'rebuild':
+            conn.execute('BEGIN IMMEDIATE;')
+            try:
+                rebuild(conn)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            print(f'Rebuilt rollups in {time.perf_counter() - start:.1f}s.')
+        else:
+            steps = refresh(conn, progress=lambda done: print(f'  {done}', end='\r'))
+            print(f'Refreshed rollups in {steps} step(s), {time.perf_counter() - start:.1f}s.')
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
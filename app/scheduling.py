@@ -0,0 +1,387 @@
+"""Appointment date/time helpers.
+
+Appointment datetimes are stored in one canonical, sortable text form,
+``YYYY-MM-DD HH:MM`` (the same shape SQLite's ``datetime()`` produces, minus
+seconds). Because the text sorts in time order, per-day and "upcoming" lookups
+can be written as plain range comparisons on ``appointment_datetime`` and served
+by the ``(doctor_id, status, appointment_datetime)`` index.
+
+Double bookings are caught by ``SCHEDULE``, a per-process index of every
+doctor's active (booked/confirmed) appointments: one sorted list of start
+times per doctor, loaded on first use, so a conflict check is a bisect
+(O(log n)). Every appointment occupies SLOT_MINUTES. Each doctor's list is
+tagged with a version from ``schedule_versions``, which triggers bump on every
+change to that doctor's appointments (migration 10). A check re-reads the
+version (one primary-key lookup) and reloads only that doctor when another
+process changed it. This process's own writes are applied to the lists
+directly (``capture`` / ``ScheduleIndex.apply``).
+"""
+import bisect
+import os
+import re
+import threading
+from datetime import date as _date, datetime, timedelta
+
+CANONICAL_FORMAT = '%Y-%m-%d %H:%M'
+
+# length of one appointment; two appointments of a doctor closer than this clash
+SLOT_MINUTES = int(os.environ.get('HMS_SLOT_MINUTES', 30))
+# statuses that hold a doctor's time
+ACTIVE_STATUSES = ('booked', 'confirmed')
+# used for doctors whose availability text is empty or not understood
+DEFAULT_AVAILABILITY = 'Mon-Fri 09:00-17:00'
+# how far ahead free_slots looks
+SEARCH_DAYS = 60
+# clashing appointments reported per check
+MAX_CLASHES = 5
+
+# formats accepted from forms and found in older rows
+_INPUT_FORMATS = (
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %I:%M %p',
+    '%Y/%m/%d %H:%M',
+    '%d/%m/%Y %H:%M',
+)
+_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%d/%m/%Y')
+
+
+def parse_appointment_datetime(value):
+    """Parse a stored or submitted appointment datetime; returns None if unrecognised."""
+    if not value:
+        return None
+    value = value.strip()
+    for fmt in _INPUT_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return None
+
+
+def normalize_appointment_datetime(date, time=None):
+    """Combine form date/time fields into the canonical text form (None if invalid)."""
+    raw = date.strip() if date else ''
+    if raw and time and time.strip():
+        raw = f"{raw} {time.strip()}"
+    parsed = parse_appointment_datetime(raw)
+    if parsed is None:
+        return None
+    return parsed.strftime(CANONICAL_FORMAT)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedule_versions (
+    doctor_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO schedule_versions(doctor_id) SELECT doctor_id FROM doctors;
+
+CREATE TRIGGER IF NOT EXISTS trg_schedule_appointments_insert AFTER INSERT ON appointments
+WHEN NEW.doctor_id IS NOT NULL
+BEGIN
+    INSERT OR IGNORE INTO schedule_versions(doctor_id) VALUES (NEW.doctor_id);
+    UPDATE schedule_versions SET version = version + 1 WHERE doctor_id = NEW.doctor_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_schedule_appointments_update
+AFTER UPDATE OF doctor_id, status, appointment_datetime ON appointments
+WHEN OLD.doctor_id IS NOT NEW.doctor_id OR OLD.status IS NOT NEW.status
+     OR OLD.appointment_datetime IS NOT NEW.appointment_datetime
+BEGIN
+    INSERT OR IGNORE INTO schedule_versions(doctor_id) SELECT NEW.doctor_id WHERE NEW.doctor_id IS NOT NULL;
+    UPDATE schedule_versions SET version = version + 1 WHERE doctor_id IN (OLD.doctor_id, NEW.doctor_id);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_schedule_appointments_delete AFTER DELETE ON appointments
+WHEN OLD.doctor_id IS NOT NULL
+BEGIN
+    UPDATE schedule_versions SET version = version + 1 WHERE doctor_id = OLD.doctor_id;
+END;
+"""
+
+_DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+_TIME = r'(\d{1,2})(?:[:.](\d{2}))?\s*([ap]\.?m\.?)?'
+_WINDOW_RE = re.compile(r'^\s*(?P<days>[a-z]{3}[a-z]*(?:\s*[-,&/]\s*[a-z]{3}[a-z]*)*)\s+'
+                        + _TIME + r'\s*(?:-|to)\s*' + _TIME + r'\s*$', re.IGNORECASE)
+
+
+def to_minutes(value):
+    # minutes since 0001-01-01; canonical strings are sliced, anything else parsed
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        try:
+            return (_date(int(value[0:4]), int(value[5:7]), int(value[8:10])).toordinal() * 1440
+                    + int(value[11:13]) * 60 + int(value[14:16]))
+        except ValueError:
+            value = parse_appointment_datetime(value)
+            if value is None:
+                return None
+    return value.toordinal() * 1440 + value.hour * 60 + value.minute
+
+
+def from_minutes(minutes):
+    day, minute = divmod(minutes, 1440)
+    return datetime.fromordinal(day).replace(hour=minute // 60, minute=minute % 60).strftime(CANONICAL_FORMAT)
+
+
+def _clock(hour, minute, meridiem):
+    hour, minute = int(hour), int(minute or 0)
+    if meridiem:
+        hour = hour % 12 + (12 if meridiem[0].lower() == 'p' else 0)
+    if hour > 24 or minute > 59:
+        raise ValueError(hour)
+    return hour * 60 + minute
+
+
+def parse_availability(text):
+    """``doctors.availability`` -> {weekday (0 = Monday): [(start, end) minutes]}, or None.
+
+    Understands e.g. 'Mon-Fri 09:00-17:00', 'Mon-Fri 9am-5pm' and several
+    windows separated by ';' ('Mon,Wed 08:00-12:00; Sat 10:00-14:00').
+    """
+    if not text:
+        return None
+    week = {}
+    for part in re.split(r'[;\n]', text):
+        if not part.strip():
+            continue
+        m = _WINDOW_RE.match(part)
+        if not m:
+            return None
+        try:
+            begin = _clock(*m.group(2, 3, 4))
+            end = _clock(*m.group(5, 6, 7))
+        except ValueError:
+            return None
+        if end <= begin:
+            return None
+        for group in re.split(r'\s*[,&/]\s*', m.group('days').lower()):
+            ends = [d.strip()[:3] for d in group.split('-')]
+            if any(d not in _DAYS for d in ends) or len(ends) > 2:
+                return None
+            first, last = _DAYS.index(ends[0]), _DAYS.index(ends[-1])
+            for offset in range((last - first) % 7 + 1):
+                week.setdefault((first + offset) % 7, []).append((begin, end))
+    for windows in week.values():
+        windows.sort()
+    return week or None
+
+
+class _DoctorSchedule:
+    __slots__ = ('version', 'starts', 'ids')
+
+    def __init__(self, version, rows):
+        self.version = version
+        rows.sort()
+        self.starts = [start for start, _ in rows]
+        self.ids = [aid for _, aid in rows]
+
+    def copy(self):
+        clone = _DoctorSchedule.__new__(_DoctorSchedule)
+        clone.version, clone.starts, clone.ids = self.version, list(self.starts), list(self.ids)
+        return clone
+
+    def remove(self, appointment_id):
+        try:
+            i = self.ids.index(appointment_id)
+        except ValueError:
+            return
+        del self.starts[i]
+        del self.ids[i]
+
+    def add(self, start, appointment_id):
+        i = bisect.bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ids.insert(i, appointment_id)
+
+    def overlapping(self, start, slot, exclude_id=None, limit=MAX_CLASHES):
+        # appointments starting less than one slot before or after ``start``
+        lo = bisect.bisect_right(self.starts, start - slot)
+        hi = bisect.bisect_left(self.starts, start + slot)
+        found = []
+        for i in range(lo, hi):
+            if self.ids[i] != exclude_id:
+                found.append((self.ids[i], self.starts[i]))
+                if len(found) >= limit:
+                    break
+        return found
+
+
+def _read_version(conn, doctor_id):
+    row = conn.execute('SELECT version FROM schedule_versions WHERE doctor_id = ?', (doctor_id,)).fetchone()
+    return row[0] if row else 0
+
+
+class _Change:
+    """An appointment's scheduling state before and after a write (see ScheduleIndex.capture)."""
+
+    def __init__(self, appointment_id, before):
+        self.appointment_id = appointment_id
+        self.before = before
+        self.after = None
+        self.versions = {}
+
+    def finish(self, conn):
+        """Call after the write, in the same transaction."""
+        self.after = _state(conn, self.appointment_id)
+        doctors = {state[0] for state in (self.before, self.after) if state and state[0] is not None}
+        self.versions = {d: _read_version(conn, d) for d in doctors}
+        return self
+
+
+def _state(conn, appointment_id):
+    row = conn.execute('SELECT doctor_id, appointment_datetime, status FROM appointments WHERE id = ?',
+                       (appointment_id,)).fetchone()
+    if row is None:
+        return None
+    return row[0], to_minutes(row[1]) if row[1] else None, row[2] in ACTIVE_STATUSES
+
+
+class ScheduleIndex:
+    """Per-doctor sorted start times of active appointments, shared by all request threads."""
+
+    def __init__(self, slot_minutes=SLOT_MINUTES):
+        self.slot = slot_minutes
+        self._lock = threading.Lock()
+        self._doctors = {}
+        self._stats = {'checks': 0, 'loads': 0, 'applied': 0, 'dropped': 0}
+
+    def _load(self, conn, doctor_id, version):
+        self._stats['loads'] += 1
+        marks = ', '.join('?' for _ in ACTIVE_STATUSES)
+        # idx_appointments_doctor_status_dt: this doctor's active rows only
+        rows = []
+        for aid, when in conn.execute(f'SELECT id, appointment_datetime FROM appointments '
+                                      f'WHERE doctor_id = ? AND status IN ({marks})',
+                                      (doctor_id, *ACTIVE_STATUSES)):
+            start = to_minutes(when) if when else None
+            if start is not None:
+                rows.append((start, aid))
+        return _DoctorSchedule(version, rows)
+
+    def schedule(self, conn, doctor_id, store=True):
+        """The doctor's current schedule. Write units pass ``store=False``: a list
+        read inside a transaction that may still roll back is not cached."""
+        version = _read_version(conn, doctor_id)
+        with self._lock:
+            cached = self._doctors.get(doctor_id)
+            if cached is not None and cached.version == version:
+                return cached
+            fresh = self._load(conn, doctor_id, version)
+            if store:
+                self._doctors[doctor_id] = fresh
+            return fresh
+
+    def snapshot(self, conn, doctor_id, store=True):
+        """A private copy of the doctor's schedule, for planning many writes at once."""
+        return self.schedule(conn, doctor_id, store).copy()
+
+    def conflicts(self, conn, doctor_id, when, exclude_id=None, store=True):
+        """[(appointment id, 'YYYY-MM-DD HH:MM')] of the doctor's active appointments
+        overlapping a slot starting at ``when`` (``exclude_id`` is the one being moved),
+        at most MAX_CLASHES of them."""
+        start = to_minutes(when)
+        if doctor_id is None or start is None:
+            return []
+        self._stats['checks'] += 1
+        found = self.schedule(conn, doctor_id, store).overlapping(start, self.slot, exclude_id)
+        return [(aid, from_minutes(t)) for aid, t in found]
+
+    def free_slots(self, conn, doctor_id, availability, after, count=5, exclude_id=None, store=True):
+        """The first ``count`` conflict-free slot starts at or after ``after``
+        within the doctor's availability, looking SEARCH_DAYS ahead."""
+        start = to_minutes(after)
+        if start is None:
+            return []
+        week = parse_availability(availability) or parse_availability(DEFAULT_AVAILABILITY)
+        sched = self.schedule(conn, doctor_id, store)
+        slots = []
+        first_day = start // 1440
+        for day in range(first_day, first_day + SEARCH_DAYS):
+            base = day * 1440
+            for begin, end in week.get(datetime.fromordinal(day).weekday(), ()):
+                t = base + begin
+                if t < start:
+                    # next slot on this window's grid
+                    t += -(-(start - t) // self.slot) * self.slot
+                while t + self.slot <= base + end:
+                    if not sched.overlapping(t, self.slot, exclude_id):
+                        slots.append(from_minutes(t))
+                        if len(slots) >= count:
+                            return slots
+                    t += self.slot
+        return slots
+
+    def capture(self, conn, appointment_id):
+        """Start tracking a write to one appointment; call ``finish(conn)`` on the
+        result after the write and ``apply`` it once committed."""
+        return _Change(appointment_id, _state(conn, appointment_id))
+
+    def apply(self, change):
+        """Apply a committed write to the cached lists. A doctor whose version moved
+        by more than this write (another writer got in between) is dropped and
+        reloaded on next use."""
+        with self._lock:
+            for doctor_id, version in change.versions.items():
+                cached = self._doctors.get(doctor_id)
+                if cached is None or cached.version == version:
+                    continue
+                if cached.version != version - 1:
+                    del self._doctors[doctor_id]
+                    self._stats['dropped'] += 1
+                    continue
+                cached.remove(change.appointment_id)
+                after = change.after
+                if after and after[0] == doctor_id and after[2] and after[1] is not None:
+                    cached.add(after[1], change.appointment_id)
+                cached.version = version
+                self._stats['applied'] += 1
+
+    def invalidate(self, doctor_id=None):
+        with self._lock:
+            if doctor_id is None:
+                self._doctors.clear()
+            else:
+                self._doctors.pop(doctor_id, None)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['doctors'] = len(self._doctors)
+            out['appointments'] = sum(len(s.ids) for s in self._doctors.values())
+        return out
+
+
+SCHEDULE = ScheduleIndex()
+
+
+def reschedule(conn, appointment_id, values, force=False, index=SCHEDULE):
+    """Write unit: ``UPDATE appointments SET <values>`` unless that double-books the doctor.
+
+    ``values`` maps column -> value (doctor_id, appointment_datetime, status, ...).
+    Returns (change, clashes). With clashes and no ``force`` nothing is written
+    and change is None; otherwise pass the change to ``index.apply`` once the
+    unit has committed.
+    """
+    change = index.capture(conn, appointment_id)
+    if change.before is None:
+        return None, []
+    doctor_id, start, active = change.before
+    doctor_id = values.get('doctor_id', doctor_id)
+    if 'appointment_datetime' in values:
+        start = values['appointment_datetime']
+    if 'status' in values:
+        active = values['status'] in ACTIVE_STATUSES
+    clashes = index.conflicts(conn, doctor_id, start, exclude_id=appointment_id, store=False) if active else []
+    if clashes and not force:
+        return None, clashes
+    assignments = ', '.join(f'{column} = ?' for column in values)
+    conn.execute(f'UPDATE appointments SET {assignments} WHERE id = ?', (*values.values(), appointment_id))
+    return change.finish(conn), clashes
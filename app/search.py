@@ -0,0 +1,309 @@
+"""Full-text search (SQLite FTS5).
+
+``patients_fts`` indexes patient name, phone and address for the admin patient
+search. It is created by migration 6 and kept in sync by triggers on
+``patients``. Phone numbers are indexed twice: once as written ("555-0142",
+i.e. the tokens 555 and 0142) and once as bare digits ("5550142"), so typing
+any part of the number works.
+
+``notes_fts`` indexes the clinical text (treatment description/notes,
+prescription notes, appointment notes/actions) for the doctor notes search
+(migration 7). One FTS row per source row, keyed by ``id * 4 + kind`` so
+triggers can update or delete it by rowid. The ``owner`` column holds a single
+token for the patient's assigned doctor ("d12"), so scoping a search to one
+doctor's patients is part of the MATCH instead of a filter over every hit.
+Reassigning a patient rewrites the owner of that patient's notes. Archived
+appointments (archive.py) keep their notes_fts rows (NOTES_ARCHIVE_SCHEMA).
+
+Queries are built by ``fts_query``: every word becomes a quoted prefix term,
+so "jo smi" finds "John Smith" and user input can never be parsed as FTS
+syntax.
+
+    python search.py rebuild [path/to/hospital_management.db]
+"""
+import re
+import sys
+
+from markupsafe import Markup, escape
+
+import db
+
+# bare digits of a phone number, for SQL triggers (SQLite has no regexp_replace)
+_PHONE_DIGITS = "replace(replace(replace(replace(replace(replace({col}, '-', ''), ' ', ''), '(', ''), ')', ''), '+', ''), '.', '')"
+
+PATIENT_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+    first_name, last_name, phone, address, phone_digits,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_patients_fts_insert AFTER INSERT ON patients
+BEGIN
+    INSERT INTO patients_fts(rowid, first_name, last_name, phone, address, phone_digits)
+    VALUES (NEW.id, NEW.first_name, NEW.last_name, NEW.phone, NEW.address, {_PHONE_DIGITS.format(col='NEW.phone')});
+END;
+CREATE TRIGGER IF NOT EXISTS trg_patients_fts_update AFTER UPDATE OF first_name, last_name, phone, address ON patients
+BEGIN
+    UPDATE patients_fts
+    SET first_name = NEW.first_name, last_name = NEW.last_name, phone = NEW.phone, address = NEW.address,
+        phone_digits = {_PHONE_DIGITS.format(col='NEW.phone')}
+    WHERE rowid = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_patients_fts_delete AFTER DELETE ON patients
+BEGIN
+    DELETE FROM patients_fts WHERE rowid = OLD.id;
+END;
+"""
+
+# notes_fts rowid = source id * 4 + kind
+NOTE_KINDS = {1: 'treatment', 2: 'prescription', 3: 'appointment'}
+
+# (kind, table, text columns)
+_NOTE_SOURCES = (
+    (1, 'treatments', ('description', 'notes')),
+    (2, 'prescriptions', ('notes',)),
+    (3, 'appointments', ('notes', 'actions')),
+)
+
+
+def _note_text(row, columns):
+    # text columns joined by newlines; '' when all are empty
+    joined = " || char(10) || ".join(f"coalesce({row}.{c}, '')" for c in columns)
+    return f"trim({joined}, char(10) || ' ')"
+
+
+def _note_triggers(kind, table, columns):
+    text = _note_text('NEW', columns)
+    insert = f"""
+    INSERT INTO notes_fts(rowid, owner, body, patient_id)
+    SELECT NEW.id * 4 + {kind}, (SELECT 'd' || doctor FROM patients WHERE id = NEW.patient_id), {text}, NEW.patient_id
+    WHERE {text} <> '';"""
+    return f"""
+CREATE TRIGGER IF NOT EXISTS trg_notes_{table}_insert AFTER INSERT ON {table}
+BEGIN{insert}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_notes_{table}_update AFTER UPDATE OF {', '.join(columns)}, patient_id ON {table}
+BEGIN
+    DELETE FROM notes_fts WHERE rowid = OLD.id * 4 + {kind};{insert}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_notes_{table}_delete AFTER DELETE ON {table}
+BEGIN
+    DELETE FROM notes_fts WHERE rowid = OLD.id * 4 + {kind};
+END;
+"""
+
+
+NOTES_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+    owner, body, patient_id UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+-- the owner token only scopes a search; rank by the text alone
+INSERT INTO notes_fts(notes_fts, rank) VALUES ('rank', 'bm25(0.0, 1.0)');
+""" + ''.join(_note_triggers(*source) for source in _NOTE_SOURCES)
+
+# re-tag a patient's notes when the patient moves to another doctor; the WHEN
+# keeps an UPDATE that writes the same doctor back (every admin patient edit)
+# from rewriting all of the patient's index rows
+NOTES_OWNER_SCHEMA = """
+DROP TRIGGER IF EXISTS trg_notes_patients_owner;
+CREATE TRIGGER trg_notes_patients_owner AFTER UPDATE OF doctor ON patients
+WHEN OLD.doctor IS NOT NEW.doctor
+BEGIN
+    UPDATE notes_fts SET owner = 'd' || NEW.doctor
+    WHERE rowid IN (
+        SELECT id * 4 + 1 FROM treatments WHERE patient_id = NEW.id
+        UNION ALL SELECT id * 4 + 2 FROM prescriptions WHERE patient_id = NEW.id
+        UNION ALL SELECT id * 4 + 3 FROM appointments WHERE patient_id = NEW.id
+    );
+END;
+"""
+
+# archived appointments (migration 8): the archival job re-indexes them with
+# index_archived_notes after the hot delete trigger removed them
+NOTES_ARCHIVE_SCHEMA = """
+CREATE TRIGGER IF NOT EXISTS trg_notes_appointments_archive_delete AFTER DELETE ON appointments_archive
+BEGIN
+    DELETE FROM notes_fts WHERE rowid = OLD.id * 4 + 3;
+END;
+"""
+
+# same doctor-change guard as NOTES_OWNER_SCHEMA
+NOTES_ARCHIVE_OWNER_SCHEMA = """
+DROP TRIGGER IF EXISTS trg_notes_archive_owner;
+CREATE TRIGGER trg_notes_archive_owner AFTER UPDATE OF doctor ON patients
+WHEN OLD.doctor IS NOT NEW.doctor
+BEGIN
+    UPDATE notes_fts SET owner = 'd' || NEW.doctor
+    WHERE rowid IN (SELECT id * 4 + 3 FROM appointments_archive WHERE patient_id = NEW.id);
+END;
+"""
+_ARCHIVED_NOTE_SOURCE = (3, 'appointments_archive', ('notes', 'actions'))
+
+# matches ranked per search; beyond this the newest CANDIDATES matches are ranked
+# and the results are marked ``truncated`` so the page can ask for a narrower
+# search. bm25 has to score every candidate, so an unbounded "ma" over a million
+# patients would cost close to a second instead of a few milliseconds.
+CANDIDATES = 1000
+
+
+class Results(list):
+    """Search result rows; ``truncated`` is True when older matches were not ranked."""
+
+    def __init__(self, rows=(), truncated=False):
+        super().__init__(rows)
+        self.truncated = truncated
+
+# words of a search box entry; anything else (quotes, operators, punctuation) is dropped
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 MATCH expression of quoted prefix terms (None if empty)."""
+    words = _WORD.findall(text or '')
+    if not words:
+        return None
+    return ' '.join(f'"{w}"*' for w in words)
+
+
+def search_patients(conn, text, limit=50):
+    """Best-matching patients (with doctor_name), most relevant first, as Results."""
+    match = fts_query(text)
+    if match is None:
+        return Results()
+    # the inner query walks the index newest-first and stops after CANDIDATES + 1
+    # rows; getting the extra one tells us there were more than CANDIDATES
+    rows = conn.execute('''
+        SELECT p.*, d.f_name || ' ' || d.l_name AS doctor_name, f.candidates
+        FROM (SELECT rowid, rank, count(*) OVER () AS candidates
+              FROM (SELECT rowid, rank FROM patients_fts WHERE patients_fts MATCH ? ORDER BY rowid DESC LIMIT ?)) f
+        JOIN patients p ON p.id = f.rowid
+        LEFT JOIN doctors d ON d.doctor_id = p.doctor
+        ORDER BY f.rank
+        LIMIT ?
+    ''', (match, CANDIDATES + 1, limit)).fetchall()
+    return Results(rows, truncated=bool(rows) and rows[0]['candidates'] > CANDIDATES)
+
+
+def notes_query(doctor_id, text):
+    """MATCH expression for ``text`` in the notes of one doctor's patients (None if empty)."""
+    match = fts_query(text)
+    if match is None:
+        return None
+    return f'owner : "d{int(doctor_id)}" AND body : ({match})'
+
+
+def search_notes(conn, doctor_id, text, limit=50):
+    """Best-matching notes on the doctor's own patients, most relevant first.
+
+    Rows are dicts with note_id, kind, source_id, patient_id, patient_name,
+    noted_at and ``snippet`` (Markup, matches wrapped in <mark>), returned as
+    Results (``truncated`` when older notes were not ranked).
+    """
+    if doctor_id is None:
+        return Results()
+    match = notes_query(doctor_id, text)
+    if match is None:
+        return Results()
+    # rank the newest CANDIDATES matches (+1 to detect more; snippets are only
+    # built for those); the patients.doctor check keeps results scoped even if
+    # an owner token were stale
+    rows = conn.execute('''
+        SELECT f.note_id, f.patient_id, f.snippet, f.candidates,
+               p.first_name || ' ' || p.last_name AS patient_name,
+               coalesce(t.start_date, pr.created_at, a.appointment_datetime, aa.appointment_datetime) AS noted_at
+        FROM (SELECT note_id, patient_id, rank, snippet, count(*) OVER () AS candidates
+              FROM (SELECT rowid AS note_id, patient_id, rank,
+                           snippet(notes_fts, 1, char(2), char(3), '…', 16) AS snippet
+                    FROM notes_fts WHERE notes_fts MATCH ? ORDER BY rowid DESC LIMIT ?)) f
+        JOIN patients p ON p.id = f.patient_id
+        LEFT JOIN treatments t ON f.note_id % 4 = 1 AND t.id = f.note_id / 4
+        LEFT JOIN prescriptions pr ON f.note_id % 4 = 2 AND pr.id = f.note_id / 4
+        LEFT JOIN appointments a ON f.note_id % 4 = 3 AND a.id = f.note_id / 4
+        LEFT JOIN appointments_archive aa ON f.note_id % 4 = 3 AND aa.id = f.note_id / 4
+        WHERE p.doctor = ?
+        ORDER BY f.rank
+        LIMIT ?
+    ''', (match, CANDIDATES + 1, doctor_id, limit)).fetchall()
+    results = Results(truncated=bool(rows) and rows[0]['candidates'] > CANDIDATES)
+    for r in rows:
+        r = dict(r)
+        del r['candidates']
+        r['kind'] = NOTE_KINDS.get(r['note_id'] % 4)
+        r['source_id'] = r['note_id'] // 4
+        r['snippet'] = _highlight(r['snippet'])
+        results.append(r)
+    return results
+
+
+def _highlight(snippet):
+    # snippet() marks matches with \x02 ... \x03: escape the note text, then turn those into <mark>
+    text = str(escape(snippet or ''))
+    return Markup(text.replace('\x02', '<mark>').replace('\x03', '</mark>'))
+
+
+def rebuild_patients(conn):
+    """Repopulate patients_fts from the patients table (caller commits)."""
+    conn.execute('DELETE FROM patients_fts')
+    conn.execute(f'''
+        INSERT INTO patients_fts(rowid, first_name, last_name, phone, address, phone_digits)
+        SELECT id, first_name, last_name, phone, address, {_PHONE_DIGITS.format(col='phone')} FROM patients
+    ''')
+    conn.execute("INSERT INTO patients_fts(patients_fts) VALUES ('optimize')")
+    return conn.execute('SELECT COUNT(*) FROM patients_fts').fetchone()[0]
+
+
+def _index_notes(conn, kind, table, columns, where='1', params=()):
+    text = _note_text('s', columns)
+    conn.execute(f'''
+        INSERT INTO notes_fts(rowid, owner, body, patient_id)
+        SELECT s.id * 4 + {kind}, 'd' || p.doctor, {text}, s.patient_id
+        FROM {table} s
+        LEFT JOIN patients p ON p.id = s.patient_id
+        WHERE {text} <> '' AND {where}
+    ''', params)
+
+
+def index_archived_notes(conn, ids):
+    """Index the notes of appointments just moved to appointments_archive."""
+    _index_notes(conn, *_ARCHIVED_NOTE_SOURCE, where=f"s.id IN ({', '.join('?' for _ in ids)})", params=ids)
+
+
+def rebuild_notes(conn):
+    """Repopulate notes_fts from treatments, prescriptions and appointments (caller commits)."""
+    conn.execute('DELETE FROM notes_fts')
+    sources = list(_NOTE_SOURCES)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'appointments_archive'").fetchone():
+        sources.append(_ARCHIVED_NOTE_SOURCE)
+    for kind, table, columns in sources:
+        _index_notes(conn, kind, table, columns)
+    conn.execute("INSERT INTO notes_fts(notes_fts) VALUES ('optimize')")
+    return conn.execute('SELECT COUNT(*) FROM notes_fts').fetchone()[0]
+
+
+# index name -> rebuild function
+REBUILDERS = {
+    'patients': rebuild_patients,
+    'notes': rebuild_notes,
+}
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] != 'rebuild':
+        print('usage: python search.py rebuild [db]')
+        return 2
+    conn = db.connect(argv[2] if len(argv) > 2 else db.DATABASE)
+    try:
+        conn.execute('BEGIN IMMEDIATE;')
+        for name, rebuild in REBUILDERS.items():
+            print(f'{name}: {rebuild(conn)} rows indexed')
+        conn.commit()
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,195 @@
+"""SQL timing per route and per statement, plus the slow-query log.
+
+``init_app`` installs a ``SqlMetrics`` collector as a query listener on the
+connection pool (see db.add_query_listener). Every statement run through
+``get_db()`` or in a writer-thread unit (writer.py, attributed to the route that
+submitted it) is added to a latency histogram for its route and for its
+(route, statement) pair. Statements slower than the threshold are written to
+the slow-query log together with their ``EXPLAIN QUERY PLAN``. The admin
+``/admin/metrics`` endpoint serves ``snapshot()`` as JSON.
+
+Settings (app.config, defaulting to the environment):
+    SQL_METRICS          HMS_SQL_METRICS=0 turns instrumentation off
+    SQL_SLOW_QUERY_MS    HMS_SLOW_QUERY_MS, threshold in ms (default 100)
+    SQL_SLOW_QUERY_LOG   HMS_SLOW_QUERY_LOG, file to append to (default: stdout)
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+import db
+
+# histogram bucket upper bounds in milliseconds (the last bucket is open-ended)
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+SLOW_QUERY_MS = float(os.environ.get('HMS_SLOW_QUERY_MS', 100))
+SLOW_QUERY_LOG = os.environ.get('HMS_SLOW_QUERY_LOG') or None
+# distinct statements tracked per process; anything beyond is counted under '(other)'
+MAX_STATEMENTS = 500
+RECENT_SLOW = 50
+
+_WS = re.compile(r'\s+')
+
+
+def normalize(sql):
+    return _WS.sub(' ', sql).strip()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+
+    def observe(self, ms, rows):
+        i = 0
+        while i < len(BUCKETS_MS) and ms > BUCKETS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.rows += rows
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (max for the open bucket)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'rows': self.rows,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+            'max_ms': round(self.max_ms, 3),
+            'buckets': [[bound, n] for bound, n in zip(list(BUCKETS_MS) + ['inf'], self.counts)],
+        }
+
+
+def explain(conn, sql, params):
+    """EXPLAIN QUERY PLAN rows as text lines; empty if the statement can't be explained."""
+    try:
+        return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params or ())]
+    except (sqlite3.Error, ValueError):
+        return []
+
+
+class SqlMetrics:
+    """Query listener aggregating pooled-connection QueryRecords."""
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS, slow_log=SLOW_QUERY_LOG):
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.routes = {}
+            self.statements = {}
+            self.slow = deque(maxlen=RECENT_SLOW)
+            self.slow_total = 0
+            self.since = time.time()
+
+    def __call__(self, conn, records):
+        slow = []
+        with self._lock:
+            for rec in records:
+                ms = rec.elapsed * 1000
+                route = rec.endpoint or '(no request)'
+                stmt = normalize(rec.sql)
+                self.routes.setdefault(route, Histogram()).observe(ms, rec.rows)
+                key = (route, stmt)
+                hist = self.statements.get(key)
+                if hist is None:
+                    if len(self.statements) >= MAX_STATEMENTS:
+                        key = (route, '(other)')
+                    hist = self.statements.setdefault(key, Histogram())
+                hist.observe(ms, rec.rows)
+                if ms >= self.slow_ms:
+                    self.slow_total += 1
+                    slow.append((rec, route, stmt, ms))
+        # EXPLAIN outside the lock; the connection is still checked out by this request
+        for rec, route, stmt, ms in slow:
+            self.log_slow(conn, rec, route, stmt, ms)
+
+    def log_slow(self, conn, rec, route, stmt, ms):
+        plan = explain(conn, rec.sql, rec.params)
+        entry = {
+            'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'route': route,
+            'ms': round(ms, 3),
+            'rows': rec.rows,
+            'sql': stmt,
+            'params': [repr(p) for p in rec.params] if isinstance(rec.params, (list, tuple)) else None,
+            'plan': plan,
+        }
+        with self._lock:
+            self.slow.append(entry)
+        lines = [f"[slow query] {entry['at']} {route} {entry['ms']:.1f}ms rows={rec.rows}: {stmt}"]
+        if entry['params']:
+            lines.append('  params: ' + ', '.join(entry['params']))
+        lines.extend('  plan: ' + detail for detail in plan)
+        text = '\n'.join(lines)
+        if self.slow_log:
+            with open(self.slow_log, 'a', encoding='utf-8') as fh:
+                fh.write(text + '\n')
+        else:
+            print(text)
+
+    def snapshot(self):
+        with self._lock:
+            routes = {name: h.to_dict() for name, h in sorted(self.routes.items())}
+            statements = [
+                dict(h.to_dict(), route=route, sql=stmt)
+                for (route, stmt), h in sorted(self.statements.items(), key=lambda kv: -kv[1].total_ms)
+            ]
+            return {
+                'since': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.since)),
+                'slow_query_ms': self.slow_ms,
+                'slow_queries': self.slow_total,
+                'bucket_bounds_ms': list(BUCKETS_MS),
+                'routes': routes,
+                'statements': statements,
+                'recent_slow': list(self.slow),
+            }
+
+
+def enabled(value):
+    """Is a config/env switch on? ('0', 'false', 'no', 'off' and '' are off.)"""
+    return str(value).strip().lower() not in ('0', 'false', 'no', 'off', '')
+
+
+def init_app(app):
+    """Install the collector on the app's pool unless SQL_METRICS is off."""
+    if not enabled(app.config.get('SQL_METRICS', os.environ.get('HMS_SQL_METRICS', '1'))):
+        return None
+    metrics = SqlMetrics(
+        float(app.config.get('SQL_SLOW_QUERY_MS', SLOW_QUERY_MS)),
+        app.config.get('SQL_SLOW_QUERY_LOG', SLOW_QUERY_LOG),
+    )
+    app.extensions['hms_sql_metrics'] = metrics
+    db.add_query_listener(metrics, app)
+    return metrics
+
+
+def get_metrics(app=None):
+    return (app or current_app).extensions.get('hms_sql_metrics')
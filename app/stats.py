@@ -0,0 +1,229 @@
+"""Dashboard counters kept in the single-row ``stats_counters`` table.
+
+INSERT/DELETE/UPDATE triggers (created by migration 3, see migrations.py) keep
+the row current, so the admin dashboard reads one row instead of running
+COUNT(*) over every table. ``rebuild`` recomputes everything from scratch and
+``reconcile`` reports (and optionally fixes) drift.
+
+    python stats.py [--fix] [path/to/hospital_management.db]
+"""
+import sys
+
+import db
+
+# column -> SQL that computes its true value
+COUNTER_QUERIES = {
+    'patients': 'SELECT COUNT(*) FROM patients',
+    'doctors': 'SELECT COUNT(*) FROM doctors',
+    'rooms': 'SELECT COUNT(*) FROM rooms',
+    'bills': 'SELECT COUNT(*) FROM bills',
+    'unpaid_bills': 'SELECT COUNT(*) FROM bills WHERE paid = 0',
+    'unpaid_total': 'SELECT COALESCE(SUM(total_amount), 0) FROM bills WHERE paid = 0',
+    'appointments_booked': "SELECT COUNT(*) FROM appointments WHERE status = 'booked'",
+    'appointments_confirmed': "SELECT COUNT(*) FROM appointments WHERE status = 'confirmed'",
+    'appointments_cancelled': "SELECT COUNT(*) FROM appointments WHERE status = 'cancelled'",
+    'appointments_completed': "SELECT COUNT(*) FROM appointments WHERE status = 'completed'",
+}
+
+# archived rows (archive.py) still count towards the totals
+ARCHIVE_QUERIES = {
+    'bills': 'SELECT COUNT(*) FROM bills_archive',
+    'appointments_cancelled': "SELECT COUNT(*) FROM appointments_archive WHERE status = 'cancelled'",
+    'appointments_completed': "SELECT COUNT(*) FROM appointments_archive WHERE status = 'completed'",
+}
+
+# money columns are compared with a tolerance
+_TOLERANCE = {'unpaid_total': 0.005}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stats_counters (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    patients INTEGER NOT NULL DEFAULT 0,
+    doctors INTEGER NOT NULL DEFAULT 0,
+    rooms INTEGER NOT NULL DEFAULT 0,
+    bills INTEGER NOT NULL DEFAULT 0,
+    unpaid_bills INTEGER NOT NULL DEFAULT 0,
+    unpaid_total REAL NOT NULL DEFAULT 0,
+    appointments_booked INTEGER NOT NULL DEFAULT 0,
+    appointments_confirmed INTEGER NOT NULL DEFAULT 0,
+    appointments_cancelled INTEGER NOT NULL DEFAULT 0,
+    appointments_completed INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO stats_counters(id) VALUES (1);
+
+CREATE TRIGGER IF NOT EXISTS trg_stats_patients_insert AFTER INSERT ON patients
+BEGIN
+    UPDATE stats_counters SET patients = patients + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_stats_patients_delete AFTER DELETE ON patients
+BEGIN
+    UPDATE stats_counters SET patients = patients - 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_stats_doctors_insert AFTER INSERT ON doctors
+BEGIN
+    UPDATE stats_counters SET doctors = doctors + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_stats_doctors_delete AFTER DELETE ON doctors
+BEGIN
+    UPDATE stats_counters SET doctors = doctors - 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_stats_rooms_insert AFTER INSERT ON rooms
+BEGIN
+    UPDATE stats_counters SET rooms = rooms + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_stats_rooms_delete AFTER DELETE ON rooms
+BEGIN
+    UPDATE stats_counters SET rooms = rooms - 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_stats_bills_insert AFTER INSERT ON bills
+BEGIN
+    UPDATE stats_counters
+    SET bills = bills + 1,
+        unpaid_bills = unpaid_bills + (COALESCE(NEW.paid, 0) = 0),
+        unpaid_total = unpaid_total + CASE WHEN COALESCE(NEW.paid, 0) = 0 THEN COALESCE(NEW.total_amount, 0) ELSE 0 END
+    WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_stats_bills_delete AFTER DELETE ON bills
+BEGIN
+    UPDATE stats_counters
+    SET bills = bills - 1,
+        unpaid_bills = unpaid_bills - (COALESCE(OLD.paid, 0) = 0),
+        unpaid_total = unpaid_total - CASE WHEN COALESCE(OLD.paid, 0) = 0 THEN COALESCE(OLD.total_amount, 0) ELSE 0 END
+    WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_stats_bills_update AFTER UPDATE OF paid, total_amount ON bills
+BEGIN
+    UPDATE stats_counters
+    SET unpaid_bills = unpaid_bills + (COALESCE(NEW.paid, 0) = 0) - (COALESCE(OLD.paid, 0) = 0),
+        unpaid_total = unpaid_total
+            + CASE WHEN COALESCE(NEW.paid, 0) = 0 THEN COALESCE(NEW.total_amount, 0) ELSE 0 END
+            - CASE WHEN COALESCE(OLD.paid, 0) = 0 THEN COALESCE(OLD.total_amount, 0) ELSE 0 END
+    WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_stats_appointments_insert AFTER INSERT ON appointments
+BEGIN
+    UPDATE stats_counters
+    SET appointments_booked = appointments_booked + (NEW.status = 'booked'),
+        appointments_confirmed = appointments_confirmed + (NEW.status = 'confirmed'),
+        appointments_cancelled = appointments_cancelled + (NEW.status = 'cancelled'),
+        appointments_completed = appointments_completed + (NEW.status = 'completed')
+    WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_stats_appointments_delete AFTER DELETE ON appointments
+BEGIN
+    UPDATE stats_counters
+    SET appointments_booked = appointments_booked - (OLD.status = 'booked'),
+        appointments_confirmed = appointments_confirmed - (OLD.status = 'confirmed'),
+        appointments_cancelled = appointments_cancelled - (OLD.status = 'cancelled'),
+        appointments_completed = appointments_completed - (OLD.status = 'completed')
+    WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_stats_appointments_status AFTER UPDATE OF status ON appointments
+WHEN NEW.status IS NOT OLD.status
+BEGIN
+    UPDATE stats_counters
+    SET appointments_booked = appointments_booked + (NEW.status = 'booked') - (OLD.status = 'booked'),
+        appointments_confirmed = appointments_confirmed + (NEW.status = 'confirmed') - (OLD.status = 'confirmed'),
+        appointments_cancelled = appointments_cancelled + (NEW.status = 'cancelled') - (OLD.status = 'cancelled'),
+        appointments_completed = appointments_completed + (NEW.status = 'completed') - (OLD.status = 'completed')
+    WHERE id = 1;
+END;
+"""
+
+
+# migration 8: moving a row into the archive is a delete (-1) plus an insert (+1)
+ARCHIVE_SCHEMA = """
+CREATE TRIGGER IF NOT EXISTS trg_stats_bills_archive_insert AFTER INSERT ON bills_archive
+BEGIN
+    UPDATE stats_counters SET bills = bills + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_stats_bills_archive_delete AFTER DELETE ON bills_archive
+BEGIN
+    UPDATE stats_counters SET bills = bills - 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_stats_appointments_archive_insert AFTER INSERT ON appointments_archive
+BEGIN
+    UPDATE stats_counters
+    SET appointments_cancelled = appointments_cancelled + (NEW.status = 'cancelled'),
+        appointments_completed = appointments_completed + (NEW.status = 'completed')
+    WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_stats_appointments_archive_delete AFTER DELETE ON appointments_archive
+BEGIN
+    UPDATE stats_counters
+    SET appointments_cancelled = appointments_cancelled - (OLD.status = 'cancelled'),
+        appointments_completed = appointments_completed - (OLD.status = 'completed')
+    WHERE id = 1;
+END;
+"""
+
+
+def read(conn):
+    """Current counters as a dict (one primary-key row read)."""
+    row = conn.execute('SELECT * FROM stats_counters WHERE id = 1').fetchone()
+    if row is None:
+        return {name: 0 for name in COUNTER_QUERIES}
+    return {name: row[name] for name in COUNTER_QUERIES}
+
+
+def actual(conn):
+    values = {name: conn.execute(sql).fetchone()[0] for name, sql in COUNTER_QUERIES.items()}
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bills_archive'").fetchone():
+        for name, sql in ARCHIVE_QUERIES.items():
+            values[name] += conn.execute(sql).fetchone()[0]
+    return values
+
+
+def rebuild(conn):
+    """Recompute every counter from the base tables (caller commits)."""
+    values = actual(conn)
+    cols = ', '.join(values)
+    marks = ', '.join('?' for _ in values)
+    conn.execute(f'INSERT OR REPLACE INTO stats_counters (id, {cols}) VALUES (1, {marks})', tuple(values.values()))
+    return values
+
+
+def reconcile(conn, fix=False):
+    """Return {counter: (stored, actual)} for counters that drifted; rebuild when fix=True."""
+    conn.execute('BEGIN;')
+    try:
+        stored = read(conn)
+        real = actual(conn)
+        drift = {}
+        for name, value in real.items():
+            if abs((stored[name] or 0) - (value or 0)) > _TOLERANCE.get(name, 0):
+                drift[name] = (stored[name], value)
+        if fix and drift:
+            rebuild(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return drift
+
+
+def main(argv):
+    fix = '--fix' in argv
+    args = [a for a in argv[1:] if a != '--fix']
+    conn = db.connect(args[0] if args else db.DATABASE)
+    try:
+        drift = reconcile(conn, fix=fix)
+    finally:
+        conn.close()
+    if not drift:
+        print('stats_counters are in sync.')
+        return 0
+    for name, (stored, value) in drift.items():
+        print(f'{name}: stored={stored} actual={value}')
+    if fix:
+        print(f'Rebuilt stats_counters ({len(drift)} counter(s) corrected).')
+        return 0
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,140 @@
+"""A patient's chart as one time-ordered list of events.
+
+``events(conn, patient_id)`` returns the patient's appointments, treatments,
+prescriptions, lab tests and bills (archived appointments and bills included)
+as dicts with the same keys: kind, id, at, title, detail, status, amount and
+doctor_id. They come from one UNION ALL query, each branch an index range on
+``patient_id``, sorted ascending by (at, kind, id), which is the order
+``pagination.paginate_rows`` pages through (newest first).
+
+``TIMELINE`` keeps the lists of the last TIMELINE_CACHE_SIZE patients, so
+viewing a chart again runs no SQL. Routes that write anything shown in a chart
+call ``invalidate(patient_id)`` after the write commits. A list is only stored
+if its read started after the patient's last invalidation; a request still on
+an older WAL snapshot cannot put stale events back. Writes from other
+processes (the CLIs, a second app process) show up after TIMELINE_TTL seconds.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+TIMELINE_CACHE_SIZE = int(os.environ.get('HMS_TIMELINE_CACHE_SIZE', 256))
+TIMELINE_TTL = float(os.environ.get('HMS_TIMELINE_TTL', 300))
+
+# one branch per event type; every branch binds the patient id once
+EVENTS_SQL = '''
+    SELECT 'appointment' AS kind, id, COALESCE(appointment_datetime, '') AS at, 'Appointment' AS title,
+           notes AS detail, status, fee AS amount, doctor_id
+    FROM appointments WHERE patient_id = ?
+    UNION ALL
+    SELECT 'appointment', id, COALESCE(appointment_datetime, ''), 'Appointment', notes, status, fee, doctor_id
+    FROM appointments_archive WHERE patient_id = ?
+    UNION ALL
+    SELECT 'treatment', id, COALESCE(start_date, ''), COALESCE(description, 'Treatment'), notes,
+           CASE WHEN end_date IS NULL THEN NULL ELSE 'ended ' || end_date END, cost, doctor_id
+    FROM treatments WHERE patient_id = ?
+    UNION ALL
+    SELECT 'prescription', p.id, COALESCE(p.created_at, ''),
+           COALESCE((SELECT group_concat(m.name || COALESCE(' ' || i.dosage, '') || ' x' || i.quantity, ', ')
+                     FROM prescription_items i JOIN medications m ON m.id = i.medication_id
+                     WHERE i.prescription_id = p.id), 'Prescription'),
+           p.notes, NULL,
+           (SELECT SUM(COALESCE(i.unit_price, 0) * COALESCE(i.quantity, 1))
+            FROM prescription_items i WHERE i.prescription_id = p.id),
+           p.doctor_id
+    FROM prescriptions p WHERE p.patient_id = ?
+    UNION ALL
+    SELECT 'lab_test', id, COALESCE(requested_at, ''), test_name, COALESCE(result, notes), status, cost, doctor_id
+    FROM lab_tests WHERE patient_id = ?
+    UNION ALL
+    SELECT 'bill', id, COALESCE(created_at, ''), 'Bill', NULL, CASE WHEN paid THEN 'paid' ELSE 'open' END,
+           total_amount, NULL
+    FROM bills WHERE patient_id = ?
+    UNION ALL
+    SELECT 'bill', id, COALESCE(created_at, ''), 'Bill', NULL, CASE WHEN paid THEN 'paid' ELSE 'open' END,
+           total_amount, NULL
+    FROM bills_archive WHERE patient_id = ?
+    ORDER BY at, kind, id
+'''
+_BRANCHES = EVENTS_SQL.count('?')
+
+
+def load(conn, patient_id):
+    """Read the patient's events from the database (no cache)."""
+    return [dict(row) for row in conn.execute(EVENTS_SQL, (patient_id,) * _BRANCHES)]
+
+
+class TimelineCache:
+    """patient id -> sorted event list, least recently viewed evicted first."""
+
+    def __init__(self, max_size=TIMELINE_CACHE_SIZE, ttl=TIMELINE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # patient id -> time.monotonic() of its last invalidation; older ones are
+        # forgotten into _horizon (a lower bound for any patient not listed)
+        self._dropped = OrderedDict()
+        self._horizon = 0.0
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'invalidations': 0}
+
+    def events(self, conn, patient_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(patient_id)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(patient_id)
+                    self._stats['hits'] += 1
+                    return entry[1]
+                self._stats['expired'] += 1
+            self._stats['misses'] += 1
+        # a GET's read-only connection reads from the snapshot it opened with
+        # (db.PooledConnection.opened); outside a transaction the read starts now
+        read_from = getattr(conn, 'opened', None) if conn.in_transaction else now
+        rows = load(conn, patient_id)
+        with self._lock:
+            if read_from is None or read_from <= self._dropped.get(patient_id, self._horizon):
+                return rows
+            self._entries[patient_id] = (now + self.ttl, rows)
+            self._entries.move_to_end(patient_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return rows
+
+    def invalidate(self, patient_id=None):
+        """Drop one patient's list (call after the write has committed), or all of them."""
+        now = time.monotonic()
+        with self._lock:
+            self._stats['invalidations'] += 1
+            if patient_id is None:
+                self._entries.clear()
+                self._dropped.clear()
+                self._horizon = now
+                return
+            patient_id = int(patient_id)
+            self._entries.pop(patient_id, None)
+            self._dropped[patient_id] = now
+            self._dropped.move_to_end(patient_id)
+            while len(self._dropped) > 4 * self.max_size:
+                _, dropped_at = self._dropped.popitem(last=False)
+                self._horizon = max(self._horizon, dropped_at)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['size'] = len(self._entries)
+            out['events'] = sum(len(entry[1]) for entry in self._entries.values())
+        return out
+
+
+TIMELINE = TimelineCache()
+
+
+def events(conn, patient_id):
+    return TIMELINE.events(conn, int(patient_id))
+
+
+def invalidate(patient_id=None):
+    TIMELINE.invalidate(patient_id)
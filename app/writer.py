@@ -0,0 +1,275 @@
+"""Single writer thread for the hot write paths (bookings, confirmations,
+treatments, prescriptions).
+
+SQLite allows one writer at a time. Instead of every request thread racing for
+the write lock (and waiting up to the 30s busy timeout at peak), routes hand a
+*write unit* to this thread and wait on a future:
+
+    run_write(lambda conn: conn.execute('UPDATE ...', params))
+    execute_write('UPDATE appointments SET status = ? WHERE id = ?', ('cancelled', aid))
+
+A unit is ``fn(conn, *args)``. It must not commit or roll back itself. The
+writer takes everything that is queued (up to ``max_batch`` units) and runs it
+in one ``BEGIN IMMEDIATE`` transaction, with each unit inside its own
+SAVEPOINT, so one failing unit does not undo the others. It then commits once
+(group commit). Futures resolve only after the COMMIT. Units' statements go to
+the same query listeners as the pooled connections (sql_metrics), attributed
+to the route that submitted the unit.
+
+Settings (app.config, defaulting to the environment):
+    DB_WRITER            HMS_DB_WRITER=0 runs units inline on the request's connection
+    DB_WRITER_BATCH      HMS_WRITER_BATCH, max units per transaction (default 64)
+    DB_WRITE_TIMEOUT     HMS_WRITE_TIMEOUT, seconds a request waits (default 10)
+
+A unit still queued after the timeout is withdrawn and run() raises
+WriteTimeout with ``committed=False``. A unit already running gets another
+timeout period; if it is still not done, WriteTimeout has ``committed=None``
+and the write may commit later. Routes flash the exception's message.
+"""
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from flask import current_app, has_request_context, request
+
+import db
+from sql_metrics import Histogram, enabled
+
+MAX_BATCH = int(os.environ.get('HMS_WRITER_BATCH', 64))
+WRITE_TIMEOUT = float(os.environ.get('HMS_WRITE_TIMEOUT', 10))
+
+
+class WriteTimeout(Exception):
+    """The unit did not finish within the writer timeout.
+
+    ``committed`` is False when the unit was withdrawn before it started (nothing
+    was written), None when it was already running and its outcome is unknown:
+    it may still commit after the request gave up.
+    """
+
+    def __init__(self, message, committed=None):
+        super().__init__(message)
+        self.committed = committed
+
+
+class _Unit:
+    __slots__ = ('fn', 'args', 'kwargs', 'future', 'queued_at', 'endpoint')
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+        # the route that submitted it, for the query listeners (sql_metrics)
+        self.endpoint = request.endpoint if has_request_context() else None
+
+
+class Writer:
+    """Owns one read/write connection and applies queued write units in batches."""
+
+    def __init__(self, database=db.DATABASE, max_batch=MAX_BATCH, timeout=WRITE_TIMEOUT, listeners=None):
+        self.database = database
+        self.max_batch = max_batch
+        self.timeout = timeout
+        # query listeners, shared with the read/write pool (db.add_query_listener)
+        self.listeners = listeners if listeners is not None else []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._queue = queue.Queue()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._stats = {'submitted': 0, 'committed': 0, 'failed': 0, 'cancelled': 0,
+                       'batches': 0, 'batch_failures': 0, 'max_queue_depth': 0}
+        self._commit_ms = Histogram()
+        self._wait_ms = Histogram()
+
+    def _ensure_started(self):
+        # a thread started before fork() does not exist in the child: start a new one
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name='hms-db-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn(conn, *args, **kwargs)``; returns a Future for its result."""
+        self._ensure_started()
+        unit = _Unit(fn, args, kwargs)
+        self._queue.put(unit)
+        with self._lock:
+            self._stats['submitted'] += 1
+            depth = self._queue.qsize()
+            if depth > self._stats['max_queue_depth']:
+                self._stats['max_queue_depth'] = depth
+        return unit.future
+
+    def run(self, fn, *args, **kwargs):
+        """Submit a unit and wait for it to be committed; re-raises the unit's exception."""
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            pass
+        # still queued: withdraw it, nothing has been written
+        if future.cancel():
+            raise WriteTimeout('The database is busy and nothing was saved. Please try again.', committed=False)
+        # already running: cancel() cannot stop it, so wait for its COMMIT or
+        # rollback (bounded by the busy timeout) before giving up on the outcome
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            raise WriteTimeout('The database is slow to confirm this change; it may still be saved. '
+                               'Check before trying again.', committed=None)
+
+    def stop(self, timeout=5):
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+
+    def _loop(self):
+        conn = db.connect(self.database)
+        # transactions are managed explicitly below
+        conn.isolation_level = None
+        try:
+            while True:
+                unit = self._queue.get()
+                if unit is None:
+                    return
+                batch = [unit]
+                stop = False
+                # group commit: take whatever else is already waiting
+                while len(batch) < self.max_batch:
+                    try:
+                        unit = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if unit is None:
+                        stop = True
+                        break
+                    batch.append(unit)
+                self._apply(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _apply(self, conn, batch):
+        units = [u for u in batch if u.future.set_running_or_notify_cancel()]
+        if len(units) < len(batch):
+            with self._lock:
+                self._stats['cancelled'] += len(batch) - len(units)
+        if not units:
+            return
+        outcomes = []
+        # units get a timed wrapper; the transaction control below is not recorded
+        timed = db.TimedConnection(conn, self.listeners)
+        start = time.perf_counter()
+        try:
+            conn.execute('BEGIN IMMEDIATE;')
+            for unit in units:
+                conn.execute('SAVEPOINT unit;')
+                timed.endpoint = unit.endpoint
+                try:
+                    result = unit.fn(timed, *unit.args, **unit.kwargs)
+                except Exception as ex:
+                    conn.execute('ROLLBACK TO unit;')
+                    conn.execute('RELEASE unit;')
+                    outcomes.append((unit, None, ex))
+                    continue
+                conn.execute('RELEASE unit;')
+                outcomes.append((unit, result, None))
+            conn.execute('COMMIT;')
+        except Exception as ex:
+            # BEGIN or COMMIT failed (or a unit broke the transaction): nothing was written
+            if conn.in_transaction:
+                try:
+                    conn.execute('ROLLBACK;')
+                except sqlite3.Error:
+                    pass
+            with self._lock:
+                self._stats['batch_failures'] += 1
+                self._stats['failed'] += len(units)
+            for unit in units:
+                unit.future.set_exception(ex)
+            timed.flush()
+            return
+        now = time.perf_counter()
+        with self._lock:
+            self._stats['batches'] += 1
+            self._commit_ms.observe((now - start) * 1000, len(units))
+            for unit, _, ex in outcomes:
+                self._stats['failed' if ex else 'committed'] += 1
+                self._wait_ms.observe((now - unit.queued_at) * 1000, 1)
+        for unit, result, ex in outcomes:
+            if ex is not None:
+                unit.future.set_exception(ex)
+            else:
+                unit.future.set_result(result)
+        # after the futures: a slow-query EXPLAIN must not hold up the routes
+        timed.flush()
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['queue_depth'] = self._queue.qsize()
+            out['avg_batch'] = round(self._commit_ms.rows / self._commit_ms.count, 2) if self._commit_ms.count else 0
+            out['commit_ms'] = self._commit_ms.to_dict()
+            out['wait_ms'] = self._wait_ms.to_dict()
+        return out
+
+
+def init_app(app):
+    """Create the app's writer (started lazily on the first write) unless DB_WRITER is off."""
+    if not enabled(app.config.get('DB_WRITER', os.environ.get('HMS_DB_WRITER', '1'))):
+        return None
+    writer = Writer(
+        app.config.get('DATABASE', db.DATABASE),
+        max_batch=int(app.config.get('DB_WRITER_BATCH', MAX_BATCH)),
+        timeout=float(app.config.get('DB_WRITE_TIMEOUT', WRITE_TIMEOUT)),
+        listeners=db.get_pool(app).listeners,
+    )
+    app.extensions['hms_writer'] = writer
+    return writer
+
+
+def get_writer(app=None):
+    return (app or current_app).extensions.get('hms_writer')
+
+
+def run_write(fn, *args, **kwargs):
+    """Apply a write unit through the writer thread (or inline when it is disabled)."""
+    writer = get_writer()
+    if writer is not None:
+        return writer.run(fn, *args, **kwargs)
+    conn = db.get_db(readonly=False)
+    try:
+        result = fn(conn, *args, **kwargs)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return result
+
+
+def _execute(conn, sql, params):
+    return conn.execute(sql, params).rowcount
+
+
+def execute_write(sql, params=()):
+    """Single-statement write unit; returns the number of rows changed."""
+    return run_write(_execute, sql, params)